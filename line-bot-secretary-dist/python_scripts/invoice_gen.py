@@ -1,8 +1,19 @@
 import os
+import math
 import asyncio
 import re
 from datetime import datetime, timedelta
 import subprocess
+import sys
+
+# 行のまとめ方と明細行の正規化は、請求書作成/App_Core の ocr_layout.py・receipt_normalizer.py
+# （と receipt_rules.json）をそのまま使う（このフォルダにコピーは置かない）。
+# App_Core を別の場所に置いたときは、環境変数 INVOICE_APP_CORE にそのフォルダを指定してください
+APP_CORE_DIR = os.environ.get("INVOICE_APP_CORE") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "請求書作成", "App_Core")
+sys.path.insert(0, APP_CORE_DIR)
+import ocr_layout  # numpy が必要
+import receipt_normalizer
 
 from winsdk.windows.media.ocr import OcrEngine
 from winsdk.windows.graphics.imaging import BitmapDecoder
@@ -51,6 +62,9 @@ OUT_DIR = os.path.join(BASE_DIR, "invoice_out")
 TEMPLATE_PATH = os.path.join(SCRIPT_DIR, "テンプレート.html")
 SEAL_PATH = os.path.join(SCRIPT_DIR, "seal_b64.txt")
 
+# 上の KEYWORD_LIST と receipt_rules.json の表記ゆれ修正から、商品行の判定器を作っておく
+NORMALIZER = receipt_normalizer.load(keywords=KEYWORD_LIST)
+
 # Edgeブラウザのパス（HTMLからPDFへの変換に使用します）
 edge_exe = r"C:\Program Files (x86)\Microsoft\Edge\Application\msedge.exe"
 if not os.path.exists(edge_exe):
@@ -191,28 +205,14 @@ async def run_ocr_on_all():
                 today = datetime(y, m, d)
             deadline = today + timedelta(days=7) # 支払い期限は7日後に設定
 
-            # 単語と座標を取得してソート
-            words_info = []
-            for line in result.lines:
-                for word in line.words:
-                    words_info.append((word.bounding_rect.y, word.bounding_rect.x, word.text))
-            words_info.sort(key=lambda w: w[0])
-            
-            # 同じ行（Y座標が近いもの）をまとめる
-            rows = []
-            current_row = []
-            last_y = -100
-            for y, x, text in words_info:
-                if abs(y - last_y) > 15 and current_row:
-                    current_row.sort(key=lambda w: w[1])
-                    rows.append(" ".join([w[2] for w in current_row]))
-                    current_row = []
-                current_row.append((y, x, text))
-                if len(current_row) == 1:
-                    last_y = y
-            if current_row:
-                current_row.sort(key=lambda w: w[1])
-                rows.append(" ".join([w[2] for w in current_row]))
+            # 単語と座標を取得して、同じ行のものをまとめる（傾き補正つき。ocr_layout.py）
+            texts, boxes = ocr_layout.rect_words([
+                (word.text, word.bounding_rect.x, word.bounding_rect.y, word.bounding_rect.width, word.bounding_rect.height)
+                for line in result.lines for word in line.words
+            ])
+            # Windows OCR の枠は水平な矩形なので、傾きはエンジンが返す角度を使う
+            skew = math.radians(result.text_angle) if result.text_angle is not None else None
+            rows = ocr_layout.rows_text(texts, ocr_layout.cluster_lines(boxes, skew))
                 
             # 合計金額の特定
             target_subtotal = 0
@@ -232,24 +232,10 @@ async def run_ocr_on_all():
             # 明細の抽出
             items = []
             for row in rows:
-                k = row.lower()
-                # 商品名のキーワードが含まれているか判定
-                if any(keyword in k for keyword in KEYWORD_LIST):
-                    name_clean = row
-                    
-                    # 機種依存文字や表記ゆれの修正
-                    name_clean = re.sub(r'\bPhone\b', 'iPhone', name_clean, flags=re.I)
-                    name_clean = re.sub(r'(?<!SI)M FREE', 'SIM FREE', name_clean, flags=re.I)
-                    name_clean = re.sub(r'\bnstax\b', 'instax', name_clean, flags=re.I)
-                    name_clean = re.sub(r'PIayStation', 'PlayStation', name_clean, flags=re.I)
-                    name_clean = re.sub(r'SIi\s*m|Sli\s*m', 'Slim', name_clean, flags=re.I)
-                    name_clean = re.sub(r'F\s*ト|CF\s*ト', 'CFI-', name_clean, flags=re.I)
-                    name_clean = re.sub(r'Ni\s*ntendo|Nintend0', 'Nintendo', name_clean, flags=re.I)
-                    name_clean = name_clean.replace('  ', ' ')
-                    
-                    row_clean = re.sub(r'\b\d{13}\b', '', name_clean)
-                    row_clean = re.sub(r'\s*,\s*', ',', row_clean)
-                    row_clean = re.sub(r'\s+([¥円])', r'\1', row_clean)
+                # 商品名のキーワードが含まれている行だけを、表記ゆれを直して取り出す（receipt_normalizer.py）
+                normalized = NORMALIZER.normalize_row(row)
+                if normalized is not None:
+                    name_clean, row_clean = normalized
                     
                     prices_str = re.findall(r'\b\d{1,3}(?:,\d{3})+\b', row_clean)
                     
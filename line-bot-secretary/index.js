@@ -64,14 +64,23 @@ async function sendMsg(channel, text, replyMsg = null) {
     return channel.send(opts).catch(e => console.error('sendMsg error:', e));
 }
 
-async function sendPdf(channel, pdfPath, label, replyMsg = null) {
+// Python 側が --preview で出力した1ページ目のプレビュー画像のパス（無ければ null）
+function previewFrom(stdout) {
+    const m = stdout.match(/___PREVIEW_GENERATED___:(.+)/);
+    const previewPath = m ? m[1].trim() : null;
+    return previewPath && fs.existsSync(previewPath) ? previewPath : null;
+}
+
+async function sendPdf(channel, pdfPath, label, replyMsg = null, previewPath = null) {
     const filename = path.basename(pdfPath);
     console.log(`PDF送信開始: ${pdfPath} exists=${fs.existsSync(pdfPath)}`);
-    // 作成依頼チャンネルに送信
+    // 作成依頼チャンネルに送信（プレビュー画像があれば先に並べて、PDFを開かなくても確認できるようにする）
     try {
+        const files = [new AttachmentBuilder(pdfPath, { name: filename })];
+        if (previewPath) files.unshift(new AttachmentBuilder(previewPath, { name: path.basename(previewPath) }));
         const opts = {
             content: `📄 ${label}`,
-            files: [new AttachmentBuilder(pdfPath, { name: filename })]
+            files
         };
         if (replyMsg) opts.reply = { messageReference: replyMsg.id, failIfNotExists: false };
         await channel.send(opts);
@@ -267,17 +276,19 @@ client.on('messageCreate', async (message) => {
             userStates[userId].state = 'processing';
             await sendMsg(channel, '【システム】承知しました！PDFを作成しています...⏳');
 
+            // 同じ画像の確認が二重に届いても請求書を重複作成しないよう、元メッセージと画像で冪等キーを作る
+            const idempotencyKey = st.originalMsg?.id ? `${docType}:${st.originalMsg.id}:${st.attachmentUrl}` : undefined;
             let scriptPath, scriptArgs;
             if (docType === 'payment') {
                 scriptPath = path.join(workDir, 'payment_notice.py');
-                scriptArgs = ['--payment-json', JSON.stringify({ destType: paymentDestType, destName: paymentDestName, items: invoiceData.items })];
+                scriptArgs = ['--payment-json', JSON.stringify({ destType: paymentDestType, destName: paymentDestName, items: invoiceData.items, idempotencyKey }), '--preview'];
             } else {
                 // batch_gen.py には deadline が必須（OCRフローはデフォルト1週間後）
                 const deadline = new Date();
                 deadline.setDate(deadline.getDate() + 7);
-                const invoicePayload = { ...invoiceData, deadline: deadline.toISOString() };
+                const invoicePayload = { ...invoiceData, deadline: deadline.toISOString(), idempotencyKey };
                 scriptPath = path.join(workDir, 'batch_gen.py');
-                scriptArgs = ['--generate-from-json', JSON.stringify(invoicePayload)];
+                scriptArgs = ['--generate-from-json', JSON.stringify(invoicePayload), '--preview'];
             }
 
             try {
@@ -286,7 +297,7 @@ client.on('messageCreate', async (message) => {
                 if (!pdfMatch) throw new Error('PDFパスが見つかりません\n' + stdout);
                 const pdfPath = pdfMatch[1].trim();
                 const completedLabel = docType === 'payment' ? '支払い通知書' : '請求書';
-                await sendPdf(channel, pdfPath, `${completedLabel}：${path.basename(pdfPath)}`, st.originalMsg);
+                await sendPdf(channel, pdfPath, `${completedLabel}：${path.basename(pdfPath)}`, st.originalMsg, previewFrom(stdout));
                 await sendMsg(channel, `✅ ${completedLabel}が完成しました！`);
                 finishAndProcessNext(userId);
             } catch (e) {
@@ -383,11 +394,11 @@ client.on('messageCreate', async (message) => {
             await sendMsg(channel, '【システム】承知しました！請求書を作成しています...⏳');
             const payload = JSON.stringify({ dest: st.manualDest, items: st.manualItems, taxType: st.manualTaxType, deadlineType: userMessage });
             try {
-                const stdout = await runPython(path.join(workDir, 'manual_invoice.py'), ['--items-json', payload], workDir);
+                const stdout = await runPython(path.join(workDir, 'manual_invoice.py'), ['--items-json', payload, '--preview'], workDir);
                 const pdfMatch = stdout.match(/___PDF_GENERATED___:(.+)/);
                 if (!pdfMatch) throw new Error('PDFパスが見つかりません');
                 const pdfPath = pdfMatch[1].trim();
-                await sendPdf(channel, pdfPath, `請求書：${path.basename(pdfPath)}`);
+                await sendPdf(channel, pdfPath, `請求書：${path.basename(pdfPath)}`, null, previewFrom(stdout));
                 await sendMsg(channel, `✅ ${st.manualDest}御中の請求書が完成しました！`);
                 delete userStates[userId];
             } catch (e) {
@@ -1,10 +1,17 @@
 import asyncio
 import os
 import re
+import sys
 from winsdk.windows.media.ocr import OcrEngine
 from winsdk.windows.graphics.imaging import BitmapDecoder
 from winsdk.windows.storage import StorageFile
 
+# App_Core の receipt_normalizer を使う
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import receipt_normalizer
+
+NORMALIZER = receipt_normalizer.load()
+
 IN_DIR = r"C:\Users\Owner\OneDrive\デスクトップ\deveropment\請求書作成\請求書作成依頼"
 
 async def test_all():
@@ -41,8 +48,7 @@ async def test_all():
             rows.append(" ".join([w[2] for w in current_row]))
             
         for row in rows:
-            k = row.lower()
-            if 'iphone' in k or 'apple' in k or 'sim' in k or '未開封' in k or 'playstation' in k or 'switch' in k or 'instax' in k or 'コントローラー' in k or 'チェキ' in k or 'phone' in k or 'stax' in k:
+            if NORMALIZER.keyword(NORMALIZER.normalize(row)) is not None:
                 print("RAW ROW:", row)
                 row_clean = re.sub(r'[^\w\s・/()\[\]】]', ' ', row).strip()
                 print("  CLEAN:", row_clean)
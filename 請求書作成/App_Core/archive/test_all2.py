@@ -1,10 +1,17 @@
 import asyncio
 import os
 import re
+import sys
 from winsdk.windows.media.ocr import OcrEngine
 from winsdk.windows.graphics.imaging import BitmapDecoder
 from winsdk.windows.storage import StorageFile
 
+# App_Core の receipt_normalizer を使う
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import receipt_normalizer
+
+NORMALIZER = receipt_normalizer.load()
+
 IN_DIR = r"C:\Users\Owner\OneDrive\デスクトップ\deveropment\請求書作成\請求書作成依頼"
 
 async def test_all2():
@@ -41,18 +48,9 @@ async def test_all2():
             rows.append(" ".join([w[2] for w in current_row]))
             
         for row in rows:
-            k = row.lower()
-            if 'iphone' in k or 'apple' in k or 'sim' in k or '未開封' in k or 'playstation' in k or 'piaystation' in k or 'station' in k or 'switch' in k or 'instax' in k or 'コントローラー' in k or 'チェキ' in k or 'phone' in k or 'stax' in k:
-                name_clean = row
-                name_clean = re.sub(r'\bPhone\b', 'iPhone', name_clean, flags=re.I)
-                name_clean = re.sub(r'(?<!SI)M FREE', 'SIM FREE', name_clean, flags=re.I)
-                name_clean = re.sub(r'\bnstax\b', 'instax', name_clean, flags=re.I)
-                name_clean = re.sub(r'\bPIayStation\b', 'PlayStation', name_clean, flags=re.I)
-                name_clean = name_clean.replace('  ', ' ')
-                
-                row_clean = re.sub(r'\b\d{13}\b', '', name_clean)
-                row_clean = re.sub(r'\s*,\s*', ',', row_clean)
-                row_clean = re.sub(r'\s+([¥円])', r'\1', row_clean)
+            normalized = NORMALIZER.normalize_row(row)
+            if normalized is not None:
+                name_clean, row_clean = normalized
                 
                 prices_str = re.findall(r'\b\d{1,3}(?:,\d{3})+\b', row_clean)
                 
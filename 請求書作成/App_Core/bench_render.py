@@ -0,0 +1,225 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# 請求書作成の処理時間を段階ごとに測るベンチマーク。
+# 各ジェネレーター（batch_gen / manual_invoice / payment_notice / pick_invoice）に、毎回同じ
+# 合成データを件数（既定 1, 10, 100）× 並列数（既定 1, 2, 4）の組み合わせで流し、
+# perf.py が集めた段階ごと（テンプレート差し込み・ブラウザ起動・ページ読み込み・フォント待ち・
+# PDF印刷・ファイル書き込みなど）の p50 / p95 / max を表にして JSON に保存する。
+#
+#   python bench_render.py [--engine native] [--counts 1,10] [--jobs 1,4] [--generators manual_invoice]
+#   python bench_render.py --compare bench_<前のコミット>.json
+#
+# 出力先は一時フォルダ（INVOICE_OUT_DIR）で、キャッシュは使わない。本番の連番・台帳には触らない。
+# ブラウザ起動も測るため、組み合わせごとにレンダープールを作り直す。
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+GENERATORS = ('batch_gen', 'manual_invoice', 'payment_notice', 'pick_invoice')
+STAGES = ('template_fill', 'font_subset', 'browser_launch', 'page_open', 'page_load', 'font_ready', 'pdf_print',
+          'native_draw', 'file_write', 'optimize', 'total')
+
+PRODUCTS = ['配送料', '梱包資材', 'ピック作業', '保管料', '検品作業', 'チャーター便 東京→大阪', '返品処理手数料']
+DESTINATIONS = ['株式会社ベンチ商事', '株式会社りんご', '有限会社テスト運輸', '合同会社サンプル']
+# 10件に1件は明細書モード（複数ページ）になる行数にする
+STATEMENT_ROWS = 40
+
+
+def synthetic_items(i):
+    """i 番目の文書の明細。同じ i なら毎回同じ内容"""
+    rng = random.Random(i)
+    rows = STATEMENT_ROWS if i % 10 == 9 else rng.randint(1, 6)
+    items = []
+    for r in range(rows):
+        unit = rng.choice([800, 1200, 2500, 3800, 12000])
+        qty = rng.randint(1, 20)
+        items.append({'name': f"{rng.choice(PRODUCTS)} {r + 1}", 'unit': unit, 'qty': qty, 'total': unit * qty})
+    return items
+
+
+def load_generators():
+    """{名前: 関数(i)}。INVOICE_OUT_DIR などを設定してから読み込む"""
+    import batch_gen
+    import manual_invoice
+    import payment_notice
+    import pick_invoice
+
+    def run_batch_gen(i):
+        return batch_gen.generate_pdf({'today': '2026-02-18', 'deadline': '2026-02-25', 'items': synthetic_items(i)})
+
+    def run_manual_invoice(i):
+        return manual_invoice.create_invoice(DESTINATIONS[i % len(DESTINATIONS)], synthetic_items(i), '1', '1')['path']
+
+    def run_payment_notice(i):
+        dest_type = 'chinajun' if i % 2 else 'other'
+        return payment_notice.generate_pdf(dest_type, DESTINATIONS[i % len(DESTINATIONS)], synthetic_items(i))
+
+    def run_pick_invoice(i):
+        names = list(pick_invoice.PICK_DESTINATIONS.values())
+        return pick_invoice.generate_pdf(names[i % len(names)], random.Random(i).randint(1, 300), '2026/02/18')
+
+    return {
+        'batch_gen': run_batch_gen,
+        'manual_invoice': run_manual_invoice,
+        'payment_notice': run_payment_notice,
+        'pick_invoice': run_pick_invoice,
+    }
+
+
+def run_scenario(fn, count, jobs):
+    """fn を count 件 jobs 並列で実行して (経過秒, 失敗数) を返す"""
+    import perf
+
+    def one(i):
+        with perf.stage('total'):
+            fn(i)
+
+    errors = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=jobs) as ex:
+        for fut in as_completed([ex.submit(one, i) for i in range(count)]):
+            try:
+                fut.result()
+            except Exception as e:
+                errors += 1
+                print(f"[WARN] {e}", file=sys.stderr)
+    return time.perf_counter() - started, errors
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPT_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def scenario_key(s):
+    return (s['generator'], s['engine'], s['count'], s['jobs'])
+
+
+def print_scenario(s):
+    stages = s['stages']
+    total = stages.get('total', {})
+    parts = [f"{name} {stages[name]['p50']:.0f}/{stages[name]['p95']:.0f}"
+             for name in STAGES if name in stages and name != 'total']
+    print(f"{s['generator']:<15} n={s['count']:<4} jobs={s['jobs']:<2} "
+          f"{s['docs_per_sec']:7.2f} docs/s  total p50 {total.get('p50', 0):.0f} p95 {total.get('p95', 0):.0f} "
+          f"max {total.get('max', 0):.0f} ms  |  " + "  ".join(parts))
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {scenario_key(s): s for s in json.load(f)['scenarios']}
+    print(f"\n--- compared with {os.path.basename(baseline_path)} (total p50 / p95, ms) ---")
+    for s in results:
+        old = baseline.get(scenario_key(s))
+        if old is None or 'total' not in old['stages'] or 'total' not in s['stages']:
+            continue
+        cells = []
+        for p in ('p50', 'p95'):
+            before, after = old['stages']['total'][p], s['stages']['total'][p]
+            change = (after - before) * 100 / before if before else 0
+            cells.append(f"{p} {before:.0f} -> {after:.0f} ({change:+.0f}%)")
+        print(f"{s['generator']:<15} n={s['count']:<4} jobs={s['jobs']:<2} " + "  ".join(cells))
+
+
+def int_list(value):
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--generators", default=','.join(GENERATORS), help="comma separated generator names")
+    parser.add_argument("--counts", type=int_list, default=[1, 10, 100], help="documents per run, e.g. 1,10,100")
+    parser.add_argument("--jobs", type=int_list, default=[1, 2, 4], help="concurrency levels, e.g. 1,2,4")
+    parser.add_argument("--engine", choices=('chromium', 'native', 'hot'), default='chromium')
+    parser.add_argument("--output", help="result JSON (default: bench_<commit>_<time>.json)")
+    parser.add_argument("--compare", help="earlier result JSON to compare against")
+    parser.add_argument("--keep", action="store_true", help="keep the generated PDFs")
+    parser.add_argument("--verbose", action="store_true", help="show the generators' own output")
+    args = parser.parse_args()
+
+    names = [g.strip() for g in args.generators.split(',') if g.strip()]
+    unknown = [g for g in names if g not in GENERATORS]
+    if unknown:
+        parser.error(f"unknown generator: {', '.join(unknown)}")
+
+    # ジェネレーターを読み込む前に、出力先・キャッシュ・計測の設定を済ませる
+    out_dir = tempfile.mkdtemp(prefix="invoice_bench_")
+    os.environ["INVOICE_OUT_DIR"] = out_dir
+    os.environ["PDF_CACHE"] = "0"
+    os.environ["INVOICE_PERF"] = "1"
+    import perf
+    import documents
+    import render_service
+    documents.DEFAULT_ENGINE = args.engine
+    generators = load_generators()
+    default_pool = render_service.POOL_SIZE
+
+    commit = git_commit()
+    scenarios = []
+    try:
+        for name in names:
+            for count in args.counts:
+                for jobs in args.jobs:
+                    render_service.close_pool()
+                    render_service.POOL_SIZE = max(default_pool, jobs)
+                    perf.reset()
+                    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+                    with quiet:
+                        elapsed, errors = run_scenario(generators[name], count, jobs)
+                    pool = render_service._pool
+                    s = {
+                        'generator': name,
+                        'engine': args.engine,
+                        'count': count,
+                        'jobs': jobs,
+                        'elapsed_sec': round(elapsed, 3),
+                        'docs_per_sec': round(count / elapsed, 2) if elapsed else None,
+                        'errors': errors,
+                        'peak_mb': round(pool.peak_mb) if pool is not None and pool.peak_mb is not None else None,
+                        'stages': perf.summarize(perf.reset()),
+                    }
+                    scenarios.append(s)
+                    print_scenario(s)
+    finally:
+        render_service.close_pool()
+        if args.keep:
+            print(f"PDFs kept in {out_dir}")
+        else:
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+    now = datetime.now()
+    output = args.output or f"bench_{commit or 'nocommit'}_{now.strftime('%Y%m%d_%H%M%S')}.json"
+    result = {
+        'commit': commit,
+        'created': now.isoformat(timespec='seconds'),
+        'engine': args.engine,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'scenarios': scenarios,
+    }
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"results: {output}")
+    if args.compare:
+        compare(scenarios, args.compare)
+    if any(s['errors'] for s in scenarios):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
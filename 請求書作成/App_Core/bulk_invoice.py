@@ -0,0 +1,132 @@
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import documents
+import render_service
+from manual_invoice import create_invoice
+
+# 月末などにまとめて請求書を作るためのコマンド。1プロセスで全件を読み込み、
+# 共有のレンダープール（render_service）のページを使い回して並列に描画する。
+#
+# 入力ファイル:
+#   .jsonl / .json … 1行に1件 {"dest", "items": [{"name","unit","qty"}], "taxType", "deadlineType", "idempotencyKey"}
+#                    （.json は同じ形式の配列でもよい）
+#   .csv           … 1行に明細1行。列: dest, name, unit, qty, taxType, deadlineType, invoice（任意）
+#                    invoice 列が同じ行（無ければ dest・taxType・deadlineType が同じ連続した行）を1件の請求書にまとめる
+#
+# 使い方: python bulk_invoice.py invoices.csv [--jobs 4] [--manifest out.json] [--engine native]
+# 作成したファイル・請求No・合計を manifest（JSON）に書き出し、___MANIFEST_GENERATED___:パス を出力する。
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(SCRIPT_DIR)
+OUT_DIR = os.environ.get("INVOICE_OUT_DIR") or os.path.join(BASE_DIR, "作成済み請求書")
+
+
+def read_jsonl(path):
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        text = f.read()
+    if text.lstrip().startswith('['):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def read_csv(path):
+    invoices = []
+    current_key = None
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        for row in csv.DictReader(f):
+            row = {k.strip(): (v or '').strip() for k, v in row.items() if k}
+            if not row.get('dest'):
+                continue
+            tax_type = row.get('taxType') or '1'
+            deadline_type = row.get('deadlineType') or '1'
+            key = row.get('invoice') or (row['dest'], tax_type, deadline_type)
+            if key != current_key:
+                invoices.append({'dest': row['dest'], 'items': [], 'taxType': tax_type, 'deadlineType': deadline_type})
+                current_key = key
+            invoices[-1]['items'].append({'name': row.get('name', ''), 'unit': row.get('unit') or 0,
+                                          'qty': row.get('qty') or 1})
+    return invoices
+
+
+def read_invoices(path):
+    if path.lower().endswith('.csv'):
+        return read_csv(path)
+    return read_jsonl(path)
+
+
+def _create(index, payload):
+    doc = create_invoice(payload['dest'], payload['items'], str(payload.get('taxType', '1')),
+                         str(payload.get('deadlineType', '1')), payload.get('idempotencyKey'))
+    return {'index': index, 'dest': payload['dest'], 'number': doc['number'],
+            'total': doc['total'], 'path': doc['path'], 'status': 'ok'}
+
+
+def run_bulk(invoices, jobs=render_service.POOL_SIZE):
+    """
+    全件を jobs 並列で作成し、入力順の結果リストを返す。失敗した件は status='error' で残す
+    """
+    results = [None] * len(invoices)
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as ex:
+        futures = {ex.submit(_create, i, inv): i for i, inv in enumerate(invoices)}
+        for fut in as_completed(futures):
+            i = futures[fut]
+            try:
+                results[i] = fut.result()
+                print(f"[{i + 1}/{len(invoices)}] {results[i]['number']} {results[i]['dest']}")
+            except Exception as e:
+                results[i] = {'index': i, 'dest': invoices[i].get('dest'), 'status': 'error', 'error': str(e)}
+                print(f"[WARN] invoice {i + 1} ({invoices[i].get('dest')}) failed: {e}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", help="CSV or JSON-lines file of invoices")
+    parser.add_argument("--jobs", type=int, default=render_service.POOL_SIZE, help="number of invoices rendered at once")
+    parser.add_argument("--manifest", help="path of the summary JSON (default: 作成済み請求書/<date>/bulk_<time>.json)")
+    parser.add_argument("--engine", choices=documents.ENGINES, help="PDF engine (default: chromium, or INVOICE_PDF_ENGINE)")
+    args = parser.parse_args()
+    if args.engine:
+        documents.DEFAULT_ENGINE = args.engine
+
+    try:
+        invoices = read_invoices(args.input)
+    except Exception as e:
+        print(f"エラー: 入力ファイルを読めませんでした: {e}", file=sys.stderr)
+        sys.exit(1)
+    if not invoices:
+        print("エラー: 請求書のデータがありません。", file=sys.stderr)
+        sys.exit(1)
+
+    # レンダープールは並列数に合わせて作る（get_pool() より先に決める必要がある）
+    render_service.POOL_SIZE = max(render_service.POOL_SIZE, args.jobs)
+
+    started = time.perf_counter()
+    results = run_bulk(invoices, args.jobs)
+    elapsed = time.perf_counter() - started
+
+    now = datetime.now()
+    manifest_path = args.manifest or os.path.join(OUT_DIR, now.strftime('%Y-%m-%d'), f"bulk_{now.strftime('%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(manifest_path)), exist_ok=True)
+    ok = [r for r in results if r['status'] == 'ok']
+    manifest = {
+        'source': os.path.abspath(args.input),
+        'created': now.isoformat(timespec='seconds'),
+        'count': len(ok),
+        'failed': len(results) - len(ok),
+        'grand_total': sum(r['total'] for r in ok),
+        'elapsed_sec': round(elapsed, 2),
+        'invoices': results,
+    }
+    render_service.atomic_write(manifest_path, json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8'))
+    print(f"{len(ok)}/{len(results)} invoices in {elapsed:.1f}s")
+    print(f"___MANIFEST_GENERATED___:{manifest_path}")
+    if len(ok) != len(results):
+        sys.exit(1)
@@ -0,0 +1,340 @@
+import os
+import sys
+from datetime import datetime
+
+import ledger
+import pdf_cache
+import pdf_optimize
+import perf
+import sequence_store
+from template_engine import (load_template, invoice_rows_html, payment_rows_html, SEAL_PATH,
+                             estimate_lines, paginate, statement_rows_html)
+
+# 請求書・お支払い通知書の共通描画処理。
+# 各 generate_pdf は連番やファイル名を決めたあと、内容を doc（dict）にまとめて render_document() に渡す。
+#
+# doc の中身:
+#   kind:        'invoice' / 'payment_notice'
+#   layout:      'standard'（テンプレート.html）/ 'chinajun'（chinajun_template.html）
+#   compact:     テンプレート.html をコンパクト表示にするか（batch_gen / pick_invoice）
+#   row_style:   'invoice' / 'payment'（お支払い通知書形式の明細行）
+#   series:      連番の系列（'' / 'M' / 'P' / 'pick' など。キャッシュのキーを分けるのに使う）
+#   number:      請求 No / お支払い No（render_once では採番後に入る）
+#   recipient:   宛先（None ならテンプレートの宛先のまま）
+#   issue_date:  請求日・作成日 'YYYY-MM-DD'
+#   due_date:    お支払い期限・お支払い日 'YYYY-MM-DD'
+#   show_dates:  False ならテンプレートに書かれた日付のまま（支払い通知書をテンプレート.html で出す場合）
+#   items:       [{'name', 'unit', 'qty', 'total'}, ...]
+#   total:       合計（税込）
+#   tax_excl:    税抜（chinajun のみ）
+#   tax_type:    税区分（manual_invoice の '1' = 税込 / '2' = 税抜。台帳に記録するだけ）
+#   statement:   True なら明細書モード（複数ページ）。None / 省略時は明細が1ページに収まらないときだけ
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_PATH = os.path.join(SCRIPT_DIR, "テンプレート.html")
+CHINAJUN_TMPL = os.path.join(SCRIPT_DIR, "chinajun_template.html")
+REGISTRATION_NO = 'T4120001206506'
+
+# テンプレート.html の明細書モードの行数（明細1行の高さ = 1.0）。
+#   first / page: 1ページ目 / 2ページ目以降の明細欄に入る行数（繰越行を含む）
+#   reserve: 最終ページで合計欄・フッターのために空ける行数
+#            （first - reserve 行を超える明細は1ページに収まらないので明細書モードにする）
+#   name_px / font_px / line: 品名の列幅・文字サイズ・折り返し1行分の高さ（折り返し行数の見積もり用）
+STATEMENT_LAYOUT = {
+    False: {'first': 15, 'page': 20, 'reserve': 6, 'name_px': 310, 'font_px': 13, 'line': 0.45},
+    True: {'first': 21, 'page': 28, 'reserve': 8, 'name_px': 356, 'font_px': 11, 'line': 0.5},
+}
+
+# 'chromium'（既定）、'native'（ブラウザを使わず reportlab で直接描画）、
+# 'hot'（テンプレートを読み込んだままのページで、変わった枠だけを差し替えて印刷する）
+ENGINES = ('chromium', 'native', 'hot')
+DEFAULT_ENGINE = os.environ.get("INVOICE_PDF_ENGINE", "chromium")
+# --idempotency-key で渡された値（render_once の既定値）
+DEFAULT_IDEMPOTENCY_KEY = None
+# --preview: PDF と一緒に1ページ目のプレビュー画像を作る（INVOICE_PREVIEW=1 でも可）
+DEFAULT_PREVIEW = os.environ.get("INVOICE_PREVIEW", "0") == "1"
+
+
+def preview_path_for(out_pdf_path):
+    # Pillow があれば小さい WebP、無ければ PNG
+    from render_service import Image
+    ext = '.webp' if Image is not None else '.png'
+    return os.path.splitext(out_pdf_path)[0] + ext
+
+
+def jp_date(iso_date):
+    return datetime.fromisoformat(iso_date).strftime('%Y年%m月%d日')
+
+
+def template_for(doc):
+    if doc['layout'] == 'chinajun':
+        return load_template(CHINAJUN_TMPL)
+    return load_template(TEMPLATE_PATH, compact=doc.get('compact', False))
+
+
+def is_statement(doc):
+    if doc['layout'] == 'chinajun':
+        return False
+    if doc.get('statement') is not None:
+        return bool(doc['statement'])
+    layout = STATEMENT_LAYOUT[bool(doc.get('compact'))]
+    return len(doc['items']) > layout['first'] - layout['reserve']
+
+
+def statement_caption(doc, tmpl):
+    recipient = doc.get('recipient')
+    if recipient is None:
+        recipient = tmpl.default_text('recipient')
+    return lambda page_no: f"請求 No : {doc['number']}　{recipient} 御中　（{page_no}頁）"
+
+
+def statement_item_rows(doc, tmpl):
+    layout = STATEMENT_LAYOUT[bool(doc.get('compact'))]
+    # 品名が折り返すと行が高くなるので、その分を行数に足してページを分ける
+    weights = [1 + (estimate_lines(it.get('name', ''), layout['font_px'], layout['name_px']) - 1) * layout['line']
+               for it in doc['items']]
+    # 途中のページは繰越行（1ページ目は下に1行、以降は上下に2行）の分を引く。最終ページに下の繰越行は無い
+    pages = paginate(weights, layout['first'] - 1, layout['page'] - 2, layout['reserve'] - 1)
+    thead = tmpl.fragment(r'<thead>.*?</thead>')
+    return statement_rows_html(doc['items'], pages, thead, statement_caption(doc, tmpl), doc.get('row_style', 'invoice'))
+
+
+def build_html(doc):
+    tmpl = template_for(doc)
+    return tmpl.fill(**html_values(doc, tmpl))
+
+
+def html_values(doc, tmpl):
+    """doc からテンプレートの各枠に入れる値を作る"""
+    if doc['layout'] == 'chinajun':
+        return dict(
+            recipient_name=doc['recipient'],
+            payment_no=doc['number'],
+            created_date=jp_date(doc['issue_date']),
+            payment_date=jp_date(doc['due_date']),
+            payment_total=f"{doc['total']:,}",
+            invoice_no=REGISTRATION_NO,
+            item_rows=payment_rows_html(doc['items']),
+            subtotal=f"¥{doc['total']:,}",
+            tax_excl=f"¥{doc['tax_excl']:,}",
+            grand_total=f"¥{doc['total']:,}",
+        )
+
+    values = {
+        'invoice_no': doc['number'],
+        'total': f"{doc['total']:,}",
+    }
+    if is_statement(doc):
+        values['item_rows'] = statement_item_rows(doc, tmpl)
+    elif doc.get('row_style') == 'payment':
+        values['item_rows'] = payment_rows_html(doc['items'])
+    else:
+        values['item_rows'] = invoice_rows_html(doc['items'])
+    if doc.get('recipient') is not None:
+        values['recipient'] = doc['recipient']
+    if doc.get('show_dates', True):
+        values['issue_date'] = jp_date(doc['issue_date'])
+        values['deadline'] = jp_date(doc['due_date'])
+    return values
+
+
+def render_document(doc, out_pdf_path, engine=None, preview_path=None):
+    """
+    doc を PDF にして out_pdf_path に書き出し、pdf_optimize で小さくする。
+    お支払い通知書は、PDF に載った明細の行数が doc の明細の数と合わなければ警告する
+    （native は描いた行数を native_pdf.draw_payment_table で確かめ、合わなければ書き出す前に例外にする）
+    """
+    _render_document(doc, out_pdf_path, engine, preview_path)
+    with perf.stage('optimize'):
+        pdf_optimize.optimize_file(out_pdf_path)
+    if doc['kind'] == 'payment_notice':
+        with perf.stage('row_check'):
+            found = count_rendered_rows(out_pdf_path, doc['items'])
+        if found is not None and found != len(doc['items']):
+            print(f"[WARN] {os.path.basename(out_pdf_path)}: found {found} of {len(doc['items'])} item names "
+                  "in the PDF text; check the page breaks")
+    return out_pdf_path
+
+
+def count_rendered_rows(pdf_path, items):
+    """
+    PDF の文字から、明細の品名が上から順に何行分見つかるかを数える（折り返しを気にしないよう空白は除く）。
+    品名が途中で切られて描かれていると見つからないので、目安にしか使わない。pymupdf が無ければ None
+    """
+    try:
+        import pymupdf
+    except ImportError:
+        try:
+            import fitz as pymupdf
+        except ImportError:
+            return None
+    with pymupdf.open(pdf_path) as pdf:
+        text = ''.join(page.get_text() for page in pdf)
+    text = ''.join(text.split())
+    pos, found = 0, 0
+    for it in items:
+        name = ''.join(str(it.get('name', '')).split())
+        at = text.find(name, pos)
+        if at < 0:
+            continue
+        found += 1
+        pos = at + len(name)
+    return found
+
+
+def _render_document(doc, out_pdf_path, engine=None, preview_path=None):
+    """
+    native が失敗したら Chromium で描画し直す。
+    preview_path を渡すと1ページ目のプレビュー画像も書き出す（Chromium は同じページから撮る）
+    """
+    # render_service は Playwright を読み込むので、native エンジンだけなら import しない
+    engine = engine or DEFAULT_ENGINE
+    if engine == 'native':
+        try:
+            import native_pdf
+            from render_service import atomic_write
+            with perf.stage('native_draw'):
+                pdf_bytes = native_pdf.draw_document(doc)
+            with perf.stage('file_write'):
+                atomic_write(out_pdf_path, pdf_bytes)
+            if preview_path and not native_pdf.write_preview(pdf_bytes, preview_path):
+                print("[WARN] pymupdf is not installed; making the native engine's preview with Chromium")
+                _chromium_preview(doc, out_pdf_path, preview_path)
+            return out_pdf_path
+        except Exception as e:
+            print(f"[WARN] native PDF engine failed, falling back to Chromium: {e}")
+    from render_service import render_pdf, render_patched
+    if engine == 'hot' and not is_statement(doc):
+        # 明細書モードはページ構成ごと変わるので、差し替えではなく通常の描画にする
+        with perf.stage('template_fill'):
+            tmpl = template_for(doc)
+            slot_html = tmpl.resolve(html_values(doc, tmpl))
+        render_patched(tmpl, slot_html, out_pdf_path, preview_path)
+        return out_pdf_path
+    with perf.stage('template_fill'):
+        html = build_html(doc)
+    render_pdf(html, out_pdf_path, preview_path)
+    return out_pdf_path
+
+
+def _chromium_preview(doc, out_pdf_path, preview_path):
+    """プレビュー画像だけを Chromium で作る（PDF は捨てる）。失敗しても PDF の作成は止めない"""
+    scratch = f"{out_pdf_path}.preview.{os.getpid()}.tmp"
+    try:
+        from render_service import render_pdf
+        render_pdf(build_html(doc), scratch, preview_path)
+    except Exception as e:
+        print(f"[WARN] could not make the preview with Chromium: {e}")
+    finally:
+        if os.path.exists(scratch):
+            os.remove(scratch)
+
+
+def template_version(doc):
+    """
+    テンプレート・印影の更新日時。変わったら同じ内容でもキャッシュを使わずに作り直す
+    """
+    path = CHINAJUN_TMPL if doc['layout'] == 'chinajun' else TEMPLATE_PATH
+    stamps = []
+    for p in (path, SEAL_PATH):
+        try: stamps.append(str(os.stat(p).st_mtime_ns))
+        except OSError: stamps.append('-')
+    return ':'.join(stamps)
+
+
+def _report_preview(doc, out_pdf_path):
+    path = preview_path_for(out_pdf_path)
+    if os.path.exists(path):
+        doc['preview'] = path
+        print(f"___PREVIEW_GENERATED___:{path}")
+
+
+def render_once(doc, allocate, idempotency_key=None, engine=None, preview=None):
+    """
+    同じ idempotency key・同じ内容の PDF が作成済みならそのパスを返す。
+    無ければ allocate() で (請求No, 出力パス) を決めてから描画し、キャッシュに登録する。
+    採番はキャッシュに無かったときだけ行うので、再送で連番が飛ばない。同じキーの依頼が同時に来ても
+    探す → 採番 → 描画 → 登録 はロックの中で1件ずつ行う。
+    idempotency key が無ければキャッシュは使わない（同じ内容でも別の請求書として作る）。
+    preview=True なら PDF と同じ名前のプレビュー画像も作り、doc['preview'] に入れる
+    """
+    idempotency_key = idempotency_key or DEFAULT_IDEMPOTENCY_KEY
+    preview = DEFAULT_PREVIEW if preview is None else preview
+    if not idempotency_key:
+        return _render_new(doc, allocate, engine, preview)
+    key = pdf_cache.request_key(doc, template_version(doc), idempotency_key)
+    with pdf_cache.locked(key):
+        hit = pdf_cache.lookup(key)
+        if hit:
+            out_pdf_path, number = hit
+            doc['number'] = number
+            print(f"[DEBUG] reusing cached PDF: {os.path.basename(out_pdf_path)}")
+            if preview:
+                _report_preview(doc, out_pdf_path)
+            return out_pdf_path
+        out_pdf_path = _render_new(doc, allocate, engine, preview)
+        pdf_cache.store(key, out_pdf_path, doc['number'])
+        return out_pdf_path
+
+
+def _render_new(doc, allocate, engine, preview):
+    """採番して描画し、台帳に記録する。描画に失敗したら番号を返す（sequence_store.release_last）"""
+    sequence_store.forget_last()
+    number, out_pdf_path = allocate()
+    doc['number'] = number
+    print(f"Creating PDF: {os.path.basename(out_pdf_path)}")
+    try:
+        render_document(doc, out_pdf_path, engine, preview_path_for(out_pdf_path) if preview else None)
+    except BaseException:
+        if sequence_store.release_last():
+            print(f"[WARN] rendering {number} failed; the number will be reused")
+        raise
+    if preview:
+        _report_preview(doc, out_pdf_path)
+    try:
+        recipient = doc.get('recipient')
+        if recipient is None:
+            recipient = template_for(doc).default('recipient')
+        ledger.record(doc, out_pdf_path, recipient)
+    except Exception as e:
+        # 台帳に書けなくても PDF は出来ているので、作成自体は失敗にしない
+        print(f"[WARN] could not record {number} in the ledger: {e}")
+    return out_pdf_path
+
+
+def pop_option(name, argv=None):
+    """
+    コマンドライン引数から --name <value> / --name=<value> を取り除いて値を返す。無ければ None
+    """
+    argv = sys.argv if argv is None else argv
+    flag = f'--{name}'
+    for i, arg in enumerate(argv):
+        if arg.startswith(flag + '='):
+            del argv[i]
+            return arg.split('=', 1)[1]
+        if arg == flag and i + 1 < len(argv):
+            value = argv[i + 1]
+            del argv[i:i + 2]
+            return value
+    return None
+
+
+def pop_cli_options(argv=None):
+    """
+    各スクリプト共通の --engine / --idempotency-key / --preview を取り除いて既定値に反映する
+    """
+    global DEFAULT_ENGINE, DEFAULT_IDEMPOTENCY_KEY, DEFAULT_PREVIEW
+    argv = sys.argv if argv is None else argv
+    if '--preview' in argv:
+        argv.remove('--preview')
+        DEFAULT_PREVIEW = True
+    value = pop_option('engine', argv)
+    if value is not None:
+        if value not in ENGINES:
+            print(f"[WARN] unknown PDF engine '{value}', using {DEFAULT_ENGINE}")
+        else:
+            DEFAULT_ENGINE = value
+    key = pop_option('idempotency-key', argv)
+    if key:
+        DEFAULT_IDEMPOTENCY_KEY = key
+    return DEFAULT_ENGINE
@@ -0,0 +1,40 @@
+import os
+import sys
+import urllib.request
+
+import fonts
+
+# 請求書用のフォント（Noto Sans JP の可変フォント）を fonts/ に置く。
+# フォントはリポジトリに入れていないので、Docker のビルド時と .bat の実行時にこれを呼ぶ。
+# すでにあれば何もしない（通信もしない）。native エンジン用の静的フォントもここで作る。取れなくても請求書の作成は止めない
+# （fonts.py は従来どおり Google Fonts のリンクに戻る）。
+
+FONT_URL = "https://github.com/google/fonts/raw/main/ofl/notosansjp/NotoSansJP%5Bwght%5D.ttf"
+FONT_FILE = "NotoSansJP[wght].ttf"
+
+
+def fetch(font_dir=fonts.FONT_DIR, url=FONT_URL):
+    """フォントが無ければダウンロードする。置いたフォントのパスを返す（失敗したら None）"""
+    faces = fonts.local_font_faces()
+    if faces:
+        return faces[0][0]
+    os.makedirs(font_dir, exist_ok=True)
+    path = os.path.join(font_dir, FONT_FILE)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        print(f"Downloading Noto Sans JP to {font_dir} ...")
+        urllib.request.urlretrieve(url, tmp)
+        os.replace(tmp, path)
+    except Exception as e:
+        print(f"[WARN] could not download Noto Sans JP: {e}")
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return None
+    return path
+
+
+if __name__ == "__main__":
+    if not fetch():
+        sys.exit(1)
+    # native エンジン（reportlab）用の静的フォントも、ここで作っておく
+    fonts.static_font_faces()
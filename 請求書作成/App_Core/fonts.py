@@ -0,0 +1,209 @@
+import io
+import os
+import glob
+import base64
+import threading
+from functools import lru_cache
+
+# テンプレートが fonts.googleapis.com から読んでいた Noto Sans JP を、ローカルのフォントファイルから
+# 請求書ごとに使う文字だけにサブセットして @font-face で埋め込む。
+#
+# フォントの置き場所: App_Core/fonts/
+#   - NotoSansJP-Regular.ttf と NotoSansJP-Bold.ttf（静的フォント）、または
+#   - NotoSansJP[wght].ttf / NotoSansJP-VariableFont_wght.ttf（可変フォント1本で全ウェイト）
+# フォントはリポジトリに入れず、fetch_fonts.py で取ってくる（Docker のビルド時・各 .bat の実行時）。
+# フォントが無い場合は None を返し、テンプレートは従来どおり Google Fonts のリンクを使う。
+# fontTools が入っていない場合はサブセットせずにフォント全体を埋め込む。
+#
+# サブセットは小さくても、作るたびにフォント全体を読み込むので1回数百ミリ秒かかる。
+# 品名の文字の組み合わせは請求書ごとに違うので、使う文字の集合をキーにするとキャッシュはほとんど当たらない。
+# そこで @font-face を2つに分ける:
+#   - テンプレートの固定部分の文字 … テンプレートごとに1回だけ作る
+#   - それ以外（品名・宛先など）の文字 … unicode-range つきの別の @font-face。これまでに出てきた文字を
+#     まとめた1つのサブセットを使い回し、まだ無い文字が来たときだけ足して作り直す
+#     （EXTRA_CHARS_MAX 文字を超えたら、その請求書の文字だけで作り直す）
+# reportlab（native_pdf.py）は可変フォントを扱えないので、static_font_faces() で
+# 可変フォントから 400 / 700 の静的フォントを作って fonts/static/ に置いておく。
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+FONT_DIR = os.environ.get("INVOICE_FONT_DIR") or os.path.join(SCRIPT_DIR, "fonts")
+FONT_FAMILY = "Noto Sans JP"
+
+# サブセットに必ず含める文字（ASCII と全角スペース）
+BASE_CHARS = frozenset(chr(c) for c in range(0x20, 0x7f)) | {'　'}
+
+try:
+    from fontTools import subset as _ft_subset
+    from fontTools.ttLib import TTFont as _TTFont
+except ImportError:
+    _ft_subset = None
+
+try:
+    import brotli  # noqa: F401  (woff2 の圧縮に必要)
+    _HAS_BROTLI = True
+except ImportError:
+    _HAS_BROTLI = False
+
+# 使い回すサブセット（品名などの文字）に入れておく文字数の上限
+EXTRA_CHARS_MAX = 2000
+
+_warned = set()
+_warn_lock = threading.Lock()
+
+
+def _warn_once(key, msg):
+    with _warn_lock:
+        if key in _warned:
+            return
+        _warned.add(key)
+    print(f"[WARN] {msg}")
+
+
+def local_font_faces():
+    """
+    [(フォントパス, font-weight の指定), ...] を返す。フォントが無ければ空リスト
+    """
+    regular = os.path.join(FONT_DIR, "NotoSansJP-Regular.ttf")
+    bold = os.path.join(FONT_DIR, "NotoSansJP-Bold.ttf")
+    if os.path.exists(regular):
+        faces = [(regular, "400")]
+        if os.path.exists(bold):
+            faces.append((bold, "700"))
+        return faces
+    variable = sorted(glob.glob(os.path.join(FONT_DIR, "NotoSansJP*wght*.[ot]tf")))
+    if variable:
+        return [(variable[0], "100 900")]
+    return []
+
+
+# static_font_faces() が作る静的フォントの太さと名前
+STATIC_WEIGHTS = {"400": "Regular", "700": "Bold"}
+_static_lock = threading.Lock()
+
+
+def static_font_faces():
+    """
+    {'400': パス, '700': パス} を返す（静的フォントが無ければ空の dict）。
+    fonts/ に可変フォントしか無いときは、fontTools.varLib.instancer で fonts/static/ に作る
+    （可変フォントより古ければ作り直す。初回は数十秒かかるので Docker のビルド時に作っておく）
+    """
+    faces = local_font_faces()
+    if not faces:
+        return {}
+    if faces[0][1] != "100 900":
+        return {weight: path for path, weight in faces}
+    variable = faces[0][0]
+    try:
+        from fontTools.varLib import instancer
+    except ImportError:
+        _warn_once("instancer", "fontTools is not installed; cannot make static Noto Sans JP for the native engine")
+        return {}
+    out_dir = os.path.join(FONT_DIR, "static")
+    result = {}
+    with _static_lock:
+        for weight, name in STATIC_WEIGHTS.items():
+            path = os.path.join(out_dir, f"NotoSansJP-{name}.ttf")
+            if not os.path.exists(path) or os.stat(path).st_mtime_ns < os.stat(variable).st_mtime_ns:
+                try:
+                    print(f"[DEBUG] building static Noto Sans JP {name} from {os.path.basename(variable)}")
+                    os.makedirs(out_dir, exist_ok=True)
+                    font = instancer.instantiateVariableFont(_TTFont(variable), {"wght": int(weight)})
+                    tmp = f"{path}.{os.getpid()}.tmp"
+                    font.save(tmp)
+                    os.replace(tmp, path)
+                except Exception as e:
+                    _warn_once(f"static-{weight}", f"could not build static Noto Sans JP {name}: {e}")
+                    continue
+            result[weight] = path
+    return result
+
+
+@lru_cache(maxsize=4)
+def _read_font(path, mtime):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@lru_cache(maxsize=32)
+def _subset(path, mtime, chars):
+    data = _read_font(path, mtime)
+    if _ft_subset is None:
+        _warn_once("fonttools", "fontTools is not installed; embedding the full Noto Sans JP font")
+        return data, "truetype"
+    options = _ft_subset.Options()
+    options.flavor = "woff2" if _HAS_BROTLI else None
+    options.name_IDs = ["*"]
+    options.notdef_outline = True
+    font = _TTFont(io.BytesIO(data), lazy=True)
+    subsetter = _ft_subset.Subsetter(options)
+    subsetter.populate(unicodes=[ord(c) for c in chars])
+    subsetter.subset(font)
+    out = io.BytesIO()
+    font.save(out)
+    return out.getvalue(), ("woff2" if _HAS_BROTLI else "truetype")
+
+
+# (フォントのパス, mtime) -> 使い回しているサブセットの (文字の集合, データ, 形式)
+_extra = {}
+_extra_lock = threading.Lock()
+
+
+def _extra_subset(path, mtime, chars):
+    """chars を含む、使い回しのサブセットを返す: (含まれる文字の集合, データ, 形式)"""
+    key = (path, mtime)
+    with _extra_lock:
+        covered, data, fmt = _extra.get(key, (frozenset(), None, None))
+        if data is not None and chars <= covered:
+            return covered, data, fmt
+        covered = covered | chars if len(covered | chars) <= EXTRA_CHARS_MAX else chars
+        data, fmt = _subset(path, mtime, covered)
+        # 古い mtime のものは捨てる（フォントが置き換わった）
+        for old in [k for k in _extra if k[0] == path]:
+            del _extra[old]
+        _extra[key] = (covered, data, fmt)
+        return covered, data, fmt
+
+
+def _unicode_range(chars):
+    """文字の集合を unicode-range の値（連続するコードポイントは U+XXXX-YYYY にまとめる）にする"""
+    points = sorted(ord(c) for c in chars)
+    ranges = []
+    start = prev = points[0]
+    for cp in points[1:]:
+        if cp != prev + 1:
+            ranges.append((start, prev))
+            start = cp
+        prev = cp
+    ranges.append((start, prev))
+    return ", ".join(f"U+{a:X}" if a == b else f"U+{a:X}-{b:X}" for a, b in ranges)
+
+
+def _face_rule(weight, data, fmt, chars=None):
+    mime = "font/woff2" if fmt == "woff2" else "font/ttf"
+    b64 = base64.b64encode(data).decode("ascii")
+    unicode_range = f" unicode-range: {_unicode_range(chars)};" if chars else ""
+    return (f'@font-face {{ font-family: "{FONT_FAMILY}"; font-style: normal; font-weight: {weight}; '
+            f'font-display: block; src: url(data:{mime};base64,{b64}) format("{fmt}");{unicode_range} }}')
+
+
+def font_face_css(chars, base_chars=frozenset()):
+    """
+    chars（使う文字の集合）を表示できる @font-face の CSS を返す。ローカルフォントが無ければ None。
+    base_chars（テンプレートの固定部分の文字）のサブセットはテンプレートごとに1回だけ作り、
+    残りの文字は unicode-range つきの使い回しのサブセットにする
+    """
+    faces = local_font_faces()
+    if not faces:
+        _warn_once("missing", f"Noto Sans JP not found in {FONT_DIR}; falling back to Google Fonts")
+        return None
+    base = frozenset(base_chars) | BASE_CHARS
+    extra = frozenset(chars) - base
+    css = []
+    for path, weight in faces:
+        mtime = os.stat(path).st_mtime_ns
+        css.append(_face_rule(weight, *_subset(path, mtime, base)))
+        if extra:
+            # 後に書いた @font-face が優先されるので、unicode-range の文字はこちらから引かれる
+            covered, data, fmt = _extra_subset(path, mtime, extra)
+            css.append(_face_rule(weight, data, fmt, covered))
+    return "\n".join(css)
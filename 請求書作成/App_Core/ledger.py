@@ -0,0 +1,298 @@
+import os
+import re
+import sys
+import json
+import sqlite3
+import argparse
+from datetime import datetime, date
+
+# 作成した請求書・お支払い通知書の台帳（SQLite）。
+# render_once() が PDF を作るたびに請求No・宛先・日付・明細・合計・出力パスを記録するので、
+# 「2月の株式会社TUYOSHI宛の請求書」や「期限切れの未入金」を作成済みフォルダを探さずに引ける。
+#
+#   python ledger.py find --dest 株式会社TUYOSHI --month 2026-02
+#   python ledger.py unpaid --overdue
+#   python ledger.py mark-paid 20260222-M01 [--date 2026-03-10]
+#   python ledger.py backfill          … 既存の PDF のファイル名から台帳を作る（明細・金額は空）
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(SCRIPT_DIR)
+OUT_DIR = os.environ.get("INVOICE_OUT_DIR") or os.path.join(BASE_DIR, "作成済み請求書")
+DB_PATH = os.environ.get("INVOICE_LEDGER_DB") or os.path.join(OUT_DIR, ".ledger.sqlite3")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id          INTEGER PRIMARY KEY,
+    number      TEXT NOT NULL,
+    kind        TEXT NOT NULL,
+    series      TEXT,
+    recipient   TEXT NOT NULL,
+    issue_date  TEXT NOT NULL,
+    due_date    TEXT,
+    total       INTEGER,
+    tax_type    TEXT,
+    path        TEXT NOT NULL UNIQUE,
+    created     TEXT NOT NULL,
+    paid_on     TEXT,
+    source      TEXT NOT NULL DEFAULT 'generated'
+);
+CREATE INDEX IF NOT EXISTS documents_recipient ON documents (recipient, issue_date);
+CREATE INDEX IF NOT EXISTS documents_issue ON documents (kind, issue_date);
+CREATE INDEX IF NOT EXISTS documents_unpaid ON documents (kind, paid_on, due_date);
+CREATE INDEX IF NOT EXISTS documents_number ON documents (number);
+CREATE TABLE IF NOT EXISTS items (
+    doc_id   INTEGER NOT NULL REFERENCES documents (id) ON DELETE CASCADE,
+    line_no  INTEGER NOT NULL,
+    name     TEXT NOT NULL,
+    unit     INTEGER,
+    qty      INTEGER,
+    total    INTEGER,
+    PRIMARY KEY (doc_id, line_no)
+);
+"""
+
+COLUMNS = ('id', 'number', 'kind', 'series', 'recipient', 'issue_date', 'due_date', 'total',
+           'tax_type', 'path', 'created', 'paid_on', 'source')
+
+
+def connect(db_path=None):
+    db_path = db_path or DB_PATH
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30.0)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _int_or_none(v):
+    try: return int(v)
+    except (TypeError, ValueError): return None
+
+
+def record(doc, path, recipient=None, db_path=None):
+    """
+    作成した doc を台帳に記録する。同じパスの記録があれば置き換える
+    """
+    conn = connect(db_path)
+    try:
+        with conn:
+            conn.execute("DELETE FROM documents WHERE path = ?", (os.path.abspath(path),))
+            cur = conn.execute(
+                "INSERT INTO documents (number, kind, series, recipient, issue_date, due_date, total, tax_type, path, created)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (doc['number'], doc['kind'], doc.get('series'), recipient or doc.get('recipient') or '',
+                 str(doc['issue_date'])[:10], str(doc.get('due_date') or '')[:10] or None,
+                 _int_or_none(doc.get('total')), doc.get('tax_type'), os.path.abspath(path),
+                 datetime.now().isoformat(timespec='seconds')),
+            )
+            conn.executemany(
+                "INSERT INTO items (doc_id, line_no, name, unit, qty, total) VALUES (?, ?, ?, ?, ?, ?)",
+                [(cur.lastrowid, i, str(it.get('name', '')), _int_or_none(it.get('unit')),
+                  _int_or_none(it.get('qty')), _int_or_none(it.get('total')))
+                 for i, it in enumerate(doc.get('items', []))],
+            )
+    finally:
+        conn.close()
+
+
+def _month_range(month):
+    """'2026-02' -> ('2026-02-01', '2026-03-01')"""
+    y, m = (int(x) for x in month.split('-')[:2])
+    return f"{y:04}-{m:02}-01", (f"{y + 1:04}-01-01" if m == 12 else f"{y:04}-{m + 1:02}-01")
+
+
+def find(dest=None, month=None, kind=None, contains=False, db_path=None):
+    where, params = [], []
+    if dest:
+        if contains:
+            where.append("recipient LIKE ?")
+            params.append(f"%{dest}%")
+        else:
+            where.append("recipient = ?")
+            params.append(dest)
+    if month:
+        start, end = _month_range(month)
+        where.append("issue_date >= ? AND issue_date < ?")
+        params += [start, end]
+    if kind:
+        where.append("kind = ?")
+        params.append(kind)
+    sql = "SELECT * FROM documents"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    conn = connect(db_path)
+    try:
+        return [dict(r) for r in conn.execute(sql + " ORDER BY issue_date, number", params)]
+    finally:
+        conn.close()
+
+
+def unpaid(overdue=False, as_of=None, db_path=None):
+    """
+    未入金の請求書。overdue=True ならお支払い期限（as_of 既定は今日）を過ぎたものだけ
+    """
+    sql = "SELECT * FROM documents WHERE kind = 'invoice' AND paid_on IS NULL"
+    params = []
+    if overdue:
+        sql += " AND due_date < ?"
+        params.append(as_of or date.today().isoformat())
+    conn = connect(db_path)
+    try:
+        return [dict(r) for r in conn.execute(sql + " ORDER BY due_date, number", params)]
+    finally:
+        conn.close()
+
+
+def items_for(doc_id, db_path=None):
+    conn = connect(db_path)
+    try:
+        return [dict(r) for r in conn.execute(
+            "SELECT name, unit, qty, total FROM items WHERE doc_id = ? ORDER BY line_no", (doc_id,))]
+    finally:
+        conn.close()
+
+
+def iter_items(recipient, start, end, kind='invoice', exclude_series=('C',), db_path=None, batch=500):
+    """
+    recipient 宛て・issue_date が start 以上 end 以下の書類の明細を1行ずつ返す（カーソルで少しずつ読む）。
+    月次請求書（series 'C'）自体は二重計上しないよう既定で除く
+    """
+    placeholders = ','.join('?' * len(exclude_series)) or "''"
+    sql = ("SELECT d.number, d.issue_date, i.name, i.unit, i.qty, i.total FROM documents d"
+           " JOIN items i ON i.doc_id = d.id"
+           " WHERE d.recipient = ? AND d.kind = ? AND d.issue_date >= ? AND d.issue_date <= ?"
+           f" AND COALESCE(d.series, '') NOT IN ({placeholders})"
+           " ORDER BY d.issue_date, d.number, i.line_no")
+    conn = connect(db_path)
+    try:
+        cur = conn.execute(sql, (recipient, kind, start, end, *exclude_series))
+        while True:
+            rows = cur.fetchmany(batch)
+            if not rows:
+                break
+            for r in rows:
+                yield dict(r)
+    finally:
+        conn.close()
+
+
+def count_without_items(recipient, start, end, kind='invoice', db_path=None):
+    """明細が記録されていない書類（backfill で登録したもの）の数"""
+    conn = connect(db_path)
+    try:
+        return conn.execute(
+            "SELECT COUNT(*) FROM documents d WHERE d.recipient = ? AND d.kind = ?"
+            " AND d.issue_date >= ? AND d.issue_date <= ?"
+            " AND NOT EXISTS (SELECT 1 FROM items i WHERE i.doc_id = d.id)",
+            (recipient, kind, start, end)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def mark_paid(number, paid_on=None, db_path=None):
+    conn = connect(db_path)
+    try:
+        with conn:
+            cur = conn.execute("UPDATE documents SET paid_on = ? WHERE number = ? AND kind = 'invoice'",
+                               (paid_on or date.today().isoformat(), number))
+        return cur.rowcount
+    finally:
+        conn.close()
+
+
+# 既存ファイル名の形式（generate_pdf ごと）。日付は YYYY-MM-DD のフォルダ名から取る
+BACKFILL_PATTERNS = [
+    # manual_invoice: 請求書_{宛先}御中_{YYYYMMDD}_{NN}.pdf
+    ('invoice', 'M', re.compile(r'^請求書_(?P<dest>.+)御中_(?P<ymd>\d{8})_(?P<no>\d+)\.pdf$')),
+    # batch_gen: 請求書_{宛先}御中{MM月DD日}-{NN}.pdf
+    ('invoice', '', re.compile(r'^請求書_(?P<dest>.+)御中\d{2}月\d{2}日-(?P<no>\d+)\.pdf$')),
+    # payment_notice: お支払い通知書_{宛先}御中_{YYYYMMDD}_{NN}.pdf
+    ('payment_notice', 'P', re.compile(r'^お支払い通知書_(?P<dest>.+)御中_(?P<ymd>\d{8})_(?P<no>\d+)\.pdf$')),
+    # pick_invoice: {宛先}御中{MM月DD日}-P{NN}.pdf
+    ('invoice', 'pick', re.compile(r'^(?P<dest>.+)御中\d{2}月\d{2}日-P(?P<no>\d+)\.pdf$')),
+]
+DAY_DIR_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+
+def backfill(root=OUT_DIR, db_path=None):
+    """
+    作成済みフォルダの PDF をファイル名から台帳に登録する（登録済みのパスは飛ばす）。登録件数を返す
+    """
+    if not os.path.isdir(root):
+        return 0
+    conn = connect(db_path)
+    added = 0
+    try:
+        known = {r[0] for r in conn.execute("SELECT path FROM documents")}
+        with conn:
+            for day in sorted(os.listdir(root)):
+                if not DAY_DIR_PATTERN.match(day):
+                    continue
+                for dirpath, _, files in os.walk(os.path.join(root, day)):
+                    for fname in sorted(files):
+                        path = os.path.abspath(os.path.join(dirpath, fname))
+                        if not fname.endswith('.pdf') or path in known:
+                            continue
+                        for kind, series, pattern in BACKFILL_PATTERNS:
+                            m = pattern.match(fname)
+                            if not m:
+                                continue
+                            ymd = day.replace('-', '')
+                            prefix = 'P' if series == 'pick' else series
+                            conn.execute(
+                                "INSERT INTO documents (number, kind, series, recipient, issue_date, path, created, source)"
+                                " VALUES (?, ?, ?, ?, ?, ?, ?, 'backfill')",
+                                (f"{ymd}-{prefix}{int(m.group('no')):02}", kind, series, m.group('dest'), day,
+                                 path, datetime.fromtimestamp(os.path.getmtime(path)).isoformat(timespec='seconds')),
+                            )
+                            added += 1
+                            break
+    finally:
+        conn.close()
+    return added
+
+
+def _print_rows(rows, as_json=False):
+    if as_json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+        return
+    for r in rows:
+        total = f"{r['total']:,}" if r['total'] is not None else '-'
+        paid = f"paid {r['paid_on']}" if r['paid_on'] else ''
+        print(f"{r['issue_date']}\t{r['number']}\t{r['recipient']}\t¥{total}\tdue {r['due_date'] or '-'}\t{paid}\t{r['path']}")
+    print(f"({len(rows)} documents)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("find", help="search by destination / month")
+    p.add_argument("--dest")
+    p.add_argument("--contains", action="store_true", help="match --dest as a substring")
+    p.add_argument("--month", help="YYYY-MM")
+    p.add_argument("--kind", choices=["invoice", "payment_notice"])
+    p.add_argument("--json", action="store_true")
+    p = sub.add_parser("unpaid", help="unpaid invoices")
+    p.add_argument("--overdue", action="store_true", help="only invoices past their deadline")
+    p.add_argument("--as-of", help="YYYY-MM-DD (default: today)")
+    p.add_argument("--json", action="store_true")
+    p = sub.add_parser("mark-paid", help="record a payment")
+    p.add_argument("number")
+    p.add_argument("--date", help="YYYY-MM-DD (default: today)")
+    sub.add_parser("backfill", help="index existing PDFs from their file names")
+    args = parser.parse_args()
+
+    if args.command == "find":
+        _print_rows(find(args.dest, args.month, args.kind, args.contains), args.json)
+    elif args.command == "unpaid":
+        _print_rows(unpaid(args.overdue, args.as_of), args.json)
+    elif args.command == "mark-paid":
+        n = mark_paid(args.number, args.date)
+        if not n:
+            print(f"エラー: 請求No {args.number} が台帳にありません。", file=sys.stderr)
+            sys.exit(1)
+        print(f"{args.number}: paid")
+    elif args.command == "backfill":
+        print(f"{backfill()} documents added")
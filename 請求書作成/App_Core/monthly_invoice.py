@@ -0,0 +1,115 @@
+import os
+import re
+import sys
+import argparse
+from datetime import datetime, date, timedelta
+
+import documents
+import ledger
+import sequence_store
+from documents import render_once
+from manual_invoice import calc_deadline
+
+# 宛先ごとの月次まとめ請求書。台帳（ledger.py）から期間内の請求書の明細を1行ずつ読み、
+# 品名と単価が同じ行は数量・金額を足し合わせて、1通の請求書（明細が多ければ明細書モード）にする。
+# 明細はカーソルで少しずつ読むので、元の請求書が何千件あってもメモリに載るのはまとめた後の行だけ。
+#
+#   python monthly_invoice.py --dest 株式会社TUYOSHI --month 2026-02
+#   python monthly_invoice.py --dest 株式会社りんご --from 2026-02-01 --to 2026-02-15 [--deadline-type 3]
+#
+# 請求No は YYYYMMDD-CNN（系列 'C'）。まとめ請求書自体は次回の集計に含めない。
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(SCRIPT_DIR)
+OUT_DIR = os.environ.get("INVOICE_OUT_DIR") or os.path.join(BASE_DIR, "作成済み請求書")
+
+
+def month_bounds(month):
+    """'2026-02' -> ('2026-02-01', '2026-02-28')"""
+    start, end = ledger._month_range(month)
+    return start, (date.fromisoformat(end) - timedelta(days=1)).isoformat()
+
+
+def merge_items(rows):
+    """
+    (品名, 単価) が同じ明細をまとめる。出てきた順を保つ
+    """
+    merged = {}
+    sources = set()
+    for r in rows:
+        sources.add(r['number'])
+        key = (r['name'], r['unit'])
+        line = merged.get(key)
+        if line is None:
+            merged[key] = {'name': r['name'], 'unit': r['unit'], 'qty': r['qty'] or 0, 'total': r['total'] or 0}
+        else:
+            line['qty'] += r['qty'] or 0
+            line['total'] += r['total'] or 0
+    return list(merged.values()), sources
+
+
+def generate_pdf(dest, start, end, deadline_type='3', idempotency_key=None):
+    items, sources = merge_items(ledger.iter_items(dest, start, end))
+    if not items:
+        raise ValueError(f"{dest} の {start}〜{end} の請求書が台帳にありません")
+    missing = ledger.count_without_items(dest, start, end)
+    if missing:
+        print(f"[WARN] {missing} documents for {dest} have no line items in the ledger (backfilled) and are not included")
+
+    today = datetime.now()
+    today_str = today.strftime('%Y%m%d')
+    deadline = calc_deadline(deadline_type, today)
+    total = sum(it['total'] for it in items)
+
+    daily_out_dir = os.path.join(OUT_DIR, today.strftime('%Y-%m-%d'), '請求書')
+    os.makedirs(daily_out_dir, exist_ok=True)
+    safe_dest = re.sub(r'[\\/:*?"<>|]', '_', dest)
+    file_prefix = f"月次請求書_{safe_dest}御中_{start.replace('-', '')}-{end.replace('-', '')}_"
+
+    def allocate():
+        count = sequence_store.next_number('C', today_str,
+                                           seed=lambda: sequence_store.count_files(daily_out_dir, '月次請求書_'))
+        invoice_no = sequence_store.format_number(today_str, 'C', count)
+        return invoice_no, os.path.join(daily_out_dir, f"{file_prefix}C{count:02}.pdf")
+
+    doc = {
+        'kind': 'invoice',
+        'layout': 'standard',
+        'series': 'C',
+        'recipient': dest,
+        'issue_date': today.strftime('%Y-%m-%d'),
+        'due_date': deadline.strftime('%Y-%m-%d'),
+        'items': items,
+        'total': total,
+    }
+    print(f"{dest}: {len(sources)} invoices, {len(items)} lines, ¥{total:,}")
+    return render_once(doc, allocate, idempotency_key)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dest", required=True, help="destination name as recorded in the ledger")
+    parser.add_argument("--month", help="YYYY-MM")
+    parser.add_argument("--from", dest="start", help="YYYY-MM-DD")
+    parser.add_argument("--to", dest="end", help="YYYY-MM-DD (inclusive)")
+    parser.add_argument("--deadline-type", default='3', choices=['1', '2', '3'], help="1=1週間後, 2=当月末, 3=翌月末")
+    parser.add_argument("--engine", choices=documents.ENGINES, help="PDF engine (default: chromium, or INVOICE_PDF_ENGINE)")
+    parser.add_argument("--idempotency-key")
+    args = parser.parse_args()
+    if args.engine:
+        documents.DEFAULT_ENGINE = args.engine
+
+    if args.month:
+        start, end = month_bounds(args.month)
+    elif args.start and args.end:
+        start, end = args.start, args.end
+    else:
+        print("エラー: --month か --from/--to を指定してください。", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        out_path = generate_pdf(args.dest, start, end, args.deadline_type, args.idempotency_key)
+        print(f"___PDF_GENERATED___:{out_path}")
+    except Exception as e:
+        print(f"エラーが発生しました: {e}", file=sys.stderr)
+        sys.exit(1)
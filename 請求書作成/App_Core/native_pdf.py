@@ -0,0 +1,632 @@
+import io
+import os
+import base64
+from functools import lru_cache
+
+from reportlab.lib.colors import HexColor, white
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+import fonts
+from documents import jp_date, template_for, is_statement, statement_caption, REGISTRATION_NO
+from template_engine import SEAL_PATH, invoice_row_values, signed_yen, statement_row_cells
+
+# ブラウザを使わずに、テンプレート.html（請求書）と chinajun_template.html（お支払い通知書）と
+# 同じレイアウトを reportlab で直接PDFに描画するエンジン。
+# CSS の px はそのまま pt に換算（1px = 0.75pt）して寸法を合わせている。
+# 振込先・差出人などの固定文言はテンプレートと同じものをここにも持っているので、
+# テンプレートを変えたときはこちらも合わせて直すこと。
+
+PAGE_W, PAGE_H = A4
+PX = 0.75
+
+GREEN = HexColor('#82b95b')
+GREEN_LIGHT = HexColor('#e6f0db')
+TEXT = HexColor('#333333')
+NAVY = HexColor('#1c3d70')
+DARK_GREEN = HexColor('#1b5e20')
+PALE_GREEN = HexColor('#c8e6c9')
+PALER_GREEN = HexColor('#f1f8e9')
+GREY = HexColor('#aaaaaa')
+
+SENDER_LINES = ['株式会社 evoke', '〒 558-0043', '大阪市住吉区墨江2-2-35', '☎ 080-1750-4373']
+INVOICE_BANK_ROWS = [('銀    行', 'paypay銀行'), ('支    店', 'ビジネス営業部(005)'),
+                     ('口座番号', '( 普 ) 1729501'), ('口座名義', 'カ）エヴォーク')]
+CHINAJUN_BANK_ROWS = [('銀　行', '三井住友銀行'), ('支　店', '難波支店'),
+                      ('口座番号', '（普）8597011'), ('口座名称', 'ちなじゅん運送 井後陽輔')]
+
+
+@lru_cache(maxsize=1)
+def _font_names():
+    """
+    (通常, 太字) のフォント名。ローカルの Noto Sans JP を埋め込む（可変フォントしか無ければ
+    fonts.static_font_faces() が静的フォントを作る）。どちらも無ければ埋め込まない CID フォントを使う
+    """
+    faces = fonts.static_font_faces()
+    if '400' in faces:
+        try:
+            pdfmetrics.registerFont(TTFont('NotoSansJP', faces['400']))
+            bold = 'NotoSansJP'
+            if '700' in faces:
+                pdfmetrics.registerFont(TTFont('NotoSansJP-Bold', faces['700']))
+                bold = 'NotoSansJP-Bold'
+            return 'NotoSansJP', bold
+        except Exception as e:
+            print(f"[WARN] could not load Noto Sans JP for native PDF: {e}")
+    print("[WARN] Noto Sans JP is not available; the native PDF uses the non-embedded HeiseiKakuGo-W5 font")
+    pdfmetrics.registerFont(UnicodeCIDFont('HeiseiKakuGo-W5'))
+    return 'HeiseiKakuGo-W5', 'HeiseiKakuGo-W5'
+
+
+@lru_cache(maxsize=2)
+def _seal_image(mtime):
+    with open(SEAL_PATH, 'r', encoding='utf-8') as f:
+        data = f.read().strip()
+    return ImageReader(io.BytesIO(base64.b64decode(data.split(',', 1)[-1])))
+
+
+def seal_image():
+    try:
+        return _seal_image(os.stat(SEAL_PATH).st_mtime_ns)
+    except Exception as e:
+        print("Base64 injection error: ", e)
+        return None
+
+
+class Painter:
+    """上端からの距離（pt）で座標を指定できる薄いラッパー"""
+
+    def __init__(self, c):
+        self.c = c
+        self.regular, self.bold = _font_names()
+
+    def y(self, top):
+        return PAGE_H - top
+
+    def width(self, s, size, bold=False):
+        return pdfmetrics.stringWidth(s, self.bold if bold else self.regular, size)
+
+    def text(self, x, top, s, size, color=TEXT, bold=False, align='left'):
+        """top は文字の上端。align は 'left' / 'right' / 'center'（x はそれぞれの基準位置）"""
+        if not s:
+            return
+        w = self.width(s, size, bold)
+        if align == 'right':
+            x -= w
+        elif align == 'center':
+            x -= w / 2
+        font = self.bold if bold else self.regular
+        self.c.setFont(font, size)
+        self.c.setFillColor(color)
+        self.c.drawString(x, self.y(top + size * 0.88), s)
+        if bold and self.bold == self.regular:
+            # 太字フォントが無いときは少しずらして重ね書きし、太く見せる
+            self.c.drawString(x + size * 0.04, self.y(top + size * 0.88), s)
+
+    def fit(self, s, size, max_w, bold=False):
+        """幅に収まらない文字列は収まるまで文字サイズを下げる（最小で元の6割）"""
+        w = self.width(s, size, bold)
+        if w <= max_w or w == 0:
+            return size
+        return max(size * 0.6, size * max_w / w)
+
+    def wrap(self, s, size, max_w, bold=False):
+        """1文字ずつ幅を見て折り返す（日本語は単語の区切りが無いため）"""
+        lines, line = [], ''
+        for ch in s:
+            if line and self.width(line + ch, size, bold) > max_w:
+                lines.append(line)
+                line = ''
+            line += ch
+        lines.append(line)
+        return lines
+
+    def rect(self, x, top, w, h, fill=None, stroke=None, line_width=1 * PX, radius=0):
+        c = self.c
+        if fill is not None:
+            c.setFillColor(fill)
+        if stroke is not None:
+            c.setStrokeColor(stroke)
+            c.setLineWidth(line_width)
+        if radius:
+            c.roundRect(x, self.y(top + h), w, h, radius, stroke=int(stroke is not None), fill=int(fill is not None))
+        else:
+            c.rect(x, self.y(top + h), w, h, stroke=int(stroke is not None), fill=int(fill is not None))
+
+    def hline(self, x1, x2, top, color=TEXT, line_width=1 * PX):
+        self.c.setStrokeColor(color)
+        self.c.setLineWidth(line_width)
+        self.c.line(x1, self.y(top), x2, self.y(top))
+
+    def image(self, img, x, top, w, h):
+        if img is not None:
+            self.c.drawImage(img, x, self.y(top + h), w, h, mask='auto', preserveAspectRatio=True, anchor='c')
+
+
+# ============================================================
+# 請求書（テンプレート.html）
+# ============================================================
+def _invoice_metrics(compact):
+    # batch_gen / pick_invoice のコンパクト表示（template_engine.COMPACT_TWEAKS）に合わせる
+    return {
+        'fs13': (11 if compact else 13) * PX,
+        'fs14': (12 if compact else 14) * PX,
+        'to_mb': (20 if compact else 30) * PX,
+        'items_mt': (20 if compact else 40) * PX,
+        'cell_pad': (8 if compact else 12) * PX,
+        'cols': [0.58, 0.15, 0.06, 0.21] if compact else [0.52, 0.18, 0.10, 0.20],
+        'totals': [21, 15, 15, 21, 15, 15] if compact else [20, 15, 15, 20, 15, 15],
+    }
+
+
+def draw_invoice(c, doc):
+    p = Painter(c)
+    m = _invoice_metrics(doc.get('compact', False))
+    tmpl = template_for(doc)
+    x0, top = 20 * mm, 15 * mm
+    W = PAGE_W - 40 * mm
+    left_w = W * 0.5
+    right_x, right_w = x0 + W * 0.55, W * 0.45
+    fs = m['fs13']
+
+    recipient = doc.get('recipient')
+    if recipient is None:
+        recipient = tmpl.default('recipient')
+    if doc.get('show_dates', True):
+        issue_jp, due_jp = jp_date(doc['issue_date']), jp_date(doc['due_date'])
+    else:
+        issue_jp, due_jp = tmpl.default('issue_date'), tmpl.default('deadline')
+
+    # --- 左上：タイトル・宛先・ご請求金額 ---
+    y = top
+    title_h = 26 * PX + 24 * PX
+    path = c.beginPath()
+    path.moveTo(x0 + left_w * 0.05, p.y(y))
+    path.lineTo(x0 + left_w, p.y(y))
+    path.lineTo(x0 + left_w, p.y(y + title_h))
+    path.lineTo(x0, p.y(y + title_h))
+    path.close()
+    c.setFillColor(GREEN)
+    c.drawPath(path, stroke=0, fill=1)
+    p.text(x0 + left_w / 2, y + (title_h - 26 * PX) / 2, '請求書', 26 * PX, white, bold=True, align='center')
+    y += title_h + 25 * PX
+
+    size = p.fit(recipient, 16 * PX, left_w - p.width('御 中', 16 * PX) - 10 * PX)
+    p.text(x0, y, recipient, size)
+    p.text(x0 + left_w, y, '御 中', 16 * PX, align='right')
+    y += 16 * PX * 1.5 + 5 * PX
+    p.hline(x0, x0 + left_w, y)
+    y += m['to_mb']
+
+    p.text(x0, y, '下記の通りご請求申し上げます。', fs)
+    y += fs * 1.5 + 5 * PX
+
+    amount_h = 24 * PX * 1.4 + 20 * PX
+    p.rect(x0, y, left_w * 0.45, amount_h, fill=GREEN)
+    p.rect(x0, y, left_w, amount_h, stroke=GREEN, line_width=2 * PX)
+    p.text(x0 + left_w * 0.225, y + (amount_h - 18 * PX) / 2, 'ご請求金額', 18 * PX, white, bold=True, align='center')
+    p.text(x0 + left_w * 0.725, y + (amount_h - 24 * PX) / 2, f"¥{doc['total']:,}-", 24 * PX, bold=True, align='center')
+    y += amount_h + 5 * PX
+
+    p.text(x0 + 10 * PX, y, '( お支払い期限 )', fs)
+    p.text(x0 + left_w - 10 * PX, y, due_jp, fs, align='right')
+    y += fs * 1.5
+
+    # --- 右上：請求No・請求日・振込先 ---
+    ry = top
+    th_x = right_x + right_w * 0.4 - 15 * PX
+    td_x = right_x + right_w * 0.4 + 2 * PX
+    for label, value in (('請求 No :', doc['number']), ('請求 日 :', issue_jp)):
+        p.text(th_x, ry, label, fs, align='right')
+        p.text(td_x, ry, value, fs)
+        ry += fs * 1.6
+    ry += 15 * PX
+    row_h = fs * 1.4 + 10 * PX
+    for label, value in INVOICE_BANK_ROWS:
+        p.rect(right_x, ry, right_w * 0.35, row_h, fill=GREEN, stroke=TEXT)
+        p.rect(right_x + right_w * 0.35, ry, right_w * 0.65, row_h, stroke=TEXT)
+        p.text(right_x + right_w * 0.175, ry + (row_h - fs) / 2, label, fs, white, align='center')
+        p.text(right_x + right_w * 0.675, ry + (row_h - fs) / 2, value, fs, align='center')
+        ry += row_h
+    ry += 5 * PX
+    p.text(right_x, ry, '※お振込手数料は御社ご負担にてお願いします。', 11 * PX)
+    ry += 11 * PX * 1.5
+
+    # --- 明細 ---
+    y = max(y, ry) + m['items_mt']
+    if is_statement(doc):
+        y = draw_statement_table(p, doc, x0, W, y, m, statement_caption(doc, tmpl))
+    else:
+        y = draw_invoice_table(p, doc, x0, W, y, m)
+    y = draw_invoice_totals(p, doc, x0, W, y, m)
+    draw_invoice_footer(p, x0, W, y + 20 * PX, fs)
+
+
+def _invoice_cells(doc, it):
+    if doc.get('row_style') == 'payment':
+        return it['name'], signed_yen(it['unit']), str(it['qty']), signed_yen(it['total'])
+    name, unit, qty, total = invoice_row_values(it)
+    return name, f'{unit:,}', str(qty), f'{total:,}'
+
+
+def draw_invoice_table_header(p, x0, W, y, m):
+    fs, pad = m['fs13'], m['cell_pad']
+    widths = [W * r for r in m['cols']]
+    head_h = fs * 1.4 + pad * 2
+    p.rect(x0, y, W, head_h, fill=GREEN)
+    x = x0
+    for label, w in zip(['商品名 / 品名', '単 価(税込)', '数 量', '金 額(税込)'], widths):
+        p.text(x + w / 2, y + (head_h - fs) / 2, label, p.fit(label, fs, w - 4), white, align='center')
+        x += w
+    return y + head_h
+
+
+def invoice_row_height(p, W, m, name):
+    fs, pad = m['fs13'], m['cell_pad']
+    lines = p.wrap(name, fs, W * m['cols'][0] - pad * 2) if name else ['']
+    return fs * 1.4 * len(lines) + pad * 2, lines
+
+
+def draw_invoice_row(p, x0, W, y, m, cells, shaded, bold=False):
+    """明細1行を描いて、次の行の上端を返す。品名は列幅で折り返す"""
+    fs, pad = m['fs13'], m['cell_pad']
+    widths = [W * r for r in m['cols']]
+    row_h, name_lines = invoice_row_height(p, W, m, cells[0])
+    if shaded:
+        p.rect(x0, y, W, row_h, fill=GREEN_LIGHT)
+    ty = y + pad + fs * 0.2
+    for i, line in enumerate(name_lines):
+        p.text(x0 + pad, ty + fs * 1.4 * i, line, fs, bold=bold)
+    x = x0 + widths[0]
+    p.text(x + widths[1] - pad, ty, cells[1], p.fit(cells[1], fs, widths[1] - pad * 2), bold=bold, align='right')
+    x += widths[1]
+    p.text(x + widths[2] / 2, ty, cells[2], p.fit(cells[2], fs, widths[2] - 2), bold=bold, align='center')
+    x += widths[2]
+    p.text(x + widths[3] - pad, ty, cells[3], p.fit(cells[3], fs, widths[3] - pad * 2, bold), bold=bold, align='right')
+    return y + row_h
+
+
+def draw_invoice_table(p, doc, x0, W, y, m):
+    y = draw_invoice_table_header(p, x0, W, y, m)
+    items = doc['items']
+    for i in range(max(7, len(items))):
+        cells = _invoice_cells(doc, items[i]) if i < len(items) else ('', '', '', '')
+        y = draw_invoice_row(p, x0, W, y, m, cells, shaded=(i % 2 == 1))
+    return y
+
+
+def draw_carry_row(p, x0, W, y, m, label, amount):
+    y2 = draw_invoice_row(p, x0, W, y, m, (label, '', '', signed_yen(amount)), shaded=False, bold=True)
+    p.hline(x0, x0 + W, y, GREEN)
+    p.hline(x0, x0 + W, y2, GREEN)
+    return y2
+
+
+def _statement_reserve(m):
+    # 最終ページに必要な合計欄とフッターの高さ（draw_invoice_totals / draw_invoice_footer と同じ寸法）
+    return m['fs14'] * 1.4 + 20 * PX + 4 * PX + 20 * PX + 20 * PX + 160 * PX
+
+
+def draw_statement_table(p, doc, x0, W, y, m, caption):
+    """
+    明細書モード: 実際の行の高さを測りながら明細を描き、ページの下端に来たら
+    「次頁へ繰越」行を入れて改ページし、次のページに見出し行と「前頁より繰越」行を描く
+    """
+    bottom = PAGE_H - 15 * mm
+    reserve = _statement_reserve(m)
+    carry_h, _ = invoice_row_height(p, W, m, '前頁より繰越')
+    y = draw_invoice_table_header(p, x0, W, y, m)
+    items = doc['items']
+    row_style = doc.get('row_style', 'invoice')
+    running, page_no = 0, 1
+    for i, it in enumerate(items):
+        name, unit, qty, total_str, total_val = statement_row_cells(it, row_style)
+        row_h, _ = invoice_row_height(p, W, m, name)
+        # 最後の行なら合計欄・フッター、それ以外なら次頁へ繰越行が入る余白が要る
+        need = row_h + (reserve if i == len(items) - 1 else carry_h)
+        if y + need > bottom and i > 0:
+            draw_carry_row(p, x0, W, y, m, f'小計（{page_no}頁 次頁へ繰越）', running)
+            p.c.showPage()
+            page_no += 1
+            y = 15 * mm
+            p.text(x0 + W, y, caption(page_no), m['fs13'], align='right')
+            y = draw_invoice_table_header(p, x0, W, y + m['fs13'] * 1.5 + 10 * PX, m)
+            y = draw_carry_row(p, x0, W, y, m, '前頁より繰越', running)
+        running += total_val
+        y = draw_invoice_row(p, x0, W, y, m, (name, unit, str(qty), total_str), shaded=(i % 2 == 1))
+    if y + reserve > bottom:
+        # 最後の行の後に合計欄が入らないときは、合計欄を次のページに送る
+        draw_carry_row(p, x0, W, y, m, f'小計（{page_no}頁 次頁へ繰越）', running)
+        p.c.showPage()
+        y = 15 * mm
+        p.text(x0 + W, y, caption(page_no + 1), m['fs13'], align='right')
+        y = draw_carry_row(p, x0, W, y + m['fs13'] * 1.5 + 10 * PX, m, '前頁より繰越', running)
+    return y
+
+
+def draw_invoice_totals(p, doc, x0, W, y, m, labels=('小計 (税率10%)', '合計 (税込)'), values=None):
+    fs = m['fs14']
+    ratios = m['totals']
+    widths = [W * r / sum(ratios) for r in ratios]
+    h = fs * 1.4 + 20 * PX
+    total_str = f"¥{doc['total']:,}"
+    values = values or (total_str, total_str)
+    cells = [(labels[0], True), (values[0], False), ('', False), ('', False), (labels[1], True), (values[1], False)]
+    x = x0
+    for (s, is_label), w in zip(cells, widths):
+        if is_label:
+            p.rect(x, y, w, h, fill=GREEN)
+            p.text(x + w / 2, y + (h - fs) / 2, s, p.fit(s, fs, w - 4, True), white, bold=True, align='center')
+        elif s:
+            p.text(x + w - 15 * PX, y + (h - fs) / 2, s, p.fit(s, fs, w - 20 * PX, True), bold=True, align='right')
+        x += w
+    p.hline(x0, x0 + W, y + h + 2 * PX, GREEN, 2 * PX)
+    return y + h + 4 * PX + 20 * PX
+
+
+def draw_invoice_footer(p, x0, W, y, fs):
+    box_w = W * 0.48
+    p.rect(x0, y, box_w, 160 * PX, stroke=GREEN, line_width=2 * PX)
+    p.text(x0 + 15 * PX, y + 15 * PX, '備考欄 :', 11 * PX)
+
+    sx = x0 + W * 0.52
+    p.c.setFont('Helvetica-Bold', 32 * PX)
+    p.c.setFillColor(NAVY)
+    p.c.drawString(sx, p.y(y + 32 * PX * 0.9), 'evoke')
+    ly = y + 32 * PX + 5 * PX
+    for line in SENDER_LINES + ['登録番号', REGISTRATION_NO]:
+        p.text(sx, ly, line, fs)
+        ly += fs * 1.6
+    p.image(seal_image(), sx + box_w - 20 * PX - 80 * PX, y + 10 * PX, 80 * PX, 80 * PX)
+
+
+# ============================================================
+# お支払い通知書（chinajun_template.html）
+# ============================================================
+def draw_payment_notice(c, doc):
+    p = Painter(c)
+    x0, top = 15 * mm, 10 * mm
+    W = PAGE_W - 30 * mm
+    fs = 8.5
+
+    # --- ヘッダー ---
+    title_w = p.width('お支払い通知書', 18, True) + 40 * PX
+    title_h = 18 * 1.3 + 12 * PX
+    p.rect(x0, top, title_w, title_h, fill=DARK_GREEN, radius=4 * PX)
+    p.text(x0 + 20 * PX, top + (title_h - 18) / 2, 'お支払い通知書', 18, white, bold=True)
+    label = 'お支払い No：'
+    p.text(x0 + W, top, doc['number'], 9, bold=True, align='right')
+    p.text(x0 + W - p.width(doc['number'], 9, True), top, label, 9, align='right')
+    p.text(x0 + W, top + 9 * 1.8, f"作成日：{jp_date(doc['issue_date'])}", 9, align='right')
+    y = top + max(title_h, 9 * 1.8 * 2) + 6 * PX + 8 * PX
+
+    # --- 宛名 ---
+    name_size = p.fit(doc['recipient'], 14, W * 0.8, True)
+    p.text(x0, y, doc['recipient'], name_size, bold=True)
+    name_w = p.width(doc['recipient'], name_size, True)
+    p.hline(x0, x0 + name_w, y + name_size * 1.05, TEXT, 0.8)
+    p.text(x0 + name_w + 8 * PX, y + name_size - 12, '御 中', 12, DARK_GREEN, bold=True)
+    y += 14 * 1.4 + 6 * PX
+
+    # --- 左：支払い情報 / 右：振込先 ---
+    gap = 12 * PX
+    left_w = (W - gap) * 1.2 / 2.2
+    rx = x0 + left_w + gap
+    right_w = W - left_w - gap
+
+    ly = y
+    p.text(x0, ly, '下記の通りお支払い申し上げます。', 9)
+    ly += 9 * 1.4 + 8 * PX
+    box_h = 13 * 1.3 + 8 * PX
+    label_w = p.width('ご支払い金額', 10, True) + 20 * PX
+    p.rect(x0, ly, label_w, box_h, fill=DARK_GREEN)
+    p.rect(x0, ly, left_w, box_h, stroke=DARK_GREEN, line_width=1.5 * PX, radius=3 * PX)
+    p.text(x0 + 10 * PX, ly + (box_h - 10) / 2, 'ご支払い金額', 10, white, bold=True)
+    vx = x0 + label_w + 6 * PX
+    p.text(vx, ly + (box_h - 12) / 2, '¥', 12, bold=True)
+    vx += p.width('¥', 12, True) + 12 * PX
+    p.text(vx, ly + (box_h - 13) / 2, f"{doc['total']:,}", 13, bold=True)
+    p.text(x0 + left_w - 8 * PX, ly + (box_h - 14) / 2, '-', 14, bold=True, align='right')
+    ly += box_h + 6 * PX
+    p.text(x0, ly, f"（お支払い日） {jp_date(doc['due_date'])}", 9)
+    ly += 9 * 1.4
+
+    ry = y
+    bar_h = 9 * 1.3 + 8 * PX
+    p.rect(rx, ry, right_w, bar_h, fill=DARK_GREEN)
+    p.text(rx + right_w / 2, ry + (bar_h - 9) / 2, '振込先', 9, white, bold=True, align='center')
+    ry += bar_h
+    row_h = fs * 1.3 + 6 * PX
+    for label, value in CHINAJUN_BANK_ROWS:
+        p.rect(rx, ry, right_w * 0.3, row_h, fill=PALE_GREEN, stroke=GREY)
+        p.rect(rx + right_w * 0.3, ry, right_w * 0.7, row_h, stroke=GREY)
+        p.text(rx + 6 * PX, ry + (row_h - fs) / 2, label, fs, bold=True)
+        p.text(rx + right_w * 0.3 + 6 * PX, ry + (row_h - fs) / 2, value, p.fit(value, fs, right_w * 0.7 - 12 * PX))
+        ry += row_h
+    ry += 2 * PX
+    p.rect(rx, ry, right_w, row_h, fill=DARK_GREEN)
+    p.text(rx + 8 * PX, ry + (row_h - fs) / 2, 'インボイス番号', fs, white, bold=True)
+    p.text(rx + right_w - 8 * PX, ry + (row_h - fs) / 2, REGISTRATION_NO, fs, white, bold=True, align='right')
+    ry += row_h
+
+    # --- 明細 ---
+    y = max(ly, ry) + 8 * PX
+    y = draw_payment_table(p, doc, x0, top, W, y)
+    y = draw_payment_totals(p, doc, x0, W, y + 4 * PX)
+    draw_payment_footer(p, x0, W, y + 8 * PX)
+
+
+PAYMENT_COLS = [0.45, 0.15, 0.10, 0.15, 0.15]
+
+
+def payment_caption(doc):
+    return lambda page_no: f"お支払い No : {doc['number']}　{doc['recipient']} 御中　（{page_no}頁）"
+
+
+def _payment_reserve():
+    # 最終ページに必要な合計欄とフッターの高さ（draw_payment_totals / draw_payment_footer と同じ寸法）
+    return 4 * PX + (8.5 * 1.3 + 8 * PX) + 8 * PX + payment_footer_height()
+
+
+def draw_payment_table(p, doc, x0, top, W, y):
+    """
+    明細を描く。ページの下端に来たら改ページし、次のページの上に見出し行を繰り返す。
+    合計欄とフッターは最終ページに入るように、入らなければ最後に改ページする。
+    描いた行数が明細の数と合わなければ例外（documents.py は Chromium で描き直す）
+    """
+    bottom = PAGE_H - 10 * mm
+    reserve = _payment_reserve()
+    caption = payment_caption(doc)
+    items = doc['items']
+    page_no, drawn = 1, 0
+
+    def new_page():
+        p.c.showPage()
+        p.text(x0 + W, top, caption(page_no), 9, align='right')
+        return top + 9 * 1.4 + 6 * PX
+
+    y = draw_payment_table_header(p, x0, W, y)
+    for i, it in enumerate(items):
+        h, _ = payment_row_height(p, W, it['name'])
+        if y + h > bottom and drawn:
+            page_no += 1
+            y = draw_payment_table_header(p, x0, W, new_page())
+        y = draw_payment_row(p, x0, W, y, it, shaded=(i % 2 == 1))
+        drawn += 1
+    if y + reserve > bottom:
+        page_no += 1
+        y = new_page()
+    if drawn != len(items):
+        raise RuntimeError(f"drew {drawn} of {len(items)} payment rows")
+    return y
+
+
+def draw_payment_table_header(p, x0, W, y, fs=8.5):
+    widths = [W * r for r in PAYMENT_COLS]
+    h = fs * 1.3 + 10 * PX
+    x = x0
+    for label, w in zip(['品名', '単価(税込)', '数量', '金額(税込)', '備考欄'], widths):
+        p.rect(x, y, w, h, fill=DARK_GREEN, stroke=DARK_GREEN)
+        if label == '品名':
+            p.text(x + 6 * PX, y + (h - fs) / 2, label, fs, white, bold=True)
+        else:
+            p.text(x + w / 2, y + (h - fs) / 2, label, fs, white, bold=True, align='center')
+        x += w
+    return y + h
+
+
+def payment_row_height(p, W, name, fs=8.5):
+    lines = p.wrap(name, fs, W * PAYMENT_COLS[0] - 6 * PX * 2)
+    return fs * 1.3 * len(lines) + 6 * PX, lines
+
+
+def draw_payment_row(p, x0, W, y, it, shaded, fs=8.5):
+    widths = [W * r for r in PAYMENT_COLS]
+    pad = 6 * PX
+    h, lines = payment_row_height(p, W, it['name'], fs)
+    cells = [None, signed_yen(it['unit']), str(it['qty']), signed_yen(it['total']), '']
+    x = x0
+    for i, w in enumerate(widths):
+        p.rect(x, y, w, h, fill=PALER_GREEN if shaded else white, stroke=PALE_GREEN)
+        ty = y + 3 * PX + fs * 0.15
+        if i == 0:
+            for n, line in enumerate(lines):
+                p.text(x + pad, ty + fs * 1.3 * n, line, fs)
+        elif i == 2:
+            p.text(x + w / 2, ty, cells[i], fs, align='center')
+        else:
+            p.text(x + w - pad, ty, cells[i], p.fit(cells[i], fs, w - pad * 2), align='right')
+        x += w
+    return y + h
+
+
+def draw_payment_totals(p, doc, x0, W, y, fs=8.5, labels=('小計（税率10%）', '税抜', '合計（税込）')):
+    h = fs * 1.3 + 8 * PX
+    total_str = f"¥{doc['total']:,}"
+    cells = [(labels[0], True), (total_str, False), (labels[1], True), (f"¥{doc['tax_excl']:,}", False),
+             (None, False), (labels[2], True), (total_str, False)]
+    widths = []
+    for s, is_label in cells:
+        if s is None:
+            widths.append(0)
+        elif is_label:
+            widths.append(p.width(s, fs, True) + 16 * PX)
+        else:
+            widths.append(max(70 * PX, p.width(s, fs) + 20 * PX) + 1 * PX)
+    widths[4] = max(0, W - sum(widths))
+    p.rect(x0, y, W, h, stroke=PALE_GREEN)
+    x = x0
+    for (s, is_label), w in zip(cells, widths):
+        if s is None:
+            p.rect(x, y, w, h, fill=PALER_GREEN)
+        elif is_label:
+            p.rect(x, y, w, h, fill=DARK_GREEN)
+            p.text(x + 8 * PX, y + (h - fs) / 2, s, fs, white, bold=True)
+        else:
+            p.text(x + w - 10 * PX, y + (h - fs) / 2, s, fs, align='right')
+        x += w
+    return y + h
+
+
+def payment_footer_height():
+    notes = 9 * 1.4 + 50 * PX
+    company = 22 * 1.2 + 8.5 * 1.7 * (len(SENDER_LINES) + 2)
+    return max(notes, company)
+
+
+def draw_payment_footer(p, x0, W, y):
+    gap = 12 * PX
+    notes_w = (W - gap) * 1.5 / 2.5
+    p.text(x0, y, '備考欄：', 9, bold=True)
+    p.rect(x0, y + 9 * 1.4, notes_w, 50 * PX, stroke=GREY)
+
+    right = x0 + W
+    cy = y
+    p.text(right, cy, 'evoke', 22, DARK_GREEN, bold=True, align='right')
+    cy += 22 * 1.2
+    for line in SENDER_LINES + ['登録番号', REGISTRATION_NO]:
+        p.text(right, cy, line, 8.5, align='right')
+        cy += 8.5 * 1.7
+    p.image(seal_image(), right - 55 * PX, cy - 55 * PX, 55 * PX, 55 * PX)
+
+
+def write_preview(pdf_bytes, path):
+    """
+    native エンジンにはブラウザのページが無いので、pymupdf で描いた PDF の1ページ目を画像にする。
+    pymupdf が入っていなければ False（documents.py が Chromium でプレビューを作る）
+    """
+    try:
+        import pymupdf
+    except ImportError:
+        try:
+            import fitz as pymupdf
+        except ImportError:
+            return False
+    from render_service import PREVIEW_WIDTH, write_preview
+    with pymupdf.open(stream=pdf_bytes, filetype='pdf') as pdf:
+        # 縮小したときにきれいになるよう、2倍の解像度で描いてから render_service で縮小する
+        zoom = 2 * PREVIEW_WIDTH / PAGE_W
+        pix = pdf[0].get_pixmap(matrix=pymupdf.Matrix(zoom, zoom))
+        write_preview(path, pix.tobytes('png'))
+    return True
+
+
+def draw_document(doc):
+    """
+    doc（documents.py の形式）を PDF のバイト列にする
+    """
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=A4, pageCompression=1)
+    c.setTitle('お支払い通知書' if doc['kind'] == 'payment_notice' else '請求書')
+    if doc['layout'] == 'chinajun':
+        draw_payment_notice(c, doc)
+    else:
+        draw_invoice(c, doc)
+    c.showPage()
+    c.save()
+    return buf.getvalue()
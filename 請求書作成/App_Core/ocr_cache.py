@@ -0,0 +1,137 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+
+# OCR 結果のキャッシュ。同じ画像を batch_gen.py や --parse-only で何度読み直しても、
+# Vision を呼ぶのは最初の1回だけにする（料金と待ち時間の節約）。
+# キーは「画像バイト列の SHA-256」と「OCR エンジンのバージョン」の組。エンジンや設定を
+# 変えたらバージョン文字列を変えれば、古い結果は使われずに自然に追い出される。
+#
+# キャッシュの中身（CACHE_DIR）:
+#   <key>.json … {'engine': バージョン, 'image_sha256': ..., 'created': 作成時刻, 'result': OCR結果}
+#   <key>.json.<pid>.<thread>.tmp … 書き込み中のファイル（書き終わったら <key>.json に置き換える）
+# 使うたびに更新日時を新しくし、合計サイズが MAX_BYTES を超えたら古い順に消す。
+# キャッシュに書けなくても OCR 結果はそのまま使う（警告だけ出す）。
+# OCR_CACHE=0 で無効。python ocr_cache.py --purge で全部消す。
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(SCRIPT_DIR)
+OUT_DIR = os.environ.get("INVOICE_OUT_DIR") or os.path.join(BASE_DIR, "作成済み請求書")
+CACHE_DIR = os.environ.get("OCR_CACHE_DIR") or os.path.join(OUT_DIR, ".ocr_cache")
+
+MAX_BYTES = int(float(os.environ.get("OCR_CACHE_MAX_MB", "100")) * 1024 * 1024)
+ENABLED = os.environ.get("OCR_CACHE", "1") != "0"
+# これより古い .tmp は、書き込み中に落ちたプロセスの残骸とみなして prune で消す（秒）
+STALE_TMP_SEC = 3600
+
+_lock = threading.Lock()
+
+
+def image_key(content, engine):
+    """画像のバイト列とエンジンのバージョンからキーを作る"""
+    image_sha = hashlib.sha256(content).hexdigest()
+    return hashlib.sha256(f"{engine}\0{image_sha}".encode('utf-8')).hexdigest(), image_sha
+
+
+def _path(key):
+    return os.path.join(CACHE_DIR, f"{key}.json")
+
+
+def get(content, engine):
+    """キャッシュ済みの OCR 結果を返す。無ければ None"""
+    if not ENABLED:
+        return None
+    key, _ = image_key(content, engine)
+    path = _path(key)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if entry.get('engine') != engine:
+        return None
+    try:
+        os.utime(path)  # 最近使ったものを追い出さないように
+    except OSError:
+        pass
+    return entry['result']
+
+
+def put(content, engine, result):
+    """
+    OCR 結果（JSON にできる値）を保存する。書けなかったら警告だけ出す（呼び出し側の処理は止めない）
+    """
+    if not ENABLED:
+        return
+    key, image_sha = image_key(content, engine)
+    entry = {'engine': engine, 'image_sha256': image_sha, 'created': time.time(), 'result': result}
+    path = _path(key)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"[WARN] could not write the OCR cache: {e}")
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return
+    prune()
+
+
+def prune(max_bytes=MAX_BYTES):
+    """
+    合計サイズが max_bytes を超えたら、最後に使ったのが古い順に消す。消した数を返す。
+    書き込み中の .tmp（別スレッド・別プロセスのものかもしれない）は数えず、STALE_TMP_SEC より古いものだけ消す
+    """
+    if not os.path.isdir(CACHE_DIR):
+        return 0
+    with _lock:
+        now = time.time()
+        entries = []
+        removed = 0
+        try:
+            names = os.listdir(CACHE_DIR)
+        except OSError as e:
+            print(f"[WARN] could not prune the OCR cache: {e}")
+            return 0
+        for name in names:
+            path = os.path.join(CACHE_DIR, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if name.endswith('.tmp'):
+                if now - st.st_mtime > STALE_TMP_SEC:
+                    try:
+                        os.remove(path)
+                        removed += 1
+                    except OSError:
+                        pass
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == '--purge':
+        print(f"removed {prune(max_bytes=0)} cache files")
+    else:
+        print(f"removed {prune()} cache files over the size limit")
@@ -0,0 +1,340 @@
+import os
+import re
+import sys
+import json
+import math
+import shutil
+import asyncio
+import threading
+import subprocess
+
+import numpy as np
+from dotenv import load_dotenv
+
+import ocr_cache
+
+# OCR エンジンの切り替え口。どのエンジンも recognize(画像のバイト列) で同じ形の結果を返す:
+#   {'engine': バージョン, 'text': 全文,
+#    'words': [{'text': 文字列, 'box': [[x, y] × 4], 'confidence': 0〜1 または None}, ...],
+#    'skew': 紙の傾き（ラジアン。エンジンが返さなければ None）}
+# 枠の頂点の順は ocr_layout.py と同じ 左上・右上・右下・左下。結果は JSON にできるので、
+# そのまま OCR キャッシュ（ocr_cache.py）に入れる。
+#
+# エンジン:
+#   vision    … Google Cloud Vision（document_text_detection）。通信あり・従量課金
+#   tesseract … ローカルの Tesseract（jpn）。通信なし。tesseract コマンドと jpn の学習データが必要
+#   windows   … Windows 標準の OCR（winsdk）。Windows のみ
+#   auto      … 画像の種類で選ぶ（ROUTES）。スクリーンショット（PNG）は文字がきれいなので
+#                ローカルのエンジンで足りる。写真（JPEG）や PDF は Vision を先に試す
+# OCR_ENGINE（または batch_gen.py の --ocr-engine）で選ぶ。既定は vision。
+
+load_dotenv()
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(SCRIPT_DIR)
+
+DEFAULT_ENGINE = os.environ.get("OCR_ENGINE", "vision")
+TESSERACT_CMD = os.environ.get("TESSERACT_CMD", "tesseract")
+TESSERACT_LANG = os.environ.get("TESSERACT_LANG", "jpn")
+# レシートは1段組みの表なので「1つのまとまったテキスト」として読ませる
+TESSERACT_PSM = os.environ.get("TESSERACT_PSM", "6")
+
+# 画像の拡張子 → 試す順（使えるものを先頭から選ぶ）
+ROUTES = {
+    '.png': ('tesseract', 'windows', 'vision'),
+    '.jpg': ('vision', 'windows', 'tesseract'),
+    '.jpeg': ('vision', 'windows', 'tesseract'),
+    '.pdf': ('vision',),
+}
+
+
+def _word(text, box, confidence=None):
+    return {'text': text, 'box': [[float(x), float(y)] for x, y in box], 'confidence': confidence}
+
+
+def _rect(x, y, w, h):
+    return [(x, y), (x + w, y), (x + w, y + h), (x, y + h)]
+
+
+def word_arrays(result):
+    """結果の単語を (文字列リスト, 枠の配列 (n, 4, 2), 確からしさの配列) にする（ocr_layout・ocr_table 用）"""
+    words = result['words']
+    texts = [w['text'] for w in words]
+    boxes = np.array([w['box'] for w in words], dtype=float).reshape(-1, 4, 2)
+    conf = np.array([np.nan if w.get('confidence') is None else w['confidence'] for w in words], dtype=float)
+    return texts, boxes, conf
+
+
+class VisionEngine:
+    name = 'vision'
+    # 結果の形や解析の仕方を変えたら上げる（OCR キャッシュのキーに入る）
+    version = "google-vision:document_text_detection:2"
+
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    def available(self):
+        try:
+            from google.cloud import vision  # noqa: F401
+        except ImportError:
+            return False
+        paths = [os.environ.get("GOOGLE_APPLICATION_CREDENTIALS"),
+                 os.path.join(os.path.dirname(BASE_DIR), "google-credentials.json"),
+                 "/etc/secrets/google-credentials.json"]
+        if os.environ.get("VISION_API_ENDPOINT") or any(p and os.path.exists(p) for p in paths):
+            return True
+        # 鍵ファイルが無くても、gcloud auth application-default login や GCE / Cloud Run の
+        # メタデータサーバーの認証情報（ADC）があれば使える（_build_client の最後と同じ）
+        import google.auth
+        from google.auth.exceptions import DefaultCredentialsError
+        try:
+            google.auth.default()
+        except DefaultCredentialsError:
+            return False
+        return True
+
+    def client(self):
+        """
+        Vision クライアントを1回だけ作って使い回す（スレッド間で共有してよい）。
+        VISION_API_ENDPOINT を指定すると、その接続先（テスト用のローカルのスタンドインなど）を使う。
+        http:// で始まる接続先には REST・認証なしで接続する
+        """
+        with self._lock:
+            if self._client is None:
+                self._client = self._build_client()
+            return self._client
+
+    def _build_client(self):
+        from google.cloud import vision
+        from google.oauth2 import service_account
+
+        endpoint = os.environ.get("VISION_API_ENDPOINT")
+        if endpoint and endpoint.startswith("http://"):
+            from google.auth.credentials import AnonymousCredentials
+            print(f"[DEBUG] Using Vision endpoint {endpoint} without credentials")
+            return vision.ImageAnnotatorClient(credentials=AnonymousCredentials(), transport="rest",
+                                               client_options={"api_endpoint": endpoint})
+        options = {"api_endpoint": endpoint} if endpoint else None
+
+        creds_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
+        fallback_path = os.path.join(os.path.dirname(BASE_DIR), "google-credentials.json")
+        render_secret_path = "/etc/secrets/google-credentials.json"
+
+        print(f"[DEBUG] creds_path from env: {creds_path} (exists: {os.path.exists(creds_path) if creds_path else False})")
+        print(f"[DEBUG] fallback_path: {fallback_path} (exists: {os.path.exists(fallback_path)})")
+        print(f"[DEBUG] render_secret_path: {render_secret_path} (exists: {os.path.exists(render_secret_path)})")
+
+        try:
+            if creds_path and os.path.exists(creds_path):
+                print("[DEBUG] Using creds_path")
+                creds = service_account.Credentials.from_service_account_file(creds_path)
+                return vision.ImageAnnotatorClient(credentials=creds, client_options=options)
+            elif os.path.exists(fallback_path):
+                print("[DEBUG] Using fallback_path")
+                creds = service_account.Credentials.from_service_account_file(fallback_path)
+                return vision.ImageAnnotatorClient(credentials=creds, client_options=options)
+            elif os.path.exists(render_secret_path):
+                print("[DEBUG] Using render_secret_path")
+                creds = service_account.Credentials.from_service_account_file(render_secret_path)
+                return vision.ImageAnnotatorClient(credentials=creds, client_options=options)
+            else:
+                print("[DEBUG] Using default ADC")
+                return vision.ImageAnnotatorClient(client_options=options)
+        except Exception as e:
+            print(f"[ERROR] Failed to initialize Vision client: {e}")
+            raise e
+
+    def recognize(self, content):
+        from google.cloud import vision
+
+        response = self.client().document_text_detection(image=vision.Image(content=content))
+        if response.error.message:
+            raise Exception(f"{response.error.message}")
+        annotation = type(response.full_text_annotation).pb(response.full_text_annotation)
+        words = []
+        for page in annotation.pages:
+            for block in page.blocks:
+                for paragraph in block.paragraphs:
+                    for word in paragraph.words:
+                        box = [(v.x, v.y) for v in word.bounding_box.vertices]
+                        if len(box) != 4:
+                            xs = [p[0] for p in box] or [0]
+                            ys = [p[1] for p in box] or [0]
+                            box = _rect(min(xs), min(ys), max(xs) - min(xs), max(ys) - min(ys))
+                        words.append(_word(''.join([s.text for s in word.symbols]), box, word.confidence or None))
+        return {'engine': self.version, 'text': annotation.text, 'words': words, 'skew': None}
+
+
+class TesseractEngine:
+    name = 'tesseract'
+
+    def __init__(self, cmd=TESSERACT_CMD, lang=TESSERACT_LANG, psm=TESSERACT_PSM):
+        self.cmd = cmd
+        self.lang = lang
+        self.psm = psm
+        self._version = None
+
+    @property
+    def version(self):
+        if self._version is None:
+            try:
+                out = subprocess.run([self.cmd, '--version'], capture_output=True, text=True, timeout=30)
+                first = (out.stdout or out.stderr).strip().splitlines()[0]
+            except (OSError, IndexError, subprocess.SubprocessError):
+                first = 'unknown'
+            self._version = f"{first}:{self.lang}:psm{self.psm}:1"
+        return self._version
+
+    def available(self):
+        if shutil.which(self.cmd) is None:
+            return False
+        try:
+            out = subprocess.run([self.cmd, '--list-langs'], capture_output=True, text=True, timeout=30)
+        except (OSError, subprocess.SubprocessError):
+            return False
+        langs = set((out.stdout + out.stderr).split())
+        return all(lang in langs for lang in self.lang.split('+'))
+
+    def recognize(self, content):
+        # 画像は標準入力で渡し、単語ごとの位置と確からしさを TSV で受け取る
+        proc = subprocess.run([self.cmd, 'stdin', 'stdout', '-l', self.lang, '--psm', str(self.psm), 'tsv'],
+                              input=content, capture_output=True, timeout=120)
+        if proc.returncode != 0:
+            raise Exception(f"tesseract failed: {proc.stderr.decode('utf-8', 'replace').strip()}")
+        lines = {}
+        for record in proc.stdout.decode('utf-8', 'replace').splitlines()[1:]:
+            cols = record.split('\t')
+            if len(cols) < 12 or cols[0] != '5' or not cols[11].strip():
+                continue
+            key = tuple(cols[1:5])  # page, block, paragraph, line
+            x, y, w, h = (int(c) for c in cols[6:10])
+            conf = float(cols[10])
+            lines.setdefault(key, []).append([cols[11].strip(), x, y, w, h, conf / 100 if conf >= 0 else None])
+        words = []
+        text_lines = []
+        for key in sorted(lines, key=lambda k: tuple(int(c) for c in k)):
+            merged = _join_cjk(lines[key])
+            words.extend(_word(t, _rect(x, y, w, h), c) for t, x, y, w, h, c in merged)
+            text_lines.append(' '.join(m[0] for m in merged))
+        return {'engine': self.version, 'text': '\n'.join(text_lines), 'words': words, 'skew': None}
+
+
+_CJK_RE = re.compile(r'[　-ヿ㐀-鿿＀-￯]')
+
+
+def _join_cjk(words):
+    """
+    Tesseract（jpn）は日本語を1〜数文字ずつの単語に切って返すので、同じ行で隙間の小さい
+    日本語の単語どうしをつなぐ（「単」「価」→「単価」）。数字や英字の単語はそのまま
+    """
+    merged = []
+    for w in words:
+        if merged:
+            prev = merged[-1]
+            gap = w[1] - (prev[1] + prev[3])
+            if (_CJK_RE.search(prev[0][-1]) and _CJK_RE.search(w[0][0])
+                    and gap < 0.5 * max(prev[4], w[4])):
+                x0, y0 = prev[1], min(prev[2], w[2])
+                x1, y1 = w[1] + w[3], max(prev[2] + prev[4], w[2] + w[4])
+                confs = [c for c in (prev[5], w[5]) if c is not None]
+                merged[-1] = [prev[0] + w[0], x0, y0, x1 - x0, y1 - y0, min(confs) if confs else None]
+                continue
+        merged.append(list(w))
+    return merged
+
+
+class WindowsEngine:
+    name = 'windows'
+    version = "windows-media-ocr:user-profile-languages:1"
+
+    def available(self):
+        if sys.platform != 'win32':
+            return False
+        try:
+            import winsdk.windows.media.ocr  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def recognize(self, content):
+        # winsdk は非同期 API なので、呼び出したスレッドでイベントループを回す
+        return asyncio.run(self._recognize(content))
+
+    async def _recognize(self, content):
+        from winsdk.windows.media.ocr import OcrEngine
+        from winsdk.windows.graphics.imaging import BitmapDecoder
+        from winsdk.windows.storage.streams import InMemoryRandomAccessStream, DataWriter
+
+        stream = InMemoryRandomAccessStream()
+        writer = DataWriter(stream)
+        writer.write_bytes(content)
+        await writer.store_async()
+        await writer.flush_async()
+        writer.detach_stream()
+        stream.seek(0)
+        decoder = await BitmapDecoder.create_async(stream)
+        bitmap = await decoder.get_software_bitmap_async()
+        engine = OcrEngine.try_create_from_user_profile_languages()
+        result = await engine.recognize_async(bitmap)
+        words = [_word(word.text, _rect(word.bounding_rect.x, word.bounding_rect.y,
+                                        word.bounding_rect.width, word.bounding_rect.height))
+                 for line in result.lines for word in line.words]
+        # Windows OCR の枠は水平な矩形なので、傾きはエンジンが返す角度を使う
+        skew = math.radians(result.text_angle) if result.text_angle is not None else None
+        return {'engine': self.version, 'text': result.text, 'words': words, 'skew': skew}
+
+
+ENGINES = {
+    'vision': VisionEngine(),
+    'tesseract': TesseractEngine(),
+    'windows': WindowsEngine(),
+}
+NAMES = ('auto',) + tuple(ENGINES)
+
+
+def get(name):
+    if name not in ENGINES:
+        raise ValueError(f"unknown OCR engine: {name} (choose from {', '.join(NAMES)})")
+    return ENGINES[name]
+
+
+def choose(name=None, filename=None):
+    """
+    使うエンジンを返す。name が auto なら、画像の拡張子ごとの ROUTES の順に使えるものを選ぶ
+    """
+    name = name or DEFAULT_ENGINE
+    if name != 'auto':
+        return get(name)
+    ext = os.path.splitext(filename or '')[1].lower()
+    for candidate in ROUTES.get(ext, ('vision', 'windows', 'tesseract')):
+        engine = ENGINES[candidate]
+        if engine.available():
+            return engine
+    raise Exception(f"no OCR engine is available for {filename}")
+
+
+def recognize(content, engine):
+    """
+    画像のバイト列を engine で読む。同じ画像・同じエンジンの結果が OCR キャッシュにあればそれを返す
+    """
+    cached = ocr_cache.get(content, engine.version)
+    if cached is not None:
+        print(f"[DEBUG] OCR cache hit ({engine.name})")
+        return cached
+    result = engine.recognize(content)
+    ocr_cache.put(content, engine.version, result)
+    return result
+
+
+if __name__ == "__main__":
+    # python ocr_engines.py [画像 [エンジン]] : 使えるエンジンの一覧・画像を読んだ結果を表示する
+    for engine in ENGINES.values():
+        print(f"{engine.name}: {'available' if engine.available() else 'not available'}")
+    if len(sys.argv) >= 2:
+        path = sys.argv[1]
+        engine = choose(sys.argv[2] if len(sys.argv) >= 3 else None, path)
+        with open(path, 'rb') as f:
+            result = recognize(f.read(), engine)
+        print(json.dumps({'engine': result['engine'], 'words': len(result['words']), 'text': result['text']},
+                         ensure_ascii=False, indent=2))
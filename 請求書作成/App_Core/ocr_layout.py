@@ -0,0 +1,100 @@
+import math
+
+import numpy as np
+
+# OCR の単語を行にまとめる。
+# 以前は min_y で並べて「前の行の先頭から 15px 以上離れたら次の行」としていたので、
+# 解像度の高い写真（文字の高さが 15px を大きく超える）や、傾いたレシートで行が崩れていた。
+# ここでは単語の枠を一度に NumPy 配列にして（中心・高さ・傾き）、
+#   1. 長めの単語の傾きの中央値から紙全体の傾きを求め、その分だけ座標を回して水平に戻す
+#   2. 縦に並べた単語の中心の間隔が、隣り合う単語の高さ × LINE_GAP を超えたところで行を分ける
+#   3. 行の中は（回した後の）x の順に並べる
+# 何千語あっても、Python のループは単語を取り出す1回だけで済む。
+#
+# 枠は単語ごとの4頂点 (n, 4, 2)。頂点の順は Vision と同じ 左上・右上・右下・左下（文字の向き基準）。
+
+# 行を分ける間隔（単語の高さに対する割合）
+LINE_GAP = 0.5
+# 傾きを求めるのに使う単語（幅が高さのこの倍以上）。短い単語は傾きが当てにならない
+SKEW_MIN_ASPECT = 1.5
+
+
+def rect_words(words):
+    """
+    (文字列, x, y, 幅, 高さ) の並びから (文字列リスト, 枠の配列) を作る。
+    Windows OCR（winsdk）のように枠が水平な矩形で返るエンジン用
+    """
+    texts = [w[0] for w in words]
+    if not words:
+        return texts, np.zeros((0, 4, 2))
+    r = np.array([w[1:5] for w in words], dtype=float)
+    x0, y0, x1, y1 = r[:, 0], r[:, 1], r[:, 0] + r[:, 2], r[:, 1] + r[:, 3]
+    boxes = np.stack([np.stack([x0, y0], 1), np.stack([x1, y0], 1),
+                      np.stack([x1, y1], 1), np.stack([x0, y1], 1)], 1)
+    return texts, boxes
+
+
+def word_geometry(boxes):
+    """枠から各単語の中心 (n, 2)・幅・高さ・傾き（ラジアン）を求める"""
+    center = boxes.mean(axis=1)
+    top = boxes[:, 1] - boxes[:, 0]
+    side = boxes[:, 3] - boxes[:, 0]
+    width = np.hypot(top[:, 0], top[:, 1])
+    height = np.hypot(side[:, 0], side[:, 1])
+    angle = np.arctan2(top[:, 1], top[:, 0])
+    return center, width, height, angle
+
+
+def estimate_skew(width, height, angle):
+    """紙全体の傾き（ラジアン）。横長の単語の傾きの中央値"""
+    if len(angle) == 0:
+        return 0.0
+    usable = width >= height * SKEW_MIN_ASPECT
+    sample = angle[usable] if usable.any() else angle
+    # ±180° をまたぐ角度でも中央値が崩れないように、単位ベクトルの向きの中央値で取る
+    return float(math.atan2(np.median(np.sin(sample)), np.median(np.cos(sample))))
+
+
+def deskew(boxes, skew=None):
+    """
+    枠を、傾きを打ち消す向きに回した座標 (n, 4, 2) にする。使った傾き（ラジアン）と一緒に返す。
+    skew を渡さなければ単語の枠から推定する
+    """
+    if skew is None:
+        if len(boxes) == 0:
+            return boxes, 0.0
+        _, width, height, angle = word_geometry(boxes)
+        skew = estimate_skew(width, height, angle)
+    cos, sin = math.cos(skew), math.sin(skew)
+    x = boxes[..., 0] * cos + boxes[..., 1] * sin
+    y = -boxes[..., 0] * sin + boxes[..., 1] * cos
+    return np.stack([x, y], axis=-1), skew
+
+
+def cluster_lines(boxes, skew=None):
+    """
+    単語を行に分け、上の行から順に「x の順に並べた単語の番号の配列」のリストを返す。
+    skew（ラジアン）を渡さなければ単語の枠から推定する
+    """
+    if len(boxes) == 0:
+        return []
+    _, _, height, _ = word_geometry(boxes)
+    # 傾きを打ち消すように回した座標
+    center = deskew(boxes, skew)[0].mean(axis=1)
+    x, y = center[:, 0], center[:, 1]
+
+    # 高さ 0 の枠（Vision が頂点を省略した場合など）は全体の中央値で補う
+    h = np.where(height > 0, height, np.median(height[height > 0]) if (height > 0).any() else 1.0)
+    order = np.argsort(y, kind='stable')
+    ys, hs = y[order], h[order]
+    gaps = np.diff(ys)
+    breaks = np.flatnonzero(gaps > LINE_GAP * np.minimum(hs[:-1], hs[1:])) + 1
+    lines = []
+    for members in np.split(order, breaks):
+        lines.append(members[np.argsort(x[members], kind='stable')])
+    return lines
+
+
+def rows_text(texts, lines):
+    """cluster_lines の結果を、単語を空白でつないだ行の文字列にする"""
+    return [" ".join([texts[i] for i in line]) for line in lines]
@@ -0,0 +1,206 @@
+import re
+import unicodedata
+
+import numpy as np
+
+import ocr_layout
+
+# OCR の単語の x 位置から、明細の 単価・数量・金額 の列を見つけて、数字を列ごとに読む。
+# 行を1本の文字列にしてから正規表現で数字を探すと、どの数字がどの列か分からず、
+# カンマが落ちた「3 66980200940」のような行は数字の切り方を総当たりするしかなかった。
+# ここでは（ocr_layout で傾きを戻した）単語の枠を使って
+#   1. 見出しの行（単価・数量・金額 のうち2つ以上を含む行）があれば、見出しの単語の中心を列の位置にする
+#   2. 見出しが無ければ、数字の単語の右端（金額は右寄せ）が縦にそろう位置を列にする
+#   3. 各行の数字の単語をいちばん近い列に入れる
+# カンマの前後で2単語に分かれて読まれた数字（「120」「,000」）は、列を探す前につないで1つの数字にする。
+# 列に入らなかった単語は品名として扱う。
+
+# 見出しの単語 → 列の種類
+HEADER_WORDS = {
+    '単価': 'unit', '価格': 'unit', '売価': 'unit',
+    '数量': 'qty', '個数': 'qty',
+    '金額': 'total',
+}
+# 数字の右端を同じ列とみなす幅（単語の高さに対する割合）
+ALIGN_TOL = 1.5
+# 見出しが無いとき、列とみなすのに必要な「その位置に数字がある行」の数
+MIN_SUPPORT = 2
+# 数量として認める上限
+MAX_QTY = 100
+
+NUMBER_RE = re.compile(r'[¥\\]?[\d,.]*\d[\d,.]*円?')
+# 数字の前後に離れて読まれた記号だけの単語（品名にも数字にも入れない）
+SYMBOL_RE = re.compile(r'[¥\\,.円@×xX*]+')
+# JAN コードなど長い数字は金額ではない（品名側に残す）
+MAX_PRICE_DIGITS = 7
+
+
+def _digits(text):
+    return re.sub(r'[^\d]', '', text)
+
+
+def _is_number(text):
+    return NUMBER_RE.fullmatch(text) is not None and len(_digits(text)) <= MAX_PRICE_DIGITS
+
+
+def _header_columns(texts, lines, left, right):
+    """見出しの行を探して [(列の種類, 列の中心の x)] を返す。見つからなければ None"""
+    for line in lines:
+        found = {}
+        for i in line:
+            hits = [kind for word, kind in HEADER_WORDS.items() if word in texts[i]]
+            # 1つの単語に見出しが2つくっついていると位置が決まらないので使わない
+            if len(set(hits)) == 1 and hits[0] not in found:
+                found[hits[0]] = (left[i] + right[i]) / 2
+        if len(found) >= 2:
+            return sorted(found.items(), key=lambda kv: kv[1])
+    return None
+
+
+def _join_numbers(idx, texts, left, right, gap):
+    """
+    1行の数字の単語（x の順）を、カンマ・小数点の前後で分かれたものをつないだ組のリストにする。
+    間が gap より離れていればつながない
+    """
+    groups = []
+    for i in idx:
+        if groups:
+            prev = groups[-1][-1]
+            split = texts[i][0] in ',.' or texts[prev][-1] in ',.'
+            if split and left[i] - right[prev] <= gap:
+                groups[-1].append(i)
+                continue
+        groups.append([i])
+    return groups
+
+
+def _aligned_columns(numbers, right, tol):
+    """
+    数字の右端が縦にそろう位置を列にする（右から3列まで）。
+    numbers: 行ごとの数字（_join_numbers の組）のリスト。戻り値は右端の x（左から順）
+    """
+    edges = []
+    rows = []
+    for r, groups in enumerate(numbers):
+        for g in groups:
+            edges.append(right[g[-1]])
+            rows.append(r)
+    if not edges:
+        return []
+    edges = np.array(edges)
+    rows = np.array(rows)
+    order = np.argsort(edges, kind='stable')
+    breaks = np.flatnonzero(np.diff(edges[order]) > tol) + 1
+    columns = []
+    for members in np.split(order, breaks):
+        if len(set(rows[members].tolist())) >= MIN_SUPPORT:
+            columns.append(float(np.median(edges[members])))
+    return columns[-3:]
+
+
+def _name_columns(columns, values):
+    """
+    見出しが無いときの列の種類を、中の数字から決める。
+    数量の列は小さい整数だけ。残りは左から 単価・金額（1列しかなければ金額）
+    """
+    kinds = [None] * len(columns)
+    qty_col = None
+    for c in range(len(columns) - 1):
+        vals = values[c]
+        if vals and all(0 < v < MAX_QTY for v in vals):
+            qty_col = c
+            break
+    if qty_col is not None:
+        kinds[qty_col] = 'qty'
+    rest = [c for c in range(len(columns)) if c != qty_col]
+    kinds[rest[-1]] = 'total'
+    if len(rest) >= 2:
+        kinds[rest[-2]] = 'unit'
+    return kinds
+
+
+def extract(texts, boxes, lines, skew=None):
+    """
+    ocr_layout.cluster_lines の結果（lines）を表として読む。
+    戻り値は行ごとの {'name': 品名の文字列, 'unit', 'qty', 'total'}（読めなかった列は None）。
+    列が見つからない行や、数字が無い行は None
+    """
+    if len(boxes) == 0:
+        return [None] * len(lines)
+    texts = [unicodedata.normalize('NFKC', t) for t in texts]
+    rotated, _ = ocr_layout.deskew(boxes, skew)
+    left = rotated[:, :, 0].min(axis=1)
+    right = rotated[:, :, 0].max(axis=1)
+    _, _, height, _ = ocr_layout.word_geometry(boxes)
+    heights = height[height > 0]
+    char_h = float(np.median(heights)) if len(heights) else 1.0
+    tol = ALIGN_TOL * char_h
+
+    numbers = [_join_numbers([i for i in line if _is_number(texts[i])], texts, left, right, char_h)
+               for line in lines]
+
+    header = _header_columns(texts, lines, left, right)
+    if header is not None:
+        kinds = [kind for kind, _ in header]
+        anchors = [x for _, x in header]
+        # 見出しは列の中ほどに書かれるので、隣の見出しとの中間を列の境目にする
+        spacing = (anchors[-1] - anchors[0]) / (len(anchors) - 1)
+        bounds = [anchors[0] - spacing / 2]
+        bounds += [(a + b) / 2 for a, b in zip(anchors, anchors[1:])]
+        bounds.append(anchors[-1] + spacing / 2 + tol)
+
+        def column_of(g):
+            x = (left[g[0]] + right[g[-1]]) / 2
+            for c in range(len(anchors)):
+                if bounds[c] <= x < bounds[c + 1]:
+                    return c
+            return None
+    else:
+        anchors = _aligned_columns(numbers, right, tol)
+        if not anchors:
+            return [None] * len(lines)
+
+        def column_of(g):
+            x = right[g[-1]]
+            c = int(np.argmin([abs(x - a) for a in anchors]))
+            return c if abs(x - anchors[c]) <= tol else None
+
+    cells_by_row = []
+    for groups in numbers:
+        cells = {}
+        for g in groups:
+            c = column_of(g)
+            if c is not None:
+                cells.setdefault(c, []).extend(g)
+        cells_by_row.append(cells)
+
+    if header is None:
+        values = [[] for _ in anchors]
+        for cells in cells_by_row:
+            for c, members in cells.items():
+                d = _digits(''.join(texts[i] for i in members))
+                if d:
+                    values[c].append(int(d))
+        kinds = _name_columns(anchors, values)
+
+    table = []
+    for line, cells in zip(lines, cells_by_row):
+        if not cells:
+            table.append(None)
+            continue
+        used = {i for members in cells.values() for i in members}
+        row = {'name': ' '.join(texts[i] for i in line
+                                if i not in used and not SYMBOL_RE.fullmatch(texts[i])),
+               'unit': None, 'qty': None, 'total': None}
+        for c, members in cells.items():
+            d = _digits(''.join(texts[i] for i in members))
+            if d and kinds[c] is not None:
+                row[kinds[c]] = int(d)
+        table.append(row)
+    return table
+
+
+def read(texts, boxes, skew=None):
+    """単語の並びを (行の文字列のリスト, 行ごとの表の読み) にする"""
+    lines = ocr_layout.cluster_lines(boxes, skew)
+    return ocr_layout.rows_text(texts, lines), extract(texts, boxes, lines, skew)
@@ -0,0 +1,230 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+
+# 同じ依頼の再送（LINE の再送・確認後の再実行など）で請求書を2回作らないためのPDFキャッシュ。
+# 呼び出し側が渡す idempotency key（例: メッセージID）と、宛先・明細・日付・テンプレートの
+# バージョンを正規化したものをまとめてハッシュし、キーにする。連番（請求No）は含めないので、
+# 同じ依頼が来たら採番も描画もせずに前回のPDFを返す。
+# idempotency key が無い依頼はキャッシュしない（同じ内容でも別の請求書として作る）。
+#
+# キャッシュの中身（CACHE_DIR）:
+#   <key>.json   … {'path': 出力先, 'number': 請求No, 'sha256': PDFのハッシュ, 'created': 作成時刻}
+#   <key>.pdf    … PDF本体のコピー（出力先のPDFが消えていたら書き戻す）
+#   locks/<key>.lock … 同じキーの依頼を1件ずつ通すためのロックファイル（locked()）
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(SCRIPT_DIR)
+OUT_DIR = os.environ.get("INVOICE_OUT_DIR") or os.path.join(BASE_DIR, "作成済み請求書")
+CACHE_DIR = os.environ.get("PDF_CACHE_DIR") or os.path.join(OUT_DIR, ".pdf_cache")
+
+MAX_AGE_DAYS = float(os.environ.get("PDF_CACHE_MAX_AGE_DAYS", "30"))
+MAX_BYTES = int(float(os.environ.get("PDF_CACHE_MAX_MB", "200")) * 1024 * 1024)
+ENABLED = os.environ.get("PDF_CACHE", "1") != "0"
+
+_lock = threading.Lock()
+
+
+def _normalize_items(items):
+    out = []
+    for it in items:
+        row = {'name': str(it.get('name', '')).strip()}
+        for k in ('unit', 'qty', 'total'):
+            try: row[k] = int(it.get(k))
+            except (TypeError, ValueError): row[k] = None
+        out.append(row)
+    return out
+
+
+def request_key(doc, template_version='', idempotency_key=None):
+    """
+    idempotency key と、doc（documents.py の形式）の請求No以外の中身をまとめてハッシュする
+    """
+    payload = {
+        'idempotency_key': idempotency_key,
+        'kind': doc.get('kind'),
+        'series': doc.get('series'),
+        'layout': doc.get('layout'),
+        'compact': bool(doc.get('compact')),
+        'row_style': doc.get('row_style'),
+        'recipient': (doc.get('recipient') or '').strip(),
+        'issue_date': str(doc.get('issue_date'))[:10],
+        'due_date': str(doc.get('due_date'))[:10],
+        'items': _normalize_items(doc.get('items', [])),
+        'total': doc.get('total'),
+        'template': template_version,
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, data):
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _drop(key):
+    for ext in ('json', 'pdf'):
+        try: os.remove(os.path.join(CACHE_DIR, f"{key}.{ext}"))
+        except OSError: pass
+
+
+@contextmanager
+def locked(key):
+    """
+    同じキーの 探す → 採番 → 描画 → 登録 を、別スレッド・別プロセスと重ならないようにするロック。
+    キャッシュが無効でもロックはかける（同時に来た再送で2つ採番しないように）
+    """
+    lock_dir = os.path.join(CACHE_DIR, "locks")
+    os.makedirs(lock_dir, exist_ok=True)
+    with open(os.path.join(lock_dir, f"{key}.lock"), 'a+b') as f:
+        _lock_file(f)
+        try:
+            yield
+        finally:
+            _unlock_file(f)
+
+
+if os.name == 'nt':
+    import msvcrt
+
+    def _lock_file(f):
+        f.seek(0)
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                return
+            except OSError:
+                time.sleep(0.05)
+
+    def _unlock_file(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _lock_file(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+    def _unlock_file(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def lookup(key):
+    """
+    キャッシュ済みなら (PDFパス, 請求No) を返す。無ければ None
+    """
+    if not ENABLED:
+        return None
+    with _lock:
+        meta_path = os.path.join(CACHE_DIR, f"{key}.json")
+        meta = _read_json(meta_path)
+        if not meta:
+            return None
+        pdf_copy = os.path.join(CACHE_DIR, f"{key}.pdf")
+        if os.path.exists(meta['path']):
+            # 出力先が消されたあと同じファイル名で別の請求書が作られていたら、キャッシュは使わない
+            if meta.get('sha256') and _sha256_file(meta['path']) != meta['sha256']:
+                _drop(key)
+                return None
+        else:
+            if not os.path.exists(pdf_copy):
+                _drop(key)
+                return None
+            # 出力先のPDFが消されていたらキャッシュから書き戻す
+            from render_service import atomic_write
+            os.makedirs(os.path.dirname(meta['path']), exist_ok=True)
+            with open(pdf_copy, 'rb') as f:
+                atomic_write(meta['path'], f.read())
+        # 最近使ったものを残すため、使うたびに mtime を更新する
+        os.utime(meta_path)
+        if os.path.exists(pdf_copy):
+            os.utime(pdf_copy)
+        return meta['path'], meta.get('number')
+
+
+def store(key, out_pdf_path, number):
+    if not ENABLED:
+        return
+    from render_service import atomic_write
+    with _lock:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(out_pdf_path, 'rb') as f:
+            data = f.read()
+        atomic_write(os.path.join(CACHE_DIR, f"{key}.pdf"), data)
+        _write_json(os.path.join(CACHE_DIR, f"{key}.json"), {
+            'path': os.path.abspath(out_pdf_path),
+            'number': number,
+            'sha256': hashlib.sha256(data).hexdigest(),
+            'created': time.time(),
+        })
+    prune()
+
+
+def prune(max_age_days=MAX_AGE_DAYS, max_bytes=MAX_BYTES):
+    """
+    古いエントリ（最終利用から max_age_days 日）を消し、合計サイズが max_bytes を超えたら古い順に消す。
+    <key>.json と <key>.pdf は1件として一緒に消す（新しい方の mtime を最終利用とみなす）。
+    書き込み中の .tmp（別プロセスのものかもしれない）は数えず、消さない。消したエントリの数を返す
+    """
+    if not os.path.isdir(CACHE_DIR):
+        return 0
+    with _lock:
+        now = time.time()
+        groups = {}
+        for name in os.listdir(CACHE_DIR):
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(CACHE_DIR, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if not os.path.isfile(path):  # locks/ は消さない
+                continue
+            key = name.split('.', 1)[0]
+            mtime, size, paths = groups.get(key, (0.0, 0, []))
+            groups[key] = (max(mtime, st.st_mtime), size + st.st_size, paths + [path])
+        entries = sorted(groups.values())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for mtime, size, paths in entries:
+            if now - mtime <= max_age_days * 86400 and total <= max_bytes:
+                break
+            for path in paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+            removed += 1
+        return removed
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == '--purge':
+        print(f"removed {prune(max_age_days=0, max_bytes=0)} cache entries")
+    else:
+        print(f"removed {prune()} expired cache entries")
@@ -0,0 +1,172 @@
+import io
+import os
+import sys
+import zlib
+import hashlib
+
+# 出来上がった PDF を Discord に送る前に小さくする後処理。
+#   - 同じ画像（印影など）が複数入っていれば1つにまとめる
+#   - 表示サイズに対して大きすぎる画像を縮小し、Flate で圧縮し直す
+#   - 圧縮オブジェクトストリームで書き直す
+# pikepdf が無い環境では何もしない。小さくならなかった場合も元のまま残す。
+# PDF_OPTIMIZE=0 で無効。
+
+ENABLED = os.environ.get("PDF_OPTIMIZE", "1") != "0"
+# これより大きい画像は縮小する（長辺の px）。印影は 80px（約21mm）で表示するので 600px あれば十分
+MAX_IMAGE_PX = int(os.environ.get("PDF_MAX_IMAGE_PX", "600"))
+
+try:
+    import pikepdf
+    from pikepdf import Name
+except ImportError:
+    pikepdf = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+_warned = False
+
+
+def _image_key(obj):
+    h = hashlib.sha256(obj.read_raw_bytes())
+    for k in ('/Width', '/Height', '/ColorSpace', '/BitsPerComponent', '/Filter', '/DecodeParms'):
+        h.update(repr(obj.get(k)).encode())
+    smask = obj.get('/SMask')
+    if smask is not None:
+        h.update(hashlib.sha256(smask.read_raw_bytes()).digest())
+    return h.hexdigest()
+
+
+def _iter_xobject_dicts(pdf):
+    for page in pdf.pages:
+        resources = page.obj.get('/Resources')
+        if resources is None:
+            continue
+        xobjects = resources.get('/XObject')
+        if xobjects is not None:
+            yield xobjects
+            # フォームXObject（Chromium はページ内容をフォームにすることがある）の中の画像も見る
+            for name in list(xobjects.keys()):
+                form = xobjects[name]
+                if form.get('/Subtype') == Name.Form and '/Resources' in form:
+                    inner = form.Resources.get('/XObject')
+                    if inner is not None:
+                        yield inner
+
+
+def dedupe_images(pdf):
+    """同じ内容の画像XObjectへの参照を1つに揃える。まとめた数を返す"""
+    seen = {}
+    merged = 0
+    for xobjects in _iter_xobject_dicts(pdf):
+        for name in list(xobjects.keys()):
+            obj = xobjects[name]
+            if obj.get('/Subtype') != Name.Image:
+                continue
+            key = _image_key(obj)
+            first = seen.setdefault(key, obj)
+            if first.objgen != obj.objgen:
+                xobjects[name] = first
+                merged += 1
+    return merged
+
+
+_MODES = {'/DeviceRGB': ('RGB', 3), '/DeviceGray': ('L', 1)}
+
+
+def _shrink(obj, size=None):
+    """
+    8bit の RGB / グレー画像を size（無ければ MAX_IMAGE_PX に収まる大きさ）に縮小して Flate で書き直す。
+    扱えない形式は None を返す
+    """
+    cs = obj.get('/ColorSpace')
+    if Image is None or obj.get('/BitsPerComponent') != 8 or str(cs) not in _MODES:
+        return None
+    filt = obj.get('/Filter')
+    if filt is not None and filt != Name.FlateDecode:
+        return None  # JPEG などはそのまま
+    w, h = int(obj.Width), int(obj.Height)
+    if size is None:
+        scale = MAX_IMAGE_PX / max(w, h)
+        if scale >= 1:
+            return None
+        size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    mode, _ = _MODES[str(cs)]
+    img = Image.frombytes(mode, (w, h), obj.read_bytes()).resize(size, Image.LANCZOS)
+    obj.write(zlib.compress(img.tobytes(), 9), filter=Name.FlateDecode)
+    obj.Width, obj.Height = size
+    return size
+
+
+def shrink_images(pdf):
+    """大きすぎる画像（とその透明マスク）を縮小する。縮小した数を返す"""
+    done = set()
+    count = 0
+    for xobjects in _iter_xobject_dicts(pdf):
+        for name in list(xobjects.keys()):
+            obj = xobjects[name]
+            if obj.get('/Subtype') != Name.Image or obj.objgen in done:
+                continue
+            done.add(obj.objgen)
+            try:
+                size = _shrink(obj)
+                if size and '/SMask' in obj:
+                    _shrink(obj.SMask, size)
+                if size:
+                    count += 1
+            except Exception as e:
+                print(f"[WARN] could not shrink image {name}: {e}")
+    return count
+
+
+def optimize_bytes(data):
+    """
+    PDF のバイト列を小さくして (新しいバイト列, 減ったバイト数) を返す。小さくならなければ元のまま
+    """
+    global _warned
+    if pikepdf is None:
+        if not _warned:
+            _warned = True
+            print("[WARN] pikepdf is not installed; PDFs are not optimized")
+        return data, 0
+    with pikepdf.open(io.BytesIO(data)) as pdf:
+        dedupe_images(pdf)
+        shrink_images(pdf)
+        pdf.remove_unreferenced_resources()
+        out = io.BytesIO()
+        pdf.save(out, compress_streams=True, recompress_flate=True,
+                 object_stream_mode=pikepdf.ObjectStreamMode.generate)
+    new = out.getvalue()
+    if len(new) >= len(data):
+        return data, 0
+    return new, len(data) - len(new)
+
+
+def optimize_file(path):
+    """
+    path の PDF を小さくして書き戻す。減ったバイト数を返す
+    """
+    if not ENABLED:
+        return 0
+    from render_service import atomic_write
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        new, saved = optimize_bytes(data)
+    except Exception as e:
+        print(f"[WARN] PDF optimization failed, keeping the original: {e}")
+        return 0
+    if saved:
+        atomic_write(path, new)
+        print(f"[DEBUG] optimized {os.path.basename(path)}: {len(data):,} -> {len(new):,} bytes (-{saved * 100 // len(data)}%)")
+    return saved
+
+
+if __name__ == "__main__":
+    # 既存の PDF をまとめて小さくする: python pdf_optimize.py a.pdf b.pdf ...
+    total = 0
+    for p in sys.argv[1:]:
+        total += optimize_file(p)
+    print(f"saved {total:,} bytes")
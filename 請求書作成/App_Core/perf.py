@@ -0,0 +1,67 @@
+import os
+import time
+import threading
+import contextlib
+
+# 処理段階ごとの所要時間を集める小さな記録係（bench_render.py 用）。
+# INVOICE_PERF=1 のときだけ記録する。普段の実行では stage() は何もしない
+# （batch_gen.py の読み取りの詳細ログもこのときだけ出す）。
+#
+#   with perf.stage('pdf_print'):
+#       pdf = await page.pdf(...)
+#
+# 段階名: template_fill（うち font_subset）/ browser_launch / page_open / page_load / font_ready / pdf_print /
+#         native_draw / file_write / optimize / total
+
+ENABLED = os.environ.get("INVOICE_PERF") == "1"
+
+_lock = threading.Lock()
+_samples = {}
+
+
+@contextlib.contextmanager
+def stage(name):
+    if not ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(name, time.perf_counter() - start)
+
+
+def add(name, seconds):
+    with _lock:
+        _samples.setdefault(name, []).append(seconds)
+
+
+def reset():
+    """今までの記録を返して空にする"""
+    global _samples
+    with _lock:
+        samples, _samples = _samples, {}
+    return samples
+
+
+def percentile(values, p):
+    """最近傍順位法のパーセンタイル（values は並べ替え済み）"""
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * p // 100))
+    return values[int(rank) - 1]
+
+
+def summarize(samples):
+    """{段階: [秒, ...]} -> {段階: {count, p50, p95, max, total}}（ミリ秒）"""
+    result = {}
+    for name, values in samples.items():
+        values = sorted(values)
+        result[name] = {
+            'count': len(values),
+            'p50': round(percentile(values, 50) * 1000, 2),
+            'p95': round(percentile(values, 95) * 1000, 2),
+            'max': round(values[-1] * 1000, 2),
+            'total': round(sum(values) * 1000, 2),
+        }
+    return result
@@ -1,19 +1,28 @@
 import os
-import os
-import re
+import csv
+import json
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import sys
-import math
-from playwright.sync_api import sync_playwright
+import render_service
+from documents import render_once, pop_cli_options, pop_option
+import sequence_store
 
 # Get the directory of the current script (App_Core)
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 # Base directory is one level up from App_Core
 BASE_DIR = os.path.dirname(SCRIPT_DIR)
 
-OUT_DIR = os.path.join(BASE_DIR, "作成済み請求書")
-TEMPLATE_PATH = os.path.join(SCRIPT_DIR, "テンプレート.html")
-SEAL_PATH = os.path.join(SCRIPT_DIR, "seal_b64.txt")
+OUT_DIR = os.environ.get("INVOICE_OUT_DIR") or os.path.join(BASE_DIR, "作成済み請求書")
+
+# 選択番号 → 宛先。カウントファイルではこの番号か宛先名をそのまま書ける
+PICK_DESTINATIONS = {
+    '1': "株式会社ミナミトランスポートレーション",
+    '2': "株式会社TUYOSHI",
+    '3': "株式会社りんご",
+    '4': "寺本康太",
+}
+PICK_UNIT_PRICE = 200
 
 def generate_pdf(destination_name, qty, custom_date_str=None):
     if custom_date_str:
@@ -22,149 +31,119 @@ def generate_pdf(destination_name, qty, custom_date_str=None):
         today = datetime.now()
     deadline = today + timedelta(days=7)
     
-    total = qty * 200
+    total = qty * PICK_UNIT_PRICE
     items = [{
         'name': 'ピック依頼',
-        'unit': 200,
+        'unit': PICK_UNIT_PRICE,
         'qty': qty,
         'total': total
     }]
 
     today_str = today.strftime('%Y%m%d')
     today_mmdd = today.strftime('%m月%d日')
-    today_jp = today.strftime('%Y年%m月%d日')
-    deadline_jp = deadline.strftime('%Y年%m月%d日')
 
     # 日付ごとのフォルダを作成
     daily_folder_name = today.strftime('%Y-%m-%d')
     daily_out_dir = os.path.join(OUT_DIR, daily_folder_name)
     os.makedirs(daily_out_dir, exist_ok=True)
 
-    count = 1
     file_prefix = f"{destination_name}御中{today_mmdd}-P"
-    for fname in os.listdir(daily_out_dir):
-        if fname.startswith(file_prefix) and fname.endswith(".pdf"):
-            count += 1
-            
-    file_no = f"{count:02}"
-    invoice_no = f"{today_str}-P{file_no}"
-    out_pdf_name = f"{file_prefix}{file_no}.pdf"
-    out_pdf_path = os.path.join(daily_out_dir, out_pdf_name)
-
-    with open(TEMPLATE_PATH, "r", encoding="utf-8") as f:
-        html_content = f.read()
-
-    try:
-        with open(SEAL_PATH, "r", encoding="utf-8") as f:
-            full_b64_string = f.read().strip()
-        html_content = re.sub(r'src=\"data:image/png;base64,[^\"]*\"', f'src="{full_b64_string}"', html_content)
-    except Exception as e:
-        print("Base64 injection error: ", e)
 
-    # Replace company name
-    html_content = re.sub(
-        r'<div class=\"to-company\"[^>]*>.*?株式会社ミナミトランスポートレーション.*?御\s*中.*?</div>',
-        f'<div class="to-company" style="font-size: 16px; white-space: nowrap;">\n                    <span>{destination_name}</span>\n                    <span style="margin-left: 10px;">御 中</span>\n                </div>',
-        html_content,
-        flags=re.DOTALL
-    )
-
-    html_content = re.sub(r'id=\"invoice-no\">.*?<', f'id="invoice-no">{invoice_no}<', html_content)
-    html_content = re.sub(r'<th>請求 日 :</th>.*?<td>.*?<', f'<th>請求 日 :</th><td>{today_jp}<', html_content, flags=re.DOTALL)
-    html_content = re.sub(r'\(\s*お支払い期限\s*\)</span>\s*<span>.*?</span>', f'( お支払い期限 )</span>\n                    <span>{deadline_jp}</span>', html_content, flags=re.DOTALL)
-
-    # Generate rows HTML (pad up to 7 rows)
-    rows_html = ""
-    total_rows = max(7, len(items))
-    for i in range(total_rows):
-        cls = "even" if i % 2 == 0 else "odd"
-        if i < len(items):
-            it = items[i]
-            rows_html += f'''
-                <tr class="{cls}">
-                    <td>{it["name"]}</td>
-                    <td>{it["unit"]:,}</td>
-                    <td>{it["qty"]}</td>
-                    <td>{it["total"]:,}</td>
-                </tr>'''
+    def allocate():
+        # 宛先ごとの連番（初回だけ既存の同じ宛先のファイル数から続ける）
+        count = sequence_store.next_number(f'pick:{destination_name}', today_str,
+                                           seed=lambda: sequence_store.count_files(daily_out_dir, file_prefix))
+        file_no = f"{count:02}"
+        invoice_no = sequence_store.format_number(today_str, 'P', count)
+        return invoice_no, os.path.join(daily_out_dir, f"{file_prefix}{file_no}.pdf")
+
+    doc = {
+        'kind': 'invoice',
+        'layout': 'standard',
+        'compact': True,
+        'series': 'pick',
+        'recipient': destination_name,
+        'issue_date': today.strftime('%Y-%m-%d'),
+        'due_date': deadline.strftime('%Y-%m-%d'),
+        'items': items,
+        'total': total,
+    }
+
+    return render_once(doc, allocate)
+
+def resolve_destination(value):
+    value = str(value).strip()
+    return PICK_DESTINATIONS.get(value, value)
+
+
+def normalize_date(value):
+    """'2026/02/22' / '2026-02-22' → '2026/02/22'（空なら None = 本日）"""
+    value = (value or '').strip()
+    if not value:
+        return None
+    return datetime.strptime(value.replace('-', '/'), '%Y/%m/%d').strftime('%Y/%m/%d')
+
+
+def read_counts(path):
+    """
+    カウントファイルを [{'dest', 'qty', 'date'}, ...] にする。
+    CSV（列: dest, qty, date）か JSON lines / JSON 配列（同じキー）。dest は選択番号か宛先名
+    """
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        if path.lower().endswith('.csv'):
+            rows = [{k.strip(): (v or '').strip() for k, v in r.items() if k} for r in csv.DictReader(f)]
         else:
-            rows_html += f'''
-                <tr class="{cls}">
-                    <td>&nbsp;</td>
-                    <td></td>
-                    <td></td>
-                    <td></td>
-                </tr>'''
-    
-    html_content = html_content.replace('<!-- ITEM_ROWS -->', rows_html)
-
-    # Replace total block
-    html_content = re.sub(r'<div class=\"amount-value\">\s*¥[0-9,]+\s*-\s*</div>', f'<div class="amount-value">¥{total:,}-</div>', html_content)
-    html_content = re.sub(r'<div class=\"t-val\">\s*¥[0-9,]+\s*</div>', f'<div class="t-val">¥{total:,}</div>', html_content)
-
-    html_content = html_content.replace('font-size: 13px;', 'font-size: 11px;')
-    html_content = html_content.replace('font-size: 14px;', 'font-size: 12px;')
-    html_content = html_content.replace('margin-top: 40px;', 'margin-top: 20px;')
-    html_content = html_content.replace('margin-bottom: 30px;', 'margin-bottom: 20px;')
-    html_content = html_content.replace('padding: 12px;', 'padding: 8px;')
-    html_content = html_content.replace('height: 297mm;', 'height: 293mm;')
-    html_content = html_content.replace('width: 52%;', 'width: 58%;')
-    html_content = html_content.replace('width: 18%;', 'width: 15%;')
-    html_content = html_content.replace('width: 10%;', 'width: 6%;')
-    html_content = html_content.replace('width: 20%;', 'width: 21%;')
-
-    temp_html = os.path.join(BASE_DIR, "pick_temp_render.html")
-    with open(temp_html, "w", encoding="utf-8") as f:
-        f.write(html_content)
-
-    print(f"Creating PDF: {out_pdf_name}")
-    with sync_playwright() as p:
-        # Check if we are in a Linux environment (like Render) or Windows
-        executable_path = None
-        if os.name != 'nt':
-            import glob
-            # First, check if PLAYWRIGHT_BROWSERS_PATH is set (Render custom cache)
-            pw_path = os.environ.get('PLAYWRIGHT_BROWSERS_PATH')
-            if pw_path and os.path.exists(pw_path):
-                # Look for chrome inside chromium-xxxx/chrome-linux/chrome
-                search_pattern = os.path.join(pw_path, '**', 'chrome')
-                matches = glob.glob(search_pattern, recursive=True)
-                if matches:
-                    executable_path = matches[0]
-            
-            # Fallback to standard system paths
-            if not executable_path:
-                linux_paths = [
-                    "/usr/bin/chromium", 
-                    "/usr/bin/chromium-browser",
-                    "/usr/bin/google-chrome"
-                ]
-                for path_choice in linux_paths:
-                    if os.path.exists(path_choice):
-                        executable_path = path_choice
-                        break
-        if executable_path:
-            print(f"[DEBUG] Launching Playwright with explicit chromium path: {executable_path}")
-            browser = p.chromium.launch(headless=True, executable_path=executable_path, args=['--no-sandbox', '--disable-setuid-sandbox', '--disable-dev-shm-usage', '--disable-gpu', '--no-zygote'])
-        else:
-            print("[DEBUG] Launching Playwright with default bundled chromium")
-            browser = p.chromium.launch(headless=True, args=['--no-sandbox', '--disable-setuid-sandbox', '--disable-dev-shm-usage', '--disable-gpu', '--no-zygote'])
-
-        page = browser.new_page()
-        import pathlib
-        uri = pathlib.Path(temp_html).resolve().as_uri()
-        page.goto(uri, wait_until="load")
-        # Ensure all web fonts (like Noto Sans JP) are fully loaded and applied
-        page.evaluate("document.fonts.ready")
-        page.wait_for_timeout(1000) # Give 1 extra second for layout recalculation
-        page.pdf(path=out_pdf_path, format="A4", display_header_footer=False, print_background=True)
-        browser.close()
-
-    if os.path.exists(temp_html):
-        os.remove(temp_html)
-    return out_pdf_path
+            text = f.read()
+            rows = json.loads(text) if text.lstrip().startswith('[') else \
+                [json.loads(line) for line in text.splitlines() if line.strip()]
+    counts = []
+    for r in rows:
+        if not r.get('dest'):
+            continue
+        counts.append({'dest': resolve_destination(r['dest']), 'qty': int(r['qty']), 'date': normalize_date(r.get('date'))})
+    return counts
+
+
+def run_counts(counts, jobs=render_service.POOL_SIZE):
+    """
+    全宛先分のピック依頼請求書を並列に作り、入力順の結果リストを返す
+    """
+    results = [None] * len(counts)
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as ex:
+        futures = {ex.submit(generate_pdf, c['dest'], c['qty'], c['date']): i
+                   for i, c in enumerate(counts) if c['qty'] > 0}
+        for fut in as_completed(futures):
+            i = futures[fut]
+            c = counts[i]
+            result = {'dest': c['dest'], 'qty': c['qty'], 'date': c['date'], 'total': c['qty'] * PICK_UNIT_PRICE}
+            try:
+                result.update(status='ok', path=fut.result())
+            except Exception as e:
+                result.update(status='error', error=str(e))
+                print(f"[WARN] pick invoice for {c['dest']} failed: {e}")
+            results[i] = result
+    # 個数 0 の行は作成しない
+    return [r if r else {'dest': c['dest'], 'qty': c['qty'], 'date': c['date'], 'status': 'skipped'}
+            for r, c in zip(results, counts)]
 
 if __name__ == "__main__":
+    pop_cli_options()
+    counts_file = pop_option('counts')
+    if counts_file:
+        # --counts FILE [--jobs N]: その日の全宛先分を1回で作成し、結果を JSON で出力する
+        jobs = int(pop_option('jobs') or render_service.POOL_SIZE)
+        render_service.POOL_SIZE = max(render_service.POOL_SIZE, jobs)
+        try:
+            results = run_counts(read_counts(counts_file), jobs)
+        except Exception as e:
+            print(f"エラー: {e}", file=sys.stderr)
+            sys.exit(1)
+        for r in results:
+            if r['status'] == 'ok':
+                print(f"___PDF_GENERATED___:{r['path']}")
+        print(json.dumps(results, ensure_ascii=False))
+        sys.exit(0 if all(r['status'] != 'error' for r in results) else 1)
+
     destination_name = None
     qty = None
     custom_date_str = None
@@ -174,15 +153,8 @@ if __name__ == "__main__":
         if len(sys.argv) >= 3:
             dest_choice = sys.argv[1].strip()
             qty_input = sys.argv[2].strip()
-            if dest_choice == '1':
-                destination_name = "株式会社ミナミトランスポートレーション"
-            elif dest_choice == '2':
-                destination_name = "株式会社TUYOSHI"
-            elif dest_choice == '3':
-                destination_name = "株式会社りんご"
-            elif dest_choice == '4':
-                destination_name = "寺本康太"
-            
+            destination_name = PICK_DESTINATIONS.get(dest_choice)
+
             if qty_input.isdigit() and int(qty_input) > 0:
                 qty = int(qty_input)
 
@@ -199,27 +171,16 @@ if __name__ == "__main__":
         print(" ピック依頼 請求書作成ツール")
         print("========================================")
         print("宛先を選択してください：")
-        print("1: 株式会社ミナミトランスポートレーション")
-        print("2: 株式会社TUYOSHI")
-        print("3: 株式会社りんご")
-        print("4: 寺本康太")
+        for choice, name in PICK_DESTINATIONS.items():
+            print(f"{choice}: {name}")
         
         while True:
-            dest_choice = input("入力 (1 から 4): ").strip()
-            if dest_choice == '1':
-                destination_name = "株式会社ミナミトランスポートレーション"
-                break
-            elif dest_choice == '2':
-                destination_name = "株式会社TUYOSHI"
-                break
-            elif dest_choice == '3':
-                destination_name = "株式会社りんご"
-                break
-            elif dest_choice == '4':
-                destination_name = "寺本康太"
+            dest_choice = input(f"入力 (1 から {len(PICK_DESTINATIONS)}): ").strip()
+            if dest_choice in PICK_DESTINATIONS:
+                destination_name = PICK_DESTINATIONS[dest_choice]
                 break
             else:
-                print("エラー: 1 から 4 を入力してください。")
+                print(f"エラー: 1 から {len(PICK_DESTINATIONS)} を入力してください。")
                 
         while True:
             qty_input = input("ピック依頼の個数を入力してください: ").strip()
@@ -245,7 +206,7 @@ if __name__ == "__main__":
         sys.exit(1)
 
     date_display = custom_date_str if custom_date_str else "本日"
-    print(f"\n[{destination_name}] 宛てに ピック依頼 (200円 x {qty}個 = {qty*200}円) 日付:{date_display} で請求書を作成します。")
+    print(f"\n[{destination_name}] 宛てに ピック依頼 ({PICK_UNIT_PRICE}円 x {qty}個 = {qty*PICK_UNIT_PRICE}円) 日付:{date_display} で請求書を作成します。")
     try:
         out_path = generate_pdf(destination_name, qty, custom_date_str)
         print(f"\n生成完了: {out_path}")
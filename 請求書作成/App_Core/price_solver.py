@@ -0,0 +1,220 @@
+import re
+import math
+
+# OCR した明細行から (単価, 数量, 金額) を読み取る。
+# 1行ずつ「それらしい読み方」の候補を挙げ（カンマ区切りの金額・カンマが落ちた数字列の切り方）、
+# 全行の金額の合計がレシートの 計/小計 と一致する組み合わせを、和をキーにした
+# 幅制限つきの動的計画法（ビームサーチ）で探す。
+#   - 候補には読み方ごとの確からしさ（score）を付け、合計が合う組の中で積が最大のものを選ぶ
+#   - 合計がどうしても合わないときは、1行だけ数量を足して合わせる（数量の読み落とし）
+#   - 小計が読めなかったときは、各行で一番確からしい読み方を使う
+# 単語の位置から列が読めた行（ocr_table.py）は、その読み方を最優先する。
+# 結果の confidence（0〜1）は、選んだ読み方の確からしさと、小計と合ったかどうかから出す。
+
+# 1行あたりに残す候補の数・DP で残す状態（部分和）の数
+MAX_CANDIDATES = 6
+BEAM = 512
+# 数量として認める上限
+MAX_QTY = 100
+# 金額の数字列の切り方で試す桁数
+SPLIT_DIGITS = range(3, 8)
+# 合計を合わせるために行を捨てる（商品行ではなかったとみなす）ときの確からしさ
+SKIP_SCORE = 0.05
+# 数量を足して合計を合わせたときに掛ける確からしさ
+CORRECTION_SCORE = 0.5
+
+PRICE_RE = re.compile(r'\b\d{1,3}(?:,\d{3})+\b')
+
+
+def _cand(unit, qty, score, how):
+    return {'unit': unit, 'qty': qty, 'total': unit * qty, 'score': score, 'how': how}
+
+
+def table_candidates(cells):
+    """
+    ocr_table.extract で列ごとに読めた数字から候補を作る。
+    列の位置で読んでいるので、単価 × 数量 = 金額 が成り立てばいちばん確からしい
+    """
+    if not cells:
+        return []
+    unit, qty, total = cells.get('unit'), cells.get('qty'), cells.get('total')
+    qty_ok = qty is not None and 0 < qty < MAX_QTY
+    cands = []
+    if unit and qty_ok and total is not None:
+        if unit * qty == total:
+            cands.append(_cand(unit, qty, 0.97, 'table'))
+        else:
+            cands.append(_cand(unit, qty, 0.5, 'table:unit,qty'))
+            if total % unit == 0 and 0 < total // unit < MAX_QTY:
+                cands.append(_cand(unit, total // unit, 0.45, 'table:unit,total'))
+            if total % qty == 0:
+                cands.append(_cand(total // qty, qty, 0.4, 'table:qty,total'))
+    elif unit and total:
+        if total % unit == 0 and 0 < total // unit < MAX_QTY:
+            cands.append(_cand(unit, total // unit, 0.9, 'table:unit,total'))
+        else:
+            cands.append(_cand(total, 1, 0.4, 'table:total'))
+    elif qty_ok and total:
+        if total % qty == 0:
+            cands.append(_cand(total // qty, qty, 0.85, 'table:qty,total'))
+    elif unit and qty_ok:
+        cands.append(_cand(unit, qty, 0.8, 'table:unit,qty'))
+    elif unit:
+        cands.append(_cand(unit, 1, 0.6, 'table:unit'))
+    elif total:
+        cands.append(_cand(total, 1, 0.6, 'table:total'))
+    return cands
+
+
+def row_candidates(row_clean, cells=None):
+    """
+    1行（receipt_normalizer で掃除済み）の読み方の候補を、確からしい順に返す。
+    cells（ocr_table.extract の行）で確かな読み方が取れたら、数字列の切り方の総当たりはしない
+    """
+    cands = table_candidates(cells)
+    if cands and cands[0]['score'] >= 0.8:
+        return cands
+    prices = [int(p.replace(',', '')) for p in PRICE_RE.findall(row_clean)]
+    if len(prices) >= 2:
+        p1, p2 = prices[0], prices[-1]
+        if p1 > 0 and p2 >= p1 and p2 % p1 == 0 and p2 // p1 < MAX_QTY:
+            cands.append(_cand(p1, p2 // p1, 0.95 if p1 > 1000 else 0.7, 'unit,total'))
+        cands.append(_cand(p2, 1, 0.4, 'total'))
+        cands.append(_cand(p1, 1, 0.3, 'unit'))
+    elif len(prices) == 1 and prices[0] > 0:
+        cands.append(_cand(prices[0], 1, 0.75, 'price'))
+
+    # カンマは落ちたが空白は残っている: 末尾の数字の並びを 数量 単価 金額 / 単価 金額 と読む
+    tokens = re.findall(r'\d+', row_clean)
+    if len(tokens) >= 2 and not prices:
+        un, tot = int(tokens[-2]), int(tokens[-1])
+        q = int(tokens[-3]) if len(tokens) >= 3 else 0
+        if un > 0 and 0 < q < MAX_QTY and q * un == tot:
+            cands.append(_cand(un, q, 0.65, 'tokens'))
+        elif un > 0 and tot % un == 0 and 0 < tot // un < MAX_QTY:
+            cands.append(_cand(un, tot // un, 0.5, 'tokens'))
+
+    # カンマが落ちた数字列を 数量・単価・金額 に切る。先に見つかる切り方（金額・単価の桁が少ない順）を少しだけ優先する
+    digits = re.sub(r'[^\d]', '', row_clean)
+    order = 0
+    for lt in SPLIT_DIGITS:
+        if lt > len(digits):
+            break
+        total_str = digits[-lt:]
+        tot = int(total_str)
+        if tot == 0:
+            continue
+        for lu in SPLIT_DIGITS:
+            if lt + lu > len(digits):
+                break
+            unit_str = digits[-(lt + lu):-lt]
+            un = int(unit_str)
+            if un == 0:
+                continue
+            rem = digits[:-(lt + lu)]
+            # 数量の前に品名の数字（型番など）がくっついていることがあるので、末尾1〜2桁だけも試す
+            for q_str, penalty in ((rem, 1.0), (rem[-2:], 0.9), (rem[-1:], 0.85)):
+                q = int(q_str) if q_str and int(q_str) > 0 else 0
+                score = None
+                if 0 < q < MAX_QTY and q * un == tot:
+                    score = 0.6 * penalty
+                elif q_str == rem and q == 0 and tot % un == 0 and tot // un < MAX_QTY:
+                    score, q = 0.45, tot // un
+                if score is None:
+                    continue
+                if total_str[0] == '0' or unit_str[0] == '0':
+                    score *= 0.5  # 先頭が 0 の金額は読み方として不自然
+                order += 1
+                cands.append(_cand(un, q, score - order * 1e-4, 'digits'))
+                break
+
+    # 同じ読み方は確からしい方だけ残す
+    best = {}
+    for c in cands:
+        key = (c['unit'], c['qty'])
+        if key not in best or best[key]['score'] < c['score']:
+            best[key] = c
+    return sorted(best.values(), key=lambda c: -c['score'])[:MAX_CANDIDATES]
+
+
+def solve(rows, target=None, beam=BEAM):
+    """
+    rows: 行ごとの候補リスト（row_candidates の結果）。target: レシートの小計（無ければ None）
+    戻り値: {'choices': 行ごとの採用した候補（捨てた行は None）, 'total', 'matched', 'corrected', 'confidence'}
+    """
+    options = []
+    for cands in rows:
+        opts = [(i, math.log(c['score']), c['total']) for i, c in enumerate(cands)]
+        # 確かな読み方（カンマ区切りの金額）が無い行だけ、捨てる選択肢を持たせる
+        if target and cands and cands[0]['score'] < 0.7:
+            opts.append((None, math.log(SKIP_SCORE), 0))
+        options.append(opts)
+
+    # 残りの行の金額の最小和（これを足すと小計を超える部分和は先が無い）
+    min_rest = [0] * (len(options) + 1)
+    for i in range(len(options) - 1, -1, -1):
+        min_rest[i] = min_rest[i + 1] + (min((o[2] for o in options[i]), default=0))
+
+    # 状態: 部分和 -> (対数スコア, 経路)。経路は (候補番号, 親の経路) の連結リスト
+    states = {0: (0.0, None)}
+    for i, opts in enumerate(options):
+        if not opts:
+            states = {s: (score, (None, path)) for s, (score, path) in states.items()}
+            continue
+        nxt = {}
+        for s, (score, path) in states.items():
+            for idx, logp, total in opts:
+                ns = s + total
+                if target and ns + min_rest[i + 1] > target:
+                    continue
+                nscore = score + logp
+                cur = nxt.get(ns)
+                if cur is None or cur[0] < nscore:
+                    nxt[ns] = (nscore, (idx, path))
+        if len(nxt) > beam:
+            nxt = dict(sorted(nxt.items(), key=lambda kv: -kv[1][0])[:beam])
+        states = nxt
+
+    def unwind(path):
+        picks = []
+        while path is not None:
+            idx, path = path
+            picks.append(idx)
+        picks.reverse()
+        return [rows[i][idx] if idx is not None else None for i, idx in enumerate(picks)]
+
+    def result(choices, logscore, matched, corrected):
+        chosen = [c for c in choices if c is not None]
+        mean = math.exp(logscore / len(chosen)) if chosen else 0.0
+        if matched:
+            confidence = 0.5 + 0.5 * mean if corrected is None else 0.4 + 0.4 * mean
+        else:
+            confidence = (0.6 if not target else 0.3) * mean
+        return {
+            'choices': choices,
+            'total': sum(c['total'] for c in chosen),
+            'matched': matched,
+            'corrected': corrected,
+            'confidence': round(min(1.0, confidence), 2),
+        }
+
+    if target and states:
+        if target in states:
+            score, path = states[target]
+            return result(unwind(path), score, True, None)
+        # 1行だけ数量を足せば小計に合う組を、スコアの高い部分和から探す
+        for s, (score, path) in sorted(states.items(), key=lambda kv: -kv[1][0])[:64]:
+            diff = target - s
+            if diff <= 0:
+                continue
+            choices = unwind(path)
+            for i, c in enumerate(choices):
+                if c is not None and diff % c['unit'] == 0 and 0 < diff // c['unit'] < MAX_QTY // 2:
+                    fixed = _cand(c['unit'], c['qty'] + diff // c['unit'], c['score'], c['how'] + '+qty')
+                    choices[i] = fixed
+                    return result(choices, score + math.log(CORRECTION_SCORE), True, i)
+
+    # 小計が無い・合わない: 一番確からしい組（捨てる選択肢は使わない）
+    best = [cands[0] if cands else None for cands in rows]
+    logscore = sum(math.log(c['score']) for c in best if c is not None)
+    return result(best, logscore, False, None)
@@ -0,0 +1,132 @@
+import os
+import re
+import json
+import unicodedata
+
+# レシートの OCR 行から商品行を見分けて、品名と金額を読みやすい形に直す。
+# batch_gen.py・配布版の invoice_gen.py・archive/test_all*.py で同じ処理を使う。
+#
+# ルールは receipt_rules.json（キーワード・読み間違いの直し・金額前の掃除）に書き、
+# 読み込み時に次の2つを作っておく:
+#   - キーワードの Aho-Corasick オートマトン … 行を1文字ずつ1回なめるだけで、キーワードが
+#     いくつあっても1行あたりの手間は変わらない
+#   - 直しのルールをまとめた1本の正規表現 … どのルールにも当たらない行（ほとんどの行）は、
+#     これで1回なめるだけで済む。当たった行だけ、コンパイル済みのルールを上から順に適用する
+#     （ルール同士が重なったり、前のルールの結果に次のルールが当たったりするので、1回の置換に
+#     まとめると以前の re.sub の連続と結果が変わる）
+# 行は最初に NFKC で正規化する（全角英数字・全角カンマ・￥ や半角カナがそろう）。
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+RULES_PATH = os.path.join(SCRIPT_DIR, "receipt_rules.json")
+
+
+class KeywordAutomaton:
+    """Aho-Corasick 方式のキーワード照合。search() は最初に見つかったキーワードを返す"""
+
+    def __init__(self, words):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [None]
+        for word in words:
+            state = 0
+            for ch in word:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(None)
+                state = nxt
+            if self._out[state] is None:
+                self._out[state] = word
+        # 幅優先で失敗遷移を張る。途中の状態でも、失敗先がキーワードの終わりならそれを出力にする
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                if self._out[nxt] is None:
+                    self._out[nxt] = self._out[self._fail[nxt]]
+
+    def search(self, text):
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state] is not None:
+                return out[state]
+        return None
+
+
+def compile_rules(rules, flags=0):
+    """
+    [(正規表現, 置き換え), ...] を、上から順に re.sub するのと同じ結果になる置き換え関数にする。
+    どれにも当たらない行は、全ルールをまとめた1本の正規表現で1回なめるだけで返す。
+    置き換えは文字列そのまま（\\1 などの参照は使えない）
+    """
+    if not rules:
+        return lambda text: text
+    any_rule = re.compile('|'.join(f"(?:{p})" for p, _ in rules), flags)
+    steps = [(re.compile(p, flags), r.replace('\\', '\\\\')) for p, r in rules]
+
+    def apply(text):
+        if any_rule.search(text) is None:
+            return text
+        for pattern, replacement in steps:
+            text = pattern.sub(replacement, text)
+        return text
+    return apply
+
+
+class Normalizer:
+    """receipt_rules.json の内容から作る、行の正規化・商品行の判定"""
+
+    def __init__(self, rules, keywords=None):
+        self.keywords = list(keywords if keywords is not None else rules.get('keywords', []))
+        self._automaton = KeywordAutomaton([k.lower() for k in self.keywords])
+        self._correct = compile_rules(rules.get('corrections', []), re.I)
+        self._clean = compile_rules(rules.get('price_cleanup', []))
+
+    @staticmethod
+    def normalize(row):
+        return unicodedata.normalize('NFKC', row)
+
+    def keyword(self, row):
+        """行（正規化済み）に含まれるキーワード。無ければ None"""
+        return self._automaton.search(row.lower())
+
+    def normalize_row(self, row):
+        """
+        商品行なら (品名用に直した行, 金額を読むために掃除した行) を返す。商品行でなければ None
+        """
+        row = self.normalize(row)
+        if self.keyword(row) is None:
+            return None
+        name_clean = self._correct(row)
+        return name_clean, self._clean(name_clean)
+
+
+def load(path=RULES_PATH, keywords=None):
+    """ルールファイルを読んで Normalizer を作る。keywords を渡すとファイルのキーワードの代わりに使う"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return Normalizer(json.load(f), keywords)
+
+
+_default = None
+
+
+def default():
+    global _default
+    if _default is None:
+        _default = load()
+    return _default
+
+
+def normalize_row(row):
+    return default().normalize_row(row)
@@ -0,0 +1,128 @@
+import os
+
+# レンダリング用 Chromium のメモリ量を /proc から測る小さなヘルパー（render_service のメモリ制御用）。
+# Chromium はプロセス間でメモリを共有するので、RSS をそのまま足すと多く数えてしまう。
+# smaps_rollup が読めれば PSS（共有分を按分した値）を使い、読めなければ VmRSS を使う。
+# /proc が無い環境（Windows など）では測れないので None を返し、呼び出し側は制御を諦める。
+#
+# 予算（RENDER_MEM_BUDGET_MB）を決めなかった場合は、コンテナのメモリ上限（cgroup）の 60% を使う。
+# 上限も分からなければ 0（= 予算なし。ピークの記録だけ行う）。
+
+BUDGET_SHARE = 0.6
+# Chromium 本体（ブラウザ・GPU・ネットワークのプロセス）と、ページ1枚あたりのおおよその使用量（MB）
+BROWSER_MB = int(os.environ.get("RENDER_BROWSER_MB", "150"))
+PAGE_MB = int(os.environ.get("RENDER_PAGE_MB", "80"))
+
+CHROMIUM_NAMES = ('chrome', 'chromium', 'chromium-browse', 'headless_shell')
+
+CGROUP_LIMIT_FILES = [
+    "/sys/fs/cgroup/memory.max",                    # cgroup v2
+    "/sys/fs/cgroup/memory/memory.limit_in_bytes",  # cgroup v1
+]
+
+
+def cgroup_limit_mb():
+    """コンテナのメモリ上限（MB）。上限なし・不明なら None"""
+    for path in CGROUP_LIMIT_FILES:
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value == 'max':
+            return None
+        # cgroup v1 は上限なしのとき巨大な値になる
+        mb = int(value) // (1024 * 1024)
+        return mb if mb < 1024 * 1024 else None
+    return None
+
+
+def budget_mb():
+    """Chromium に使わせてよいメモリ（MB）。0 なら予算なし"""
+    value = os.environ.get("RENDER_MEM_BUDGET_MB")
+    if value:
+        return int(value)
+    limit = cgroup_limit_mb()
+    return int(limit * BUDGET_SHARE) if limit else 0
+
+
+def page_cap(budget):
+    """予算内で同時に開いてよいページ数。予算なしなら None"""
+    if not budget:
+        return None
+    return max(1, (budget - BROWSER_MB) // PAGE_MB)
+
+
+def _proc_table():
+    """{pid: (ppid, コマンド名)}。/proc が無ければ None"""
+    try:
+        names = os.listdir('/proc')
+    except OSError:
+        return None
+    table = {}
+    for name in names:
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as f:
+                stat = f.read()
+        except OSError:
+            continue  # 途中で終了したプロセス
+        # "pid (comm) state ppid ..." comm には空白や括弧が入り得るので最後の ')' で切る
+        comm = stat[stat.index('(') + 1:stat.rindex(')')]
+        ppid = int(stat[stat.rindex(')') + 2:].split()[1])
+        table[int(name)] = (ppid, comm)
+    return table
+
+
+def _process_mb(pid):
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def descendants_mb(root=None):
+    """root（既定はこのプロセス）の子孫プロセス（= 自分が起動した Chromium）の合計メモリ（MB）"""
+    table = _proc_table()
+    if table is None:
+        return None
+    children = {}
+    for pid, (ppid, _) in table.items():
+        children.setdefault(ppid, []).append(pid)
+    total = 0.0
+    stack = list(children.get(root or os.getpid(), []))
+    while stack:
+        pid = stack.pop()
+        total += _process_mb(pid)
+        stack.extend(children.get(pid, []))
+    return total
+
+
+def chromium_mb():
+    """
+    コンテナ内の全 Chromium の合計メモリ（MB）。ボットが別プロセスで同時に動かしている分も含む
+    """
+    table = _proc_table()
+    if table is None:
+        return None
+    return sum(_process_mb(pid) for pid, (_, comm) in table.items() if comm in CHROMIUM_NAMES)
+
+
+if __name__ == "__main__":
+    # 現在の設定と使用量を表示する
+    budget = budget_mb()
+    print(f"cgroup limit: {cgroup_limit_mb()} MB")
+    print(f"budget: {budget or 'none'} MB, page cap: {page_cap(budget)}")
+    print(f"chromium in use: {chromium_mb()} MB")
@@ -0,0 +1,478 @@
+import io
+import os
+import glob
+import atexit
+import asyncio
+import tempfile
+import threading
+import time
+
+import perf
+import render_memory
+from playwright.async_api import async_playwright
+
+# 1プロセス内で Chromium を使い回すための共有レンダリングサービス
+# 各 generate_pdf は render_pdf() を呼ぶだけで、ブラウザ起動・ページ確保・後片付けはここで行う
+
+# 同時に保持するページ数（= 同時レンダリング数の上限）
+POOL_SIZE = int(os.environ.get("RENDER_POOL_SIZE", "2"))
+# 1ページを何回使い回したら作り直すか
+PAGE_MAX_USES = int(os.environ.get("RENDER_PAGE_MAX_USES", "50"))
+# 1回のレンダリングの待ち時間上限（秒）。ページやメモリの空きを待っている時間は含めない
+RENDER_TIMEOUT = float(os.environ.get("RENDER_TIMEOUT", "120"))
+
+# メモリ制御（render_memory.py）。Chromium 全体の使用量が予算を超えそうなら、新しいレンダリングは
+# 空くまで待つ（失敗にはしない）。MEM_WAIT 秒待っても空かなければ警告を出して描画する。
+# 自分の Chromium が予算の MEM_RECYCLE 倍を超えたら、使い終わったページをその場で作り直す
+MEM_BUDGET_MB = render_memory.budget_mb()
+MEM_WAIT = float(os.environ.get("RENDER_MEM_WAIT", "300"))
+MEM_RECYCLE = float(os.environ.get("RENDER_MEM_RECYCLE", "0.8"))
+MEM_SAMPLE_SEC = 0.1
+
+# プレビュー画像（1ページ目）の幅（px）。A4 を 96dpi で描いた 794px から縮小する
+PREVIEW_WIDTH = int(os.environ.get("RENDER_PREVIEW_WIDTH", "600"))
+A4_CSS_PX = (794, 1123)
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+CHROMIUM_ARGS = ['--no-sandbox', '--disable-setuid-sandbox', '--disable-dev-shm-usage', '--disable-gpu', '--no-zygote']
+
+
+def find_chromium_executable():
+    """
+    Linux環境（Renderなど）で使う chromium のパスを探す。見つからなければ None（同梱版を使う）
+    """
+    if os.name == 'nt':
+        return None
+    # First, check if PLAYWRIGHT_BROWSERS_PATH is set (Render custom cache)
+    pw_path = os.environ.get('PLAYWRIGHT_BROWSERS_PATH')
+    if pw_path and os.path.exists(pw_path):
+        # Look for chrome inside chromium-xxxx/chrome-linux/chrome
+        matches = glob.glob(os.path.join(pw_path, 'chromium-*', 'chrome-linux', 'chrome'))
+        if not matches:
+            matches = glob.glob(os.path.join(pw_path, '**', 'chrome'), recursive=True)
+        # 「chrome」という名前のフォルダ（~/.cache/puppeteer/chrome など）も拾うので、実行できるファイルだけ残す
+        matches = [p for p in matches if os.path.isfile(p) and os.access(p, os.X_OK)]
+        if matches:
+            return matches[0]
+    # Fallback to standard system paths
+    for path_choice in ["/usr/bin/chromium", "/usr/bin/chromium-browser", "/usr/bin/google-chrome"]:
+        if os.path.exists(path_choice):
+            return path_choice
+    return None
+
+
+class RenderPool:
+    """
+    温めたままの Chromium ページを最大 size 枚まで保持し、PDF生成に使い回すプール。
+    Playwright は専用スレッドのイベントループ上で動かすので、どのスレッドからでも呼び出せる。
+    ページは max_uses 回使うか、レンダリング中に例外が出たら作り直す。
+    mem_budget（MB）があれば、ページ数をその予算に収まる枚数までに抑え、メモリが増えたら
+    ページを作り直し、予算を超えそうなときは空くまで待たせる。レンダリングごとのピークは peak_mb に残る。
+    """
+
+    def __init__(self, size=POOL_SIZE, max_uses=PAGE_MAX_USES, mem_budget=MEM_BUDGET_MB):
+        self.mem_budget = mem_budget
+        cap = render_memory.page_cap(mem_budget)
+        if cap is not None and cap < size:
+            print(f"[DEBUG] render pool limited to {cap} pages by the {mem_budget} MB memory budget")
+            size = cap
+        self.size = max(1, size)
+        self.max_uses = max(1, max_uses)
+        self.peak_mb = None
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._pw = None
+        self._browser = None
+        self._slots = None
+        self._launch_lock = None
+
+    # --- イベントループ（専用スレッド） ---
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is not None:
+                return
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._loop.run_forever, name="render-pool", daemon=True)
+            self._thread.start()
+
+    def _run(self, coro):
+        self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    # --- ブラウザ・ページ管理（ループ内で実行） ---
+    async def _get_browser(self):
+        if self._launch_lock is None:
+            self._launch_lock = asyncio.Lock()
+        async with self._launch_lock:
+            if self._browser is not None and self._browser.is_connected():
+                return self._browser
+            if self._pw is None:
+                self._pw = await async_playwright().start()
+            args = list(CHROMIUM_ARGS)
+            if self.mem_budget:
+                # レンダラープロセスをページ数までに抑える（空いているプロセスは使い回される）
+                args.append(f'--renderer-process-limit={self.size}')
+            kwargs = {'headless': True, 'args': args}
+            executable_path = find_chromium_executable()
+            if executable_path:
+                print(f"[DEBUG] Launching Playwright with explicit chromium path: {executable_path}")
+                kwargs['executable_path'] = executable_path
+            else:
+                print("[DEBUG] Launching Playwright with default bundled chromium")
+            with perf.stage('browser_launch'):
+                self._browser = await self._pw.chromium.launch(**kwargs)
+            return self._browser
+
+    async def _acquire(self):
+        slot = await self._slots.get()
+        try:
+            if slot['page'] is None or slot['page'].is_closed():
+                browser = await self._get_browser()
+                with perf.stage('page_open'):
+                    slot['page'] = await browser.new_page()
+                slot['uses'] = 0
+        except Exception:
+            self._slots.put_nowait({'page': None, 'uses': 0})
+            raise
+        return slot
+
+    async def _release(self, slot, ok, recycle=False):
+        slot['uses'] += 1
+        if not ok or recycle or slot['uses'] >= self.max_uses:
+            # 使い切った・壊れたページは閉じて、次回の取得時に作り直す
+            try:
+                await slot['page'].close()
+            except Exception:
+                pass
+            slot['page'] = None
+            slot['uses'] = 0
+        self._slots.put_nowait(slot)
+
+    async def _measure(self, fn=None):
+        return await asyncio.get_running_loop().run_in_executor(None, fn or render_memory.descendants_mb)
+
+    async def _close_idle_pages(self):
+        """待っているページを全部閉じる（次に使うときに作り直される）"""
+        idle = []
+        while not self._slots.empty():
+            idle.append(self._slots.get_nowait())
+        for slot in idle:
+            if slot['page'] is not None:
+                try:
+                    await slot['page'].close()
+                except Exception:
+                    pass
+            slot['page'] = None
+            slot['uses'] = 0
+            self._slots.put_nowait(slot)
+
+    async def _wait_for_memory(self):
+        """
+        コンテナ内の Chromium にもう1ページ分の余裕ができるまで待つ。
+        ほかのボットのジョブが描画中ならその終了を待ち、自分の空きページが原因なら閉じて空ける
+        """
+        started = time.monotonic()
+        warned = False
+        while True:
+            used = await self._measure(render_memory.chromium_mb)
+            if used is None or used + render_memory.PAGE_MB <= self.mem_budget:
+                return
+            if self._in_flight == 0 and not warned:
+                await self._close_idle_pages()
+            waited = time.monotonic() - started
+            if waited >= MEM_WAIT:
+                print(f"[WARN] chromium uses {used:.0f} MB (budget {self.mem_budget} MB); rendering anyway after {waited:.0f}s")
+                return
+            if not warned:
+                print(f"[DEBUG] chromium uses {used:.0f} MB (budget {self.mem_budget} MB); waiting for memory")
+                warned = True
+            await asyncio.sleep(0.5)
+
+    async def _with_page(self, fn, timeout=RENDER_TIMEOUT):
+        if self._slots is None:
+            self._slots = asyncio.Queue()
+            for _ in range(self.size):
+                self._slots.put_nowait({'page': None, 'uses': 0})
+        if self.mem_budget:
+            # ページを開く前に待つ（開いたページの分まで数えてしまわないように）
+            await self._wait_for_memory()
+        slot = await self._acquire()
+        ok = False
+        recycle = False
+        sampler = None
+        try:
+            self._in_flight += 1
+            sampler = asyncio.ensure_future(self._sample_peak())
+            result = await asyncio.wait_for(fn(slot['page']), timeout)
+            ok = True
+            return result
+        finally:
+            # 測定がどうなっても、ページ（と予算の枠）は必ず返す
+            try:
+                if sampler is not None:
+                    self._in_flight -= 1
+                    sampler.cancel()
+                    peak = await self._sampled_peak(sampler)
+                    if peak is not None:
+                        self.peak_mb = peak
+                        budget = f" / budget {self.mem_budget} MB" if self.mem_budget else ""
+                        print(f"[DEBUG] render peak memory: {peak:.0f} MB{budget}")
+                        # 使い終わった時点で増えすぎていたら、このページ（のレンダラー）を作り直して返す
+                        recycle = bool(self.mem_budget) and peak > self.mem_budget * MEM_RECYCLE
+            finally:
+                await self._release(slot, ok, recycle)
+
+    @staticmethod
+    async def _sampled_peak(sampler):
+        """
+        取り消した _sample_peak の結果。始まる前に取り消された・測定で例外が出たときは None
+        （asyncio.wait は sampler の例外を投げないので、ここで投げるのは自分が取り消されたときだけ）
+        """
+        await asyncio.wait([sampler])
+        if sampler.cancelled():
+            return None
+        if sampler.exception() is not None:
+            print(f"[WARN] could not measure render memory: {sampler.exception()}")
+            return None
+        return sampler.result()
+
+    async def _sample_peak(self):
+        """キャンセルされるまで自分の Chromium の使用量を測り続け、最大値を返す"""
+        peak = None
+        try:
+            while True:
+                used = await self._measure()
+                if used is None:
+                    return None
+                peak = used if peak is None else max(peak, used)
+                await asyncio.sleep(MEM_SAMPLE_SEC)
+        except asyncio.CancelledError:
+            return peak
+
+    async def _shutdown(self):
+        if self._slots is not None:
+            while not self._slots.empty():
+                slot = self._slots.get_nowait()
+                if slot['page'] is not None:
+                    try:
+                        await slot['page'].close()
+                    except Exception:
+                        pass
+            self._slots = None
+        if self._browser is not None:
+            try:
+                await self._browser.close()
+            except Exception:
+                pass
+            self._browser = None
+        if self._pw is not None:
+            await self._pw.stop()
+            self._pw = None
+        self._launch_lock = None
+
+    # --- 公開API ---
+    def run_on_page(self, fn, timeout=RENDER_TIMEOUT):
+        """
+        fn(page) は async 関数。プールから借りたページで実行し、結果を返す。
+        timeout は fn 自体にかかる時間の上限で、ページやメモリの空き待ちの間は数えない
+        """
+        return self._run(self._with_page(fn, timeout))
+
+    def render_pdf(self, html, out_pdf_path=None, preview_path=None):
+        """
+        HTML文字列をそのままページに読み込んで PDF のバイト列を返す（一時HTMLファイルは作らない）。
+        out_pdf_path を渡すとアトミックに書き出す。preview_path を渡すと、同じページから
+        1ページ目のプレビュー画像（.png / .webp）も書き出す
+        """
+        async def _render(page):
+            # ホットページ（render_patched）で使っていたページも、ここで別の文書に置き換わる
+            page._hot_template = None
+            with perf.stage('page_load'):
+                await page.set_content(html, wait_until="load")
+            # フォントは data: URI で埋め込み済みなので、読み込み完了を待つだけでよい
+            with perf.stage('font_ready'):
+                await page.evaluate("document.fonts.ready")
+            # A4 portrait without headers/footers
+            with perf.stage('pdf_print'):
+                pdf = await page.pdf(format="A4", display_header_footer=False, print_background=True)
+            shot = await _screenshot_first_page(page) if preview_path else None
+            return pdf, shot
+        pdf_bytes, shot = self.run_on_page(_render)
+        if out_pdf_path:
+            with perf.stage('file_write'):
+                atomic_write(out_pdf_path, pdf_bytes)
+        if shot:
+            write_preview(preview_path, shot)
+        return pdf_bytes
+
+    def render_patched(self, template, slot_html, out_pdf_path=None, preview_path=None):
+        """
+        ホットページ方式: ページに同じテンプレートが読み込まれていれば、前回から変わった枠
+        （template.join(..., marked=True) の <!--slot:N--> の中身）だけをスクリプト1回で差し替えて印刷する。
+        別のテンプレートが載っているページ（または新しいページ）では一度だけ全体を読み込む
+        """
+        async def _render(page):
+            if getattr(page, '_hot_template', None) is not template:
+                page._hot_template = None
+                with perf.stage('page_load'):
+                    await page.set_content(template.join(slot_html, marked=True), wait_until="load")
+                    await page.evaluate(INDEX_SLOTS_JS)
+                page._hot_template, page._hot_slots = template, list(slot_html)
+                changed = {}
+            else:
+                changed = {str(i): v for i, v in enumerate(slot_html) if page._hot_slots[i] != v}
+                if changed:
+                    # 差し替え途中で失敗したページは作り直させる（_release がエラー時に捨てる）
+                    page._hot_template = None
+                    with perf.stage('page_load'):
+                        await page.evaluate(PATCH_SLOTS_JS, changed)
+                    page._hot_template, page._hot_slots = template, list(slot_html)
+            with perf.stage('font_ready'):
+                await page.evaluate("document.fonts.ready")
+            with perf.stage('pdf_print'):
+                pdf = await page.pdf(format="A4", display_header_footer=False, print_background=True)
+            shot = await _screenshot_first_page(page) if preview_path else None
+            return pdf, shot
+        pdf_bytes, shot = self.run_on_page(_render)
+        if out_pdf_path:
+            with perf.stage('file_write'):
+                atomic_write(out_pdf_path, pdf_bytes)
+        if shot:
+            write_preview(preview_path, shot)
+        return pdf_bytes
+
+    def close(self):
+        with self._lock:
+            loop = self._loop
+            self._loop = None
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), loop).result(30)
+        except Exception as e:
+            print(f"[WARN] render pool shutdown error: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join(5)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+# <!--slot:N--> と <!--/slot:N--> のコメントの組を探して覚えておく
+INDEX_SLOTS_JS = """() => {
+    const slots = {}, open = {};
+    const walker = document.createTreeWalker(document, NodeFilter.SHOW_COMMENT);
+    let node;
+    while ((node = walker.nextNode())) {
+        const m = /^(\\/?)slot:(\\d+)$/.exec(node.data);
+        if (!m) continue;
+        if (m[1]) slots[m[2]] = [open[m[2]], node];
+        else open[m[2]] = node;
+    }
+    window.__invoiceSlots = slots;
+    return Object.keys(slots).length;
+}"""
+
+# {番号: HTML} の枠の中身を置き換える。<template> でパースするので <tr> などもそのまま入る
+PATCH_SLOTS_JS = """(values) => {
+    const tmpl = document.createElement('template');
+    for (const [i, html] of Object.entries(values)) {
+        const [start, end] = window.__invoiceSlots[i];
+        while (start.nextSibling && start.nextSibling !== end) start.nextSibling.remove();
+        tmpl.innerHTML = html;
+        end.parentNode.insertBefore(tmpl.content, end);
+    }
+}"""
+
+
+async def _screenshot_first_page(page):
+    """
+    PDF と同じ見た目（印刷用CSS）で1ページ目の範囲だけを撮る。ページは使い回すので最後に元に戻す
+    """
+    viewport = page.viewport_size
+    w, h = A4_CSS_PX
+    await page.emulate_media(media="print")
+    await page.set_viewport_size({'width': w, 'height': h})
+    try:
+        return await page.screenshot(type="png", clip={'x': 0, 'y': 0, 'width': w, 'height': h})
+    finally:
+        await page.emulate_media(media="null")
+        if viewport:
+            await page.set_viewport_size(viewport)
+
+
+def write_preview(path, png_bytes, width=PREVIEW_WIDTH):
+    """
+    PNG のバイト列を width に縮小して path に書き出す（拡張子が .webp なら WebP）。
+    Pillow が無ければ縮小せずに PNG のまま書く
+    """
+    if Image is None:
+        atomic_write(os.path.splitext(path)[0] + ".png", png_bytes)
+        return
+    img = Image.open(io.BytesIO(png_bytes)).convert("RGB")
+    if img.width > width:
+        img = img.resize((width, round(img.height * width / img.width)), Image.LANCZOS)
+    buf = io.BytesIO()
+    if path.lower().endswith(".webp"):
+        img.save(buf, "WEBP", quality=80, method=4)
+    else:
+        img.save(buf, "PNG", optimize=True)
+    atomic_write(path, buf.getvalue())
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # POOL_SIZE は呼び出し側（bulk_invoice の --jobs など）が先に変えていることがある
+            _pool = RenderPool(size=POOL_SIZE)
+            atexit.register(_pool.close)
+        return _pool
+
+
+def close_pool():
+    """共有プールを閉じる。次の get_pool() で（その時の POOL_SIZE で）作り直される"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
+
+
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def atomic_write(path, data):
+    """
+    同じフォルダの一時ファイルに書いてから置き換える。途中で落ちても壊れたPDFが残らない
+    """
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", suffix=".tmp", dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        # mkstemp は 0600 で作るので、普通に open() したときと同じ権限に戻す
+        os.chmod(tmp_path, 0o666 & ~_UMASK)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def render_patched(template, slot_html, out_pdf_path=None, preview_path=None):
+    return get_pool().render_patched(template, slot_html, out_pdf_path, preview_path)
+
+
+def render_pdf(html, out_pdf_path=None, preview_path=None):
+    """
+    HTML文字列を A4 PDF に変換してバイト列を返す。全ての generate_pdf はここを通す
+    """
+    return get_pool().render_pdf(html, out_pdf_path, preview_path)
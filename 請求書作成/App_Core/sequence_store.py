@@ -0,0 +1,130 @@
+import os
+import sys
+import sqlite3
+import threading
+
+# 請求No・お支払いNoの連番を日付×系列ごとに払い出す小さな SQLite ストア。
+# 以前は出力フォルダの PDF を os.listdir で数えて採番していたため、同時に2件作ると同じ番号になったり、
+# PDF を消すと番号が再利用されたりしていた。ここでは BEGIN IMMEDIATE のトランザクション内で
+# カウンタを1つ進めるので、別プロセスから同時に呼ばれても番号は重複せず、常に増えていく。
+#
+# 系列（series）:
+#   ''           … batch_gen（YYYYMMDD-NN）と manual_invoice（YYYYMMDD-MNN）。同じ 請求書 フォルダに
+#                  出すので、以前のファイル数での採番と同じく1本の連番を分け合う（INVOICE_SERIES）
+#   'P'          … payment_notice（YYYYMMDD-PNN）
+#   'pick:<宛先>' … pick_invoice（宛先ごとに YYYYMMDD-PNN）
+# その日・その系列の最初の採番では seed() の値（既存ファイルから数えた使用済みの番号）から続ける。
+# 描画に失敗したときは release_last() で、そのスレッドが最後に取った番号を返す（その後に
+# 別の番号が払い出されていなければ、次の採番で同じ番号が使われるので欠番にならない）。
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(SCRIPT_DIR)
+OUT_DIR = os.environ.get("INVOICE_OUT_DIR") or os.path.join(BASE_DIR, "作成済み請求書")
+DB_PATH = os.environ.get("INVOICE_SEQ_DB") or os.path.join(OUT_DIR, ".sequences.sqlite3")
+
+BUSY_TIMEOUT = 30.0
+INVOICE_SERIES = ''
+
+# スレッドごとの「最後に払い出した番号」（release_last 用）
+_last = threading.local()
+
+
+def _connect(db_path=None):
+    db_path = db_path or DB_PATH
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    # isolation_level=None にして BEGIN を自分で発行する
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, isolation_level=None)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sequences (
+            series TEXT NOT NULL,
+            day    TEXT NOT NULL,
+            last   INTEGER NOT NULL,
+            PRIMARY KEY (series, day)
+        )
+    """)
+    return conn
+
+
+def next_number(series, day, seed=None, db_path=None):
+    """
+    series・day（'YYYYMMDD'）の次の番号（1始まり）を返す。
+    seed はその日初めての採番のときだけ呼ばれ、使用済みの最後の番号を返す関数
+    """
+    conn = _connect(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT last FROM sequences WHERE series = ? AND day = ?", (series, day)
+            ).fetchone()
+            if row is None:
+                last = int(seed()) if seed else 0
+                conn.execute(
+                    "INSERT INTO sequences (series, day, last) VALUES (?, ?, ?)", (series, day, last + 1)
+                )
+            else:
+                last = row[0]
+                conn.execute(
+                    "UPDATE sequences SET last = ? WHERE series = ? AND day = ?", (last + 1, series, day)
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        _last.value = (series, day, last + 1, db_path)
+        return last + 1
+    finally:
+        conn.close()
+
+
+def forget_last():
+    _last.value = None
+
+
+def release_last():
+    """
+    このスレッドが最後に next_number で取った番号を返す。その後に同じ系列で採番されていたら何もしない。
+    返せたら True
+    """
+    taken = getattr(_last, 'value', None)
+    _last.value = None
+    if taken is None:
+        return False
+    series, day, n, db_path = taken
+    conn = _connect(db_path)
+    try:
+        cur = conn.execute(
+            "UPDATE sequences SET last = ? WHERE series = ? AND day = ? AND last = ?", (n - 1, series, day, n)
+        )
+        return cur.rowcount == 1
+    finally:
+        conn.close()
+
+
+def format_number(day, prefix, n):
+    """format_number('20260218', 'M', 3) -> '20260218-M03'"""
+    return f"{day}-{prefix}{n:02}"
+
+
+def count_files(folder, prefix='', suffix='.pdf'):
+    """seed 用: 既存の採番方法と同じく、フォルダ内のファイル数を数える"""
+    try:
+        return sum(1 for f in os.listdir(folder) if f.startswith(prefix) and f.endswith(suffix))
+    except FileNotFoundError:
+        return 0
+
+
+if __name__ == "__main__":
+    # 現在のカウンタを表示する: python sequence_store.py [YYYYMMDD]
+    conn = _connect()
+    try:
+        if len(sys.argv) >= 2:
+            rows = conn.execute(
+                "SELECT day, series, last FROM sequences WHERE day = ? ORDER BY series", (sys.argv[1],)
+            ).fetchall()
+        else:
+            rows = conn.execute("SELECT day, series, last FROM sequences ORDER BY day, series").fetchall()
+    finally:
+        conn.close()
+    for day, series, last in rows:
+        print(f"{day}\t{series or '(batch)'}\t{last}")
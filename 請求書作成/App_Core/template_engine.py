@@ -0,0 +1,346 @@
+import os
+import re
+import html
+import math
+import threading
+import unicodedata
+
+import fonts
+import perf
+
+# テンプレートHTMLを「固定文字列」と「差し込み枠（slot）」の列に一度だけコンパイルし、
+# 以後は1回の結合だけで請求書HTMLを作るためのエンジン。
+# 印影(seal_b64.txt)とレイアウト調整(compact)はコンパイル時に焼き込む。
+# Google Fonts の <link> は font_face 枠になり、ローカルの Noto Sans JP があれば
+# その請求書で使う文字だけのサブセットを @font-face で埋め込む（fonts.py）。
+# テンプレート・印影ファイルの mtime が変わったら自動で作り直す。
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SEAL_PATH = os.path.join(SCRIPT_DIR, "seal_b64.txt")
+
+# テンプレート.html の差し込み位置（グループ1が差し替わる部分）
+SLOT_PATTERNS = [
+    ('font_face', re.compile(r'(<link href="https://fonts\.googleapis\.com/[^"]*" rel="stylesheet">)')),
+    ('recipient', re.compile(r'<div class="to-company"[^>]*>\s*<span>(.*?)</span>', re.DOTALL)),
+    ('invoice_no', re.compile(r'id="invoice-no">(.*?)<')),
+    ('issue_date', re.compile(r'<th>請求 日 :</th>\s*<td>(.*?)<', re.DOTALL)),
+    ('deadline', re.compile(r'\(\s*お支払い期限\s*\)</span>\s*<span>(.*?)</span>', re.DOTALL)),
+    ('total', re.compile(r'<div class="amount-value">\s*¥([0-9,]+)\s*-\s*</div>')),
+    ('total', re.compile(r'<div class="t-val">\s*¥([0-9,]+)\s*</div>')),
+]
+# <!-- ITEM_ROWS --> のようなマーカー（chinajun_template.html の全プレースホルダーもこれ）
+MARKER_PATTERN = re.compile(r'<!-- ([A-Z][A-Z_]*) -->')
+SEAL_SRC_PATTERN = re.compile(r'src="data:image/png;base64,[^"]*"')
+
+# batch_gen / pick_invoice で使っている1ページに収めるための微調整
+COMPACT_TWEAKS = [
+    ('font-size: 13px;', 'font-size: 11px;'),
+    ('font-size: 14px;', 'font-size: 12px;'),
+    ('margin-top: 40px;', 'margin-top: 20px;'),
+    ('margin-bottom: 30px;', 'margin-bottom: 20px;'),
+    ('padding: 12px;', 'padding: 8px;'),
+    ('height: 297mm;', 'height: 293mm;'),
+    ('width: 52%;', 'width: 58%;'),
+    ('width: 18%;', 'width: 15%;'),
+    ('width: 10%;', 'width: 6%;'),
+    ('width: 20%;', 'width: 21%;'),
+]
+
+
+class Raw(str):
+    """エスケープせずにそのまま差し込むHTML断片（明細行など）"""
+
+
+def escape(value):
+    if isinstance(value, Raw):
+        return value
+    return html.escape(str(value), quote=True)
+
+
+class Template:
+    def __init__(self, segments, slots, defaults):
+        # segments[i] の後ろに slots[i] が入る（len(segments) == len(slots) + 1）
+        self.segments = segments
+        self.slots = slots
+        self.defaults = defaults
+        self.slot_names = set(slots)
+        # テンプレート固定部分（と枠の元の内容）で使われている文字（フォントのサブセット用）
+        self.static_chars = frozenset(''.join(segments) + ''.join(defaults))
+
+    def resolve(self, values):
+        """
+        枠ごと（self.slots と同じ順）に差し込むHTMLのリストを返す。指定がない枠はテンプレートの元の内容のまま。
+        値は Raw でない限り HTML エスケープする
+        """
+        if 'font_face' in self.slot_names and 'font_face' not in values:
+            with perf.stage('font_subset'):
+                css = fonts.font_face_css(self.used_chars(values), self.static_chars)
+            if css:
+                values = dict(values, font_face=Raw(f'<style>\n{css}\n    </style>'))
+        return [escape(values[name]) if name in values else self.defaults[i]
+                for i, name in enumerate(self.slots)]
+
+    def fill(self, **values):
+        """名前付きの枠に値を差し込んだHTMLを返す"""
+        return self.join(self.resolve(values))
+
+    def join(self, slot_html, marked=False):
+        """
+        resolve() の結果をテンプレートに差し込む。marked=True なら各枠を
+        <!--slot:N-->…<!--/slot:N--> で囲み、読み込んだページ上で枠だけを差し替えられるようにする
+        """
+        parts = [self.segments[0]]
+        for i, html_part in enumerate(slot_html):
+            if marked:
+                parts.append(f'<!--slot:{i}-->{html_part}<!--/slot:{i}-->')
+            else:
+                parts.append(html_part)
+            parts.append(self.segments[i + 1])
+        return ''.join(parts)
+
+    def default(self, name):
+        """テンプレートに元から書かれている枠の値"""
+        return self.defaults[self.slots.index(name)]
+
+    def default_text(self, name):
+        """default() の HTML（&amp; など）を文字に戻したもの。escape() する所や PDF に直接描く所で使う"""
+        return html.unescape(self.default(name))
+
+    def fragment(self, pattern):
+        """テンプレートの固定部分から pattern に一致する部分を取り出す（明細表の <thead> など）"""
+        m = re.search(pattern, ''.join(self.segments), re.DOTALL)
+        return m.group(0) if m else ''
+
+    def used_chars(self, values):
+        chars = set(self.static_chars)
+        for v in values.values():
+            chars.update(str(v))
+        return chars
+
+
+def _read_seal():
+    try:
+        with open(SEAL_PATH, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except Exception as e:
+        print("Base64 injection error: ", e)
+        return None
+
+
+def compile_template(source, seal=None, compact=False):
+    if compact:
+        for old, new in COMPACT_TWEAKS:
+            source = source.replace(old, new)
+    if seal:
+        source = source.replace('SEAL_BASE64', seal.split(',', 1)[-1])
+        source = SEAL_SRC_PATTERN.sub(lambda m: f'src="{seal}"', source)
+
+    spans = []
+    for name, pattern in SLOT_PATTERNS:
+        for m in pattern.finditer(source):
+            spans.append((m.start(1), m.end(1), name))
+    for m in MARKER_PATTERN.finditer(source):
+        spans.append((m.start(), m.end(), m.group(1).lower()))
+    # 同じ位置から始まる枠は長い方（マーカー）を優先し、重なった枠は先に見つかった方を使う
+    spans.sort(key=lambda s: (s[0], -s[1]))
+
+    segments, slots, defaults = [], [], []
+    pos = 0
+    last_start = -1
+    for start, end, name in spans:
+        if start < pos or start == last_start:
+            continue
+        last_start = start
+        segments.append(source[pos:start])
+        slots.append(name)
+        # マーカーは空文字、それ以外はテンプレートに書かれている元の値を初期値にする
+        defaults.append('' if source.startswith('<!--', start) else source[start:end])
+        pos = end
+    segments.append(source[pos:])
+    return Template(segments, slots, defaults)
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def load_template(path, compact=False):
+    """
+    コンパイル済みテンプレートを返す。テンプレートか印影の mtime が変わっていれば読み直す
+    """
+    key = (os.path.abspath(path), compact)
+    stamp = (_mtime(path), _mtime(SEAL_PATH))
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit and hit[0] == stamp:
+            return hit[1]
+    with open(path, "r", encoding="utf-8") as f:
+        source = f.read()
+    tmpl = compile_template(source, seal=_read_seal(), compact=compact)
+    with _cache_lock:
+        _cache[key] = (stamp, tmpl)
+    return tmpl
+
+
+def invoice_row_values(it):
+    """
+    明細1行を (品名, 単価, 数量, 金額) に揃える。数値にできない値は既定値にする
+    """
+    try: qty_val = int(it.get("qty", 1))
+    except: qty_val = 1
+
+    try: total_val = int(it.get("total", 0))
+    except: total_val = 0
+
+    unit_val = it.get("unit")
+    if unit_val is None:
+        unit_val = total_val // qty_val if qty_val > 0 else 0
+    else:
+        try: unit_val = int(unit_val)
+        except: unit_val = 0
+    return it.get("name", ""), unit_val, qty_val, total_val
+
+
+def invoice_rows_html(items, min_rows=7):
+    """
+    テンプレート.html 用の明細行。min_rows 行に満たない分は空行で埋める
+    """
+    rows = []
+    total_rows = max(min_rows, len(items))
+    for i in range(total_rows):
+        cls = "even" if i % 2 == 0 else "odd"
+        if i < len(items):
+            name, unit_val, qty_val, total_val = invoice_row_values(items[i])
+            rows.append(f'''
+                <tr class="{cls}">
+                    <td>{escape(name)}</td>
+                    <td>{unit_val:,}</td>
+                    <td>{qty_val}</td>
+                    <td>{total_val:,}</td>
+                </tr>''')
+        else:
+            rows.append(f'''
+                <tr class="{cls}">
+                    <td>&nbsp;</td>
+                    <td></td>
+                    <td></td>
+                    <td></td>
+                </tr>''')
+    return Raw(''.join(rows))
+
+
+def signed_yen(value):
+    return f"{'−' if value < 0 else ''}¥{abs(value):,}"
+
+
+def payment_rows_html(items):
+    """
+    お支払い通知書用の明細行（マイナス金額は − 付きで表示）
+    """
+    rows = []
+    for it in items:
+        rows.append(f'''<tr>
+            <td class="name-col">{escape(it["name"])}</td>
+            <td>{signed_yen(it['unit'])}</td>
+            <td style="text-align:center;">{it["qty"]}</td>
+            <td>{signed_yen(it['total'])}</td>
+            <td></td>
+        </tr>\n''')
+    return Raw(''.join(rows))
+
+
+# ============================================================
+# 明細書モード（明細が1ページに収まらない請求書）
+# ============================================================
+def estimate_lines(text, font_px, width_px):
+    """品名が列幅で何行に折り返されるかの目安（全角は1文字 = font_px、半角はその約半分で数える）"""
+    w = 0.0
+    for ch in str(text):
+        w += font_px if unicodedata.east_asian_width(ch) in ('W', 'F', 'A') else font_px * 0.55
+    return max(1, math.ceil(w / width_px)) if width_px > 0 else 1
+
+
+def paginate(weights, first, per_page, reserve):
+    """
+    各行の高さ（1行 = 1.0）の列をページに分ける。1ページ目は first、以降は per_page 行分入り、
+    最終ページは合計欄とフッターのために reserve 行分空ける。[(開始, 終了), ...] を返す
+    """
+    pages = []
+    start, cap, n = 0, first, len(weights)
+    while True:
+        used, end = 0.0, start
+        while end < n and used + weights[end] <= cap - reserve:
+            used += weights[end]
+            end += 1
+        if end == n:
+            pages.append((start, n))
+            return pages
+        # 最終ページにはならないので、ページの最後まで詰める（最低1行は次のページに残す）
+        while end < n - 1 and used + weights[end] <= cap:
+            used += weights[end]
+            end += 1
+        if end == start and cap == per_page:
+            end += 1  # 1行だけでページを超える場合もそのまま載せる
+        pages.append((start, end))
+        start, cap = end, per_page
+
+
+def statement_row_cells(it, row_style='invoice'):
+    """明細書モード用の (品名, 単価, 数量, 金額の表示, 金額) """
+    if row_style == 'payment':
+        return it['name'], signed_yen(it['unit']), it['qty'], signed_yen(it['total']), it['total']
+    name, unit_val, qty_val, total_val = invoice_row_values(it)
+    return name, f"{unit_val:,}", qty_val, f"{total_val:,}", total_val
+
+
+def _carry_row(label, amount):
+    return f'''
+                <tr style="font-weight: bold; border-top: 1px solid #82b95b; border-bottom: 1px solid #82b95b;">
+                    <td>{escape(label)}</td>
+                    <td></td>
+                    <td></td>
+                    <td>{signed_yen(amount)}</td>
+                </tr>'''
+
+
+def statement_rows_html(items, pages, thead, caption, row_style='invoice'):
+    """
+    テンプレート.html の ITEM_ROWS に差し込む複数ページ分の明細。
+    ページの境目で表とページを閉じて次のページを開き、見出し行（thead）を繰り返す。
+    各ページの最後に「次頁へ繰越」、次のページの最初に「前頁より繰越」の小計行を入れる。
+    caption(ページ番号) は2ページ目以降の表の上に出す一行
+    """
+    rows = []
+    running = 0
+    for page_no, (start, end) in enumerate(pages, 1):
+        if page_no > 1:
+            rows.append(f'''
+            </tbody>
+        </table>
+    </div>
+    <div class="invoice-page" style="page-break-before: always;">
+        <div style="font-size: 13px; text-align: right;">{escape(caption(page_no))}</div>
+        <table class="items-list" style="margin-top: 10px;">
+            {thead}
+            <tbody>''')
+            rows.append(_carry_row('前頁より繰越', running))
+        for i in range(start, end):
+            name, unit, qty, total_str, total_val = statement_row_cells(items[i], row_style)
+            running += total_val
+            rows.append(f'''
+                <tr class="{"even" if i % 2 == 0 else "odd"}">
+                    <td>{escape(name)}</td>
+                    <td>{unit}</td>
+                    <td>{qty}</td>
+                    <td>{total_str}</td>
+                </tr>''')
+        if page_no < len(pages):
+            rows.append(_carry_row(f'小計（{page_no}頁 次頁へ繰越）', running))
+    return Raw(''.join(rows))
@@ -0,0 +1,66 @@
+import fonts
+import pytest
+from fontTools.fontBuilder import FontBuilder
+from fontTools.pens.ttGlyphPen import TTGlyphPen
+
+CHARS = [chr(c) for c in range(0x20, 0x7f)] + list('　請求書御中配送料梱包資材保管検品')
+
+
+@pytest.fixture
+def font_dir(tmp_path, monkeypatch):
+    """ASCII と少しの漢字だけを持つ小さなフォントを fonts/ に置く"""
+    names = ['.notdef'] + [f'u{ord(c):04X}' for c in CHARS]
+    fb = FontBuilder(1000, isTTF=True)
+    fb.setupGlyphOrder(names)
+    fb.setupCharacterMap({ord(c): f'u{ord(c):04X}' for c in CHARS})
+    glyphs = {}
+    for n in names:
+        pen = TTGlyphPen(None)
+        pen.moveTo((100, 0))
+        pen.lineTo((500, 700))
+        pen.lineTo((900, 0))
+        pen.closePath()
+        glyphs[n] = pen.glyph()
+    fb.setupGlyf(glyphs)
+    fb.setupHorizontalMetrics({n: (1000, 100) for n in names})
+    fb.setupHorizontalHeader(ascent=880, descent=-120)
+    fb.setupNameTable({'familyName': 'Noto Sans JP', 'styleName': 'Regular'})
+    fb.setupOS2()
+    fb.setupPost()
+    fb.save(str(tmp_path / 'NotoSansJP-Regular.ttf'))
+    monkeypatch.setattr(fonts, 'FONT_DIR', str(tmp_path))
+    monkeypatch.setattr(fonts, '_extra', {})
+    fonts._subset.cache_clear()
+    return tmp_path
+
+
+def test_unicode_range():
+    assert fonts._unicode_range(set('abc') | {'z', '請'}) == "U+61-63, U+7A, U+8ACB"
+
+
+def test_template_chars_are_subset_once_and_extra_chars_reuse_one_subset(font_dir):
+    template = frozenset('請求書御中')
+    css = fonts.font_face_css(template | set('配送料 12'), template)
+    assert css.count('@font-face') == 2
+    assert 'unicode-range: U+6599, U+9001, U+914D;' in css
+    # 前に出てきた文字だけなら、サブセットを作り直さない
+    before = fonts._subset.cache_info().misses
+    css = fonts.font_face_css(template | set('配送'), template)
+    assert fonts._subset.cache_info().misses == before
+    assert 'unicode-range: U+6599, U+9001, U+914D;' in css
+    # 新しい文字が来たら、今までの文字に足して作り直す
+    css = fonts.font_face_css(template | set('梱包'), template)
+    assert fonts._subset.cache_info().misses == before + 1
+    assert 'unicode-range: U+5305, U+6599, U+68B1, U+9001, U+914D;' in css
+
+
+def test_template_only_document_has_no_extra_face(font_dir):
+    template = frozenset('請求書御中')
+    assert fonts.font_face_css(template | set('123,-'), template).count('@font-face') == 1
+
+
+def test_extra_chars_start_over_above_the_limit(font_dir, monkeypatch):
+    monkeypatch.setattr(fonts, 'EXTRA_CHARS_MAX', 4)
+    fonts.font_face_css(set('配送料'))
+    css = fonts.font_face_css(set('梱包資'))
+    assert 'unicode-range: U+5305, U+68B1, U+8CC7;' in css
@@ -0,0 +1,82 @@
+
+import ledger
+import pytest
+
+
+@pytest.fixture
+def db(tmp_path):
+    return str(tmp_path / 'ledger.sqlite3')
+
+
+def _doc(number, recipient, issue, due='2024-02-29', kind='invoice', total=1000, **kw):
+    doc = {'number': number, 'kind': kind, 'recipient': recipient, 'issue_date': issue,
+           'due_date': due, 'total': total,
+           'items': [{'name': 'iPhone', 'unit': total, 'qty': 1, 'total': total}]}
+    doc.update(kw)
+    return doc
+
+
+def test_record_and_find(tmp_path, db):
+    ledger.record(_doc('20240131-01', '株式会社A', '2024-01-31 10:00:00'), str(tmp_path / 'a1.pdf'), db_path=db)
+    ledger.record(_doc('20240201-01', '株式会社A', '2024-02-01'), str(tmp_path / 'a2.pdf'), db_path=db)
+    ledger.record(_doc('20240205-01', '株式会社B商事', '2024-02-05'), str(tmp_path / 'b.pdf'), db_path=db)
+    ledger.record(_doc('20240210-P01', '株式会社A', '2024-02-10', kind='payment_notice', due=None),
+                  str(tmp_path / 'p.pdf'), db_path=db)
+
+    assert [r['number'] for r in ledger.find('株式会社A', db_path=db)] == \
+        ['20240131-01', '20240201-01', '20240210-P01']
+    assert [r['number'] for r in ledger.find('株式会社A', '2024-02', 'invoice', db_path=db)] == ['20240201-01']
+    assert [r['number'] for r in ledger.find('B', contains=True, db_path=db)] == ['20240205-01']
+    assert ledger.find('B', db_path=db) == []
+    # 日付は YYYY-MM-DD に揃え、明細も残る
+    first = ledger.find(month='2024-01', db_path=db)[0]
+    assert first['issue_date'] == '2024-01-31'
+    assert ledger.items_for(first['id'], db_path=db) == [{'name': 'iPhone', 'unit': 1000, 'qty': 1, 'total': 1000}]
+
+
+def test_record_replaces_same_path(tmp_path, db):
+    path = str(tmp_path / 'a.pdf')
+    ledger.record(_doc('20240131-01', '株式会社A', '2024-01-31', total=1000), path, db_path=db)
+    ledger.record(_doc('20240131-01', '株式会社A', '2024-01-31', total=2000), path, db_path=db)
+    rows = ledger.find(db_path=db)
+    assert [r['total'] for r in rows] == [2000]
+    assert [i['total'] for i in ledger.items_for(rows[0]['id'], db_path=db)] == [2000]
+
+
+def test_unpaid_and_mark_paid(tmp_path, db):
+    ledger.record(_doc('20240101-01', 'A', '2024-01-01', due='2024-01-31'), str(tmp_path / '1.pdf'), db_path=db)
+    ledger.record(_doc('20240201-01', 'A', '2024-02-01', due='2024-02-29'), str(tmp_path / '2.pdf'), db_path=db)
+    ledger.record(_doc('20240201-P01', 'A', '2024-02-01', kind='payment_notice', due=None),
+                  str(tmp_path / 'p.pdf'), db_path=db)
+
+    assert [r['number'] for r in ledger.unpaid(db_path=db)] == ['20240101-01', '20240201-01']
+    assert [r['number'] for r in ledger.unpaid(overdue=True, as_of='2024-02-15', db_path=db)] == ['20240101-01']
+    assert ledger.mark_paid('20240101-01', '2024-02-10', db_path=db) == 1
+    assert ledger.mark_paid('20240201-P01', db_path=db) == 0
+    assert [r['number'] for r in ledger.unpaid(db_path=db)] == ['20240201-01']
+
+
+def test_backfill_from_file_names(tmp_path, db):
+    root = tmp_path / 'out'
+    day = root / '2024-02-22'
+    (day / '請求書').mkdir(parents=True)
+    (day / 'お支払い通知書').mkdir()
+    for path in (day / '請求書' / '請求書_株式会社TUYOSHI御中_20240222_01.pdf',
+                 day / '請求書' / '請求書_株式会社A御中02月22日-3.pdf',
+                 day / '株式会社B御中02月22日-P02.pdf',
+                 day / 'お支払い通知書' / 'お支払い通知書_株式会社C御中_20240222_01.pdf',
+                 day / '請求書' / 'memo.pdf',
+                 root / 'misc' / '請求書_株式会社D御中_20240222_01.pdf'):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b'%PDF')
+
+    assert ledger.backfill(str(root), db_path=db) == 4
+    rows = {r['number']: r for r in ledger.find(db_path=db)}
+    assert set(rows) == {'20240222-M01', '20240222-03', '20240222-P02', '20240222-P01'}
+    assert rows['20240222-M01']['recipient'] == '株式会社TUYOSHI'
+    assert rows['20240222-P01']['kind'] == 'payment_notice'
+    assert rows['20240222-P02']['series'] == 'pick'
+    assert all(r['source'] == 'backfill' and r['issue_date'] == '2024-02-22' for r in rows.values())
+    # 2回目は登録済みのパスを飛ばす
+    assert ledger.backfill(str(root), db_path=db) == 0
+    assert ledger.backfill(str(tmp_path / 'missing'), db_path=db) == 0
@@ -0,0 +1,11 @@
+from datetime import datetime
+
+from manual_invoice import calc_deadline
+
+
+def test_calc_deadline():
+    assert calc_deadline('1', datetime(2024, 1, 30)) == datetime(2024, 2, 6)
+    assert calc_deadline('2', datetime(2024, 1, 30)) == datetime(2024, 1, 31)
+    # 翌月末（以前は当月末を返していた）
+    assert calc_deadline('3', datetime(2024, 1, 30)) == datetime(2024, 2, 29)
+    assert calc_deadline('3', datetime(2024, 12, 15)) == datetime(2025, 1, 31)
@@ -0,0 +1,29 @@
+from monthly_invoice import merge_items, month_bounds
+
+
+def test_merge_items_sums_same_name_and_unit():
+    rows = [
+        {'number': '20240201-01', 'name': 'iPhone 15', 'unit': 120000, 'qty': 2, 'total': 240000},
+        {'number': '20240201-01', 'name': 'AirPods', 'unit': 30000, 'qty': 1, 'total': 30000},
+        {'number': '20240205-01', 'name': 'iPhone 15', 'unit': 120000, 'qty': 1, 'total': 120000},
+        # 単価が違えば別の行
+        {'number': '20240205-01', 'name': 'iPhone 15', 'unit': 118000, 'qty': 1, 'total': 118000},
+        # 数量・金額が空の行は 0 として足す
+        {'number': '20240210-01', 'name': 'AirPods', 'unit': 30000, 'qty': None, 'total': None},
+    ]
+    items, sources = merge_items(rows)
+    assert items == [
+        {'name': 'iPhone 15', 'unit': 120000, 'qty': 3, 'total': 360000},
+        {'name': 'AirPods', 'unit': 30000, 'qty': 1, 'total': 30000},
+        {'name': 'iPhone 15', 'unit': 118000, 'qty': 1, 'total': 118000},
+    ]
+    assert sources == {'20240201-01', '20240205-01', '20240210-01'}
+
+
+def test_merge_items_empty():
+    assert merge_items(iter([])) == ([], set())
+
+
+def test_month_bounds():
+    assert month_bounds('2024-02') == ('2024-02-01', '2024-02-29')
+    assert month_bounds('2023-12') == ('2023-12-01', '2023-12-31')
@@ -0,0 +1,49 @@
+import os
+import time
+
+import ocr_cache
+import pytest
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(ocr_cache, 'CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(ocr_cache, 'ENABLED', True)
+    return tmp_path / 'cache'
+
+
+def test_put_and_get(cache_dir):
+    result = {'engine': 'v1', 'text': 'iPhone 1 159,800', 'words': [], 'skew': None}
+    assert ocr_cache.get(b'image', 'v1') is None
+    ocr_cache.put(b'image', 'v1', result)
+    assert ocr_cache.get(b'image', 'v1') == result
+    # エンジンのバージョンが変われば別のキー
+    assert ocr_cache.get(b'image', 'v2') is None
+
+
+def test_prune_keeps_other_writers_tmp_files(cache_dir):
+    os.makedirs(cache_dir)
+    busy = cache_dir / 'abc.json.123.456.tmp'
+    busy.write_bytes(b'x' * 100)
+    stale = cache_dir / 'old.json.1.2.tmp'
+    stale.write_bytes(b'x' * 100)
+    old = time.time() - ocr_cache.STALE_TMP_SEC - 60
+    os.utime(stale, (old, old))
+    for i in range(3):
+        (cache_dir / f'{i}.json').write_bytes(b'y' * 100)
+        os.utime(cache_dir / f'{i}.json', (old + i, old + i))
+    # 書き込み中の .tmp は数えないので、残す .json は 200 バイトまで = 2件
+    assert ocr_cache.prune(max_bytes=200) == 2
+    assert busy.exists() and not stale.exists()
+    assert sorted(p.name for p in cache_dir.glob('*.json')) == ['1.json', '2.json']
+
+
+def test_put_failure_only_warns(tmp_path, monkeypatch, capsys):
+    # CACHE_DIR がファイルなので書けない
+    blocker = tmp_path / 'cache'
+    blocker.write_text('not a directory')
+    monkeypatch.setattr(ocr_cache, 'CACHE_DIR', str(blocker))
+    monkeypatch.setattr(ocr_cache, 'ENABLED', True)
+    ocr_cache.put(b'image', 'v1', {'text': ''})
+    assert '[WARN] could not write the OCR cache' in capsys.readouterr().out
+    assert ocr_cache.get(b'image', 'v1') is None
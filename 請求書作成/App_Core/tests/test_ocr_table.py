@@ -0,0 +1,89 @@
+import math
+
+import numpy as np
+
+import ocr_table
+
+CHAR_W = 14
+HEIGHT = 20
+LINE_STEP = 40
+HEADER = [('品名', 80), ('数量', 420), ('単価', 540), ('金額', 690)]
+# (品名, 数量, 単価, 金額) と、数量・単価・金額の単語の右端
+ITEMS = [('ノートPC', '2', '120,000', '240,000'),
+         ('PlayStation5', '3', '66,980', '200,940'),
+         ('Switch', '1', '37,980', '37,980')]
+ITEM_RIGHT = (420, 560, 700)
+
+
+def _word(text, right, top):
+    left = right - CHAR_W * len(text)
+    return text, [(left, top), (right, top), (right, top + HEIGHT), (left, top + HEIGHT)]
+
+
+def _receipt(header=True, angle=0.0, split_comma=False):
+    """単語を右寄せで並べたレシート。angle（度）だけ紙を回す"""
+    words = []
+    top = 0
+    if header:
+        words += [_word(text, right, top) for text, right in HEADER]
+        top += LINE_STEP
+    for name, qty, unit, total in ITEMS:
+        words.append(_word(name, 40 + CHAR_W * len(name), top))
+        words.append(_word(qty, ITEM_RIGHT[0], top))
+        if split_comma and ',' in unit:
+            # 「66」「,980」のように1つの金額が2単語に分かれて読まれることがある
+            head, tail = unit.split(',', 1)
+            words.append(_word(head, ITEM_RIGHT[1] - CHAR_W * (len(tail) + 1), top))
+            words.append(_word(',' + tail, ITEM_RIGHT[1], top))
+        else:
+            words.append(_word(unit, ITEM_RIGHT[1], top))
+        words.append(_word(total, ITEM_RIGHT[2], top))
+        top += LINE_STEP
+    texts = [w[0] for w in words]
+    boxes = np.array([w[1] for w in words], dtype=float)
+    a = math.radians(angle)
+    rot = np.array([[math.cos(a), -math.sin(a)], [math.sin(a), math.cos(a)]])
+    return texts, boxes @ rot.T
+
+
+def _items(table):
+    return [(r['unit'], r['qty'], r['total']) for r in table if r is not None]
+
+
+EXPECTED = [(120000, 2, 240000), (66980, 3, 200940), (37980, 1, 37980)]
+
+
+def test_header_columns():
+    rows, table = ocr_table.read(*_receipt(header=True))
+    assert len(rows) == 4
+    assert _items(table) == EXPECTED
+    assert [r['name'] for r in table[1:]] == ['ノートPC', 'PlayStation5', 'Switch']
+
+
+def test_right_aligned_columns_without_header():
+    rows, table = ocr_table.read(*_receipt(header=False))
+    assert len(rows) == 3
+    assert _items(table) == EXPECTED
+    assert [r['name'] for r in table] == ['ノートPC', 'PlayStation5', 'Switch']
+
+
+def test_skewed_receipt():
+    for header in (True, False):
+        _, table = ocr_table.read(*_receipt(header=header, angle=4))
+        assert _items(table) == EXPECTED
+
+
+def test_number_split_into_two_words_is_joined():
+    for header in (True, False):
+        _, table = ocr_table.read(*_receipt(header=header, split_comma=True))
+        assert _items(table) == EXPECTED
+
+
+def test_rows_without_numbers():
+    texts, boxes = _receipt(header=False)
+    texts.append('ありがとうございました')
+    boxes = np.concatenate([boxes, np.array([[(40, 200), (320, 200), (320, 220), (40, 220)]], dtype=float)])
+    _, table = ocr_table.read(texts, boxes)
+    assert table[-1] is None
+    assert _items(table) == EXPECTED
+    assert ocr_table.extract([], np.zeros((0, 4, 2)), [[], []]) == [None, None]
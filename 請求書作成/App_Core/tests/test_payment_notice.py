@@ -0,0 +1,33 @@
+from payment_notice import compute_amounts, group_by_carrier
+
+
+def test_compute_amounts_other():
+    items = [{'name': 'iPhone', 'unit': 5000, 'qty': 2, 'total': 10000},
+             {'name': '送料', 'unit': -1000, 'qty': 1, 'total': -1000}]
+    out, total, tax_excl = compute_amounts('other', items)
+    assert out == items
+    assert total == 9000
+    assert tax_excl == 8181
+
+
+def test_compute_amounts_chinajun_adds_fee_row():
+    items = [{'name': 'iPhone', 'unit': 10101, 'qty': 1, 'total': 10101}]
+    out, total, tax_excl = compute_amounts('chinajun', items)
+    # 手数料は小計×0.02 の切り捨てをマイナスで足す
+    assert out[-1] == {'name': '手数料 全体×0.02', 'unit': -202, 'qty': 1, 'total': -202}
+    assert total == 9899
+    assert tax_excl == 8999
+    # 渡した明細は書き換えない
+    assert len(items) == 1
+
+
+def test_group_by_carrier_keeps_order_and_merges():
+    entries = [
+        {'destType': 'other', 'destName': '山田運送', 'items': [{'name': 'a'}]},
+        {'destType': 'chinajun', 'destName': 'ちなじゅん', 'items': [{'name': 'b'}]},
+        {'destName': ' 山田運送 ', 'items': [{'name': 'c'}]},
+        {'destType': 'chinajun', 'destName': '山田運送', 'items': [{'name': 'd'}]},
+    ]
+    groups = group_by_carrier(entries)
+    assert list(groups) == [('other', '山田運送'), ('chinajun', 'ちなじゅん'), ('chinajun', '山田運送')]
+    assert [it['name'] for it in groups[('other', '山田運送')]] == ['a', 'c']
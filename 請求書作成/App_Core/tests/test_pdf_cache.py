@@ -0,0 +1,95 @@
+import os
+import time
+
+import pdf_cache
+import pytest
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_cache, 'CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(pdf_cache, 'ENABLED', True)
+    return tmp_path / 'cache'
+
+
+def _doc(**kw):
+    doc = {
+        'kind': 'invoice', 'series': 'A', 'recipient': '株式会社サンプル',
+        'issue_date': '2024-05-31', 'due_date': '2024-06-30',
+        'items': [{'name': 'iPhone 15', 'unit': 120000, 'qty': 2, 'total': 240000}],
+        'total': 240000,
+    }
+    doc.update(kw)
+    return doc
+
+
+def test_request_key_normalizes_whitespace_numbers_and_dates():
+    base = pdf_cache.request_key(_doc(), 'v1', 'msg-1')
+    same = _doc(
+        recipient=' 株式会社サンプル　',
+        issue_date='2024-05-31 10:15:00', due_date='2024-06-30T00:00:00',
+        items=[{'name': ' iPhone 15 ', 'unit': '120000', 'qty': 2.0, 'total': '240000'}],
+    )
+    assert pdf_cache.request_key(same, 'v1', 'msg-1') == base
+    # 再送のキー・テンプレート・明細が違えば別の依頼
+    assert pdf_cache.request_key(_doc(), 'v1', 'msg-2') != base
+    assert pdf_cache.request_key(_doc(), 'v2', 'msg-1') != base
+    other = _doc(items=[{'name': 'iPhone 15', 'unit': 120000, 'qty': 3, 'total': 360000}])
+    assert pdf_cache.request_key(other, 'v1', 'msg-1') != base
+
+
+def _stored(cache_dir, tmp_path, key='k1', data=b'%PDF-1.4 original'):
+    out = tmp_path / 'out' / f'{key}.pdf'
+    out.parent.mkdir(exist_ok=True)
+    out.write_bytes(data)
+    pdf_cache.store(key, str(out), 'A-0001')
+    return out
+
+
+def test_lookup_hit(cache_dir, tmp_path):
+    out = _stored(cache_dir, tmp_path)
+    assert pdf_cache.lookup('k1') == (str(out), 'A-0001')
+
+
+def test_lookup_drops_entry_when_output_was_replaced(cache_dir, tmp_path):
+    out = _stored(cache_dir, tmp_path)
+    # 同じファイル名で別の請求書が作られた
+    out.write_bytes(b'%PDF-1.4 another invoice')
+    assert pdf_cache.lookup('k1') is None
+    assert not (cache_dir / 'k1.json').exists()
+    assert not (cache_dir / 'k1.pdf').exists()
+    assert out.read_bytes() == b'%PDF-1.4 another invoice'
+
+
+def test_lookup_rewrites_missing_output_from_copy(cache_dir, tmp_path):
+    out = _stored(cache_dir, tmp_path)
+    out.unlink()
+    assert pdf_cache.lookup('k1') == (str(out), 'A-0001')
+    assert out.read_bytes() == b'%PDF-1.4 original'
+
+
+def test_lookup_drops_entry_without_output_or_copy(cache_dir, tmp_path):
+    out = _stored(cache_dir, tmp_path)
+    out.unlink()
+    (cache_dir / 'k1.pdf').unlink()
+    assert pdf_cache.lookup('k1') is None
+    assert not (cache_dir / 'k1.json').exists()
+
+
+def test_prune_evicts_json_and_pdf_together(cache_dir):
+    os.makedirs(cache_dir / 'locks')
+    old = time.time() - 3600
+    for i, key in enumerate(('a', 'b', 'c')):
+        for ext in ('json', 'pdf'):
+            path = cache_dir / f'{key}.{ext}'
+            path.write_bytes(b'x' * 50)
+            os.utime(path, (old + i, old + i))
+    # a は .pdf だけ最近使われた → 新しい方の mtime で数えるので a は残る
+    os.utime(cache_dir / 'a.pdf')
+    busy = cache_dir / 'd.json.123.456.tmp'
+    busy.write_bytes(b'x' * 500)
+    # 書き込み中の .tmp は数えないので、残すのは 200 バイト = 2件
+    assert pdf_cache.prune(max_bytes=200) == 1
+    assert sorted(p.name for p in cache_dir.iterdir() if p.is_file()) == [
+        'a.json', 'a.pdf', 'c.json', 'c.pdf', 'd.json.123.456.tmp']
+    assert (cache_dir / 'locks').is_dir()
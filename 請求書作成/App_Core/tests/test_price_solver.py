@@ -0,0 +1,70 @@
+import price_solver
+
+
+def _picks(result):
+    return [(c['unit'], c['qty']) if c else None for c in result['choices']]
+
+
+def test_missing_comma_row_matches_subtotal():
+    # 「66,980」「200,940」のカンマが落ち、品名の「2.0」も数字列にくっついた行
+    rows = [price_solver.row_candidates("USB2.0ケーブル 3 66980200940"),
+            price_solver.row_candidates("マウス 1,200 2 2,400")]
+    result = price_solver.solve(rows, target=200940 + 2400)
+    assert _picks(result) == [(66980, 3), (1200, 2)]
+    assert result['matched'] and result['corrected'] is None
+    assert result['total'] == 203340
+
+
+def test_row_that_is_not_an_item_is_skipped():
+    # 会員番号の数字が 数量 2・単価 150・金額 300 とも読めてしまう行
+    rows = [price_solver.row_candidates("マウス 1,200 2 2,400"),
+            price_solver.row_candidates("会員番号 2 150300"),
+            price_solver.row_candidates("キーボード 3,000 1 3,000")]
+    assert rows[1][0]['score'] < 0.7
+    result = price_solver.solve(rows, target=5400)
+    assert _picks(result) == [(1200, 2), None, (3000, 1)]
+    assert result['matched']
+
+    # 小計に入っているなら捨てない
+    result = price_solver.solve(rows, target=5700)
+    assert _picks(result) == [(1200, 2), (150, 2), (3000, 1)]
+
+
+def test_comma_row_is_never_skipped():
+    rows = [price_solver.row_candidates("マウス 1,200 2 2,400"),
+            price_solver.row_candidates("キーボード 3,000 1 3,000")]
+    result = price_solver.solve(rows, target=3000)
+    assert None not in result['choices']
+    assert not result['matched']
+
+
+def test_quantity_is_corrected_to_match_subtotal():
+    # 数量の「2」を読み落とした行（単価と金額が同じに読めている）
+    rows = [price_solver.row_candidates("ケーブル 1,500 1,500"),
+            price_solver.row_candidates("マウス 1,200 2 2,400")]
+    result = price_solver.solve(rows, target=3000 + 2400)
+    assert _picks(result) == [(1500, 2), (1200, 2)]
+    assert result['matched'] and result['corrected'] == 0
+    assert result['choices'][0]['how'].endswith('+qty')
+    assert result['total'] == 5400
+    # 補正した結果は、そのまま合ったときより確からしさを下げる
+    exact = price_solver.solve(rows, target=1500 + 2400)
+    assert result['confidence'] < exact['confidence']
+
+
+def test_without_subtotal_uses_best_reading_of_each_row():
+    rows = [price_solver.row_candidates("USB2.0ケーブル 3 66980200940"),
+            price_solver.row_candidates("会員番号 2 150300"),
+            price_solver.row_candidates("マウス 1,200 2 2,400")]
+    result = price_solver.solve(rows)
+    # 小計が無ければ行は捨てず、各行の一番確からしい読み方をそのまま使う
+    assert _picks(result) == [(66980, 3), (150, 2), (1200, 2)]
+    assert not result['matched'] and result['corrected'] is None
+    assert result['total'] == 200940 + 300 + 2400
+    assert 0 < result['confidence'] <= 0.6
+
+
+def test_table_cells_take_priority():
+    cands = price_solver.row_candidates("ノートPC 120000 2 240000",
+                                        {'unit': 120000, 'qty': 2, 'total': 240000})
+    assert [(c['unit'], c['qty'], c['how']) for c in cands] == [(120000, 2, 'table')]
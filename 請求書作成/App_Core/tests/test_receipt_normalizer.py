@@ -0,0 +1,107 @@
+import json
+import random
+import re
+import unicodedata
+
+import price_solver
+import receipt_normalizer
+
+with open(receipt_normalizer.RULES_PATH, 'r', encoding='utf-8') as f:
+    RULES = json.load(f)
+
+ROWS = [
+    "Phone 15 Pro 128GB M FREE 1 159,800",
+    "APPLE iPhone15 SIM FREE 2 ¥ 159 , 800",
+    "nstax mini 12 チェキ 3 9,980 29,940",
+    "PIayStation5 SIi m CF ト2000A01 4548736146945 66,980 円",
+    "Ni ntendo Switch 有機EL  1  37,980",
+    "Nintend0 Switch Sli m 2 37,980 75,960",
+    "ＰＳ５ デジタル・エディション ２ ６６，９８０",
+    "小計 ¥293,680",
+    "レジ袋 3円",
+    # 1回の置換にまとめると結果が変わっていた行（ルールが重なる・前のルールの結果に次が当たる）
+    "switch SIiM FREE 1 29,800",
+    "ポケモン BOX 4521329312345, 12345678 5,500円",
+]
+FRAGMENTS = ["Phone", "iPhone", "M FREE", "SIM FREE", "nstax", "PIayStation", "SIi m", "Sli m",
+             "CF ト", "F ト", "Ni ntendo", "Nintend0", "  ", " ", ",", " , ", "¥", " 円", "円",
+             "4548736146945", "12345678", "66980", "1", "2", "ポケモン", "box", "小計"]
+
+
+def sequential(rules, text, flags=0):
+    """以前の書き方: ルールを上から1本ずつ re.sub する"""
+    for pattern, replacement in rules:
+        text = re.sub(pattern, replacement, text, flags=flags)
+    return text
+
+
+def old_normalize_row(row):
+    row = unicodedata.normalize('NFKC', row)
+    if not any(k in row.lower() for k in RULES['keywords']):
+        return None
+    name_clean = sequential(RULES['corrections'], row, re.I)
+    return name_clean, sequential(RULES['price_cleanup'], name_clean)
+
+
+def sample_rows(n=2000, seed=0):
+    rnd = random.Random(seed)
+    return [''.join(rnd.choice(FRAGMENTS) for _ in range(rnd.randint(1, 8))) for _ in range(n)]
+
+
+def test_compile_rules_matches_sequential_sub():
+    correct = receipt_normalizer.compile_rules(RULES['corrections'], re.I)
+    clean = receipt_normalizer.compile_rules(RULES['price_cleanup'])
+    for row in ROWS + sample_rows():
+        row = unicodedata.normalize('NFKC', row)
+        assert correct(row) == sequential(RULES['corrections'], row, re.I), row
+        assert clean(row) == sequential(RULES['price_cleanup'], row), row
+
+
+def test_normalize_row_matches_old_rules():
+    normalizer = receipt_normalizer.load()
+    for row in ROWS + sample_rows(seed=1):
+        assert normalizer.normalize_row(row) == old_normalize_row(row), row
+
+
+def test_examples():
+    normalizer = receipt_normalizer.load()
+    assert normalizer.normalize_row("Phone 15 Pro 128GB M FREE 1 159,800") == (
+        "iPhone 15 Pro 128GB SIM FREE 1 159,800", "iPhone 15 Pro 128GB SIM FREE 1 159,800")
+    assert normalizer.normalize_row("PIayStation5 SIi m CF ト2000A01 4548736146945 66,980 円")[1] == \
+        "PlayStation5 Slim CFI-2000A01  66,980円"
+    # 全角の英数字・カンマも NFKC でそろえてから照合する
+    assert normalizer.normalize_row("ＰＳ５ ２ ６６，９８０") == ("PS5 2 66,980", "PS5 2 66,980")
+    assert normalizer.normalize_row("小計 ¥293,680") is None
+
+
+def test_price_run_without_commas_is_kept():
+    # カンマが落ちた「66,980」「200,940」は JAN コードと違って消さず、price_solver に切り分けさせる
+    normalizer = receipt_normalizer.load()
+    _, row_clean = normalizer.normalize_row("PS5コントローラー 3 66980200940")
+    assert row_clean == "PS5コントローラー 3 66980200940"
+    cands = price_solver.row_candidates(row_clean)
+    assert (cands[0]['unit'], cands[0]['qty'], cands[0]['total']) == (66980, 3, 200940)
+    # 8〜12桁・14桁の数字列も残す。消すのは13桁の JAN コードだけ
+    assert normalizer.normalize_row("ポケモン 12345678 1")[1] == "ポケモン 12345678 1"
+    assert normalizer.normalize_row("ポケモン 45487361469450 1")[1] == "ポケモン 45487361469450 1"
+    assert normalizer.normalize_row("ポケモン 4548736146945 5,500")[1] == "ポケモン  5,500"
+
+
+def test_empty_rules_leave_text_alone():
+    assert receipt_normalizer.compile_rules([])("Phone  1") == "Phone  1"
+
+
+def test_keyword_automaton():
+    automaton = receipt_normalizer.KeywordAutomaton(["he", "she", "his", "hers", "ポケモン"])
+    assert automaton.search("ushers") == "she"
+    assert automaton.search("ahis") == "his"
+    assert automaton.search("ポケモンカード") == "ポケモン"
+    assert automaton.search("hx") is None
+    keywords = RULES['keywords']
+    automaton = receipt_normalizer.KeywordAutomaton(keywords)
+    for row in ROWS + sample_rows(seed=2):
+        row = unicodedata.normalize('NFKC', row).lower()
+        found = automaton.search(row)
+        assert (found is not None) == any(k in row for k in keywords), row
+        if found is not None:
+            assert found in row
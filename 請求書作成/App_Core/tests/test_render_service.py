@@ -0,0 +1,60 @@
+import asyncio
+
+import render_service
+
+
+class FakePage:
+    def __init__(self):
+        self.closed = False
+
+    def is_closed(self):
+        return self.closed
+
+    async def close(self):
+        self.closed = True
+
+
+def _pool(measure):
+    pool = render_service.RenderPool(size=1, mem_budget=0)
+
+    async def fake_measure(fn=None):
+        return measure()
+    pool._measure = fake_measure
+    return pool
+
+
+async def _render_twice(pool, fn):
+    # 1枚しかないページが返されていなければ、2回目は空きを待ったまま終わらない
+    pool._slots = asyncio.Queue()
+    pool._slots.put_nowait({'page': FakePage(), 'uses': 0})
+    first = await pool._with_page(fn)
+    second = await asyncio.wait_for(pool._with_page(fn), 1)
+    return first, second, pool._slots.qsize()
+
+
+def test_page_is_released_when_memory_sampling_fails():
+    def broken():
+        raise OSError("no /proc")
+
+    async def render(page):
+        await asyncio.sleep(0.01)
+        return 'pdf'
+    assert asyncio.run(_render_twice(_pool(broken), render)) == ('pdf', 'pdf', 1)
+
+
+def test_sampler_cancelled_before_it_started():
+    async def run():
+        pool = _pool(lambda: 100.0)
+        sampler = asyncio.ensure_future(pool._sample_peak())
+        sampler.cancel()
+        return await render_service.RenderPool._sampled_peak(sampler)
+    assert asyncio.run(run()) is None
+
+
+def test_peak_is_recorded():
+    async def render(page):
+        await asyncio.sleep(0.05)
+        return 'pdf'
+    pool = _pool(lambda: 120.0)
+    asyncio.run(_render_twice(pool, render))
+    assert pool.peak_mb == 120.0
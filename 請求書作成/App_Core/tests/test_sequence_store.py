@@ -0,0 +1,78 @@
+import threading
+
+import sequence_store
+
+
+def test_concurrent_next_number_never_repeats(tmp_path):
+    db = str(tmp_path / 'seq.sqlite3')
+    got, errors = [], []
+
+    def worker():
+        try:
+            for _ in range(10):
+                got.append(sequence_store.next_number('', '20240531', db_path=db))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    assert sorted(got) == list(range(1, 81))
+
+
+def test_seed_only_for_first_number_of_the_day(tmp_path):
+    db = str(tmp_path / 'seq.sqlite3')
+    calls = []
+
+    def seed():
+        calls.append(1)
+        return 4
+
+    assert sequence_store.next_number('P', '20240531', seed, db_path=db) == 5
+    assert sequence_store.next_number('P', '20240531', seed, db_path=db) == 6
+    assert calls == [1]
+    # 系列・日付が違えば別の連番
+    assert sequence_store.next_number('', '20240531', db_path=db) == 1
+    assert sequence_store.next_number('P', '20240601', db_path=db) == 1
+
+
+def test_release_last_reuses_number(tmp_path):
+    db = str(tmp_path / 'seq.sqlite3')
+    assert sequence_store.next_number('', '20240531', db_path=db) == 1
+    assert sequence_store.release_last()
+    # 2回目は何もしない
+    assert not sequence_store.release_last()
+    assert sequence_store.next_number('', '20240531', db_path=db) == 1
+
+
+def test_release_last_keeps_numbers_taken_by_other_threads(tmp_path):
+    db = str(tmp_path / 'seq.sqlite3')
+    assert sequence_store.next_number('', '20240531', db_path=db) == 1
+    other = threading.Thread(target=sequence_store.next_number, args=('', '20240531'), kwargs={'db_path': db})
+    other.start()
+    other.join()
+    # 別のスレッドが 2 を取ったあとなので 1 は返せない（2 を重複させない）
+    assert not sequence_store.release_last()
+    assert sequence_store.next_number('', '20240531', db_path=db) == 3
+
+
+def test_release_last_is_per_thread(tmp_path):
+    db = str(tmp_path / 'seq.sqlite3')
+    sequence_store.forget_last()
+    other = threading.Thread(target=sequence_store.next_number, args=('', '20240531'), kwargs={'db_path': db})
+    other.start()
+    other.join()
+    assert not sequence_store.release_last()
+    assert sequence_store.next_number('', '20240531', db_path=db) == 2
+
+
+def test_format_number_and_count_files(tmp_path):
+    assert sequence_store.format_number('20260218', 'M', 3) == '20260218-M03'
+    (tmp_path / 'a.pdf').write_bytes(b'')
+    (tmp_path / 'b.pdf').write_bytes(b'')
+    (tmp_path / 'c.png').write_bytes(b'')
+    assert sequence_store.count_files(str(tmp_path)) == 2
+    assert sequence_store.count_files(str(tmp_path / 'missing')) == 0
@@ -0,0 +1,115 @@
+import os
+
+import documents
+from template_engine import (Raw, Template, compile_template, escape, estimate_lines, load_template, paginate,
+                             statement_rows_html)
+
+
+def test_statement_caption_escapes_template_default_once():
+    # テンプレートに書かれている宛先は HTML のまま（&amp;）なので、キャプションでは文字に戻してから escape する
+    tmpl = Template(['<p>', '</p>'], ['recipient'], ['A&amp;B商事'])
+    doc = {'number': '20240531-01', 'recipient': None}
+    caption = documents.statement_caption(doc, tmpl)
+    assert caption(2) == '請求 No : 20240531-01　A&B商事 御中　（2頁）'
+    items = [{'name': 'iPhone', 'unit': 1000, 'qty': 1}] * 2
+    out = statement_rows_html(items, [(0, 1), (1, 2)], '', caption)
+    assert 'A&amp;B商事 御中' in out
+    assert '&amp;amp;' not in out
+
+
+SOURCE = '''<html><body>
+<div class="to-company" style="x"><span>サンプル商事</span> 御中</div>
+<p id="invoice-no">20240101-01</p>
+<div class="amount-value">¥1,000 -</div>
+<table><tbody><!-- ITEM_ROWS --></tbody></table>
+<div class="t-val">¥1,000</div>
+<p style="font-size: 13px;">振込先</p>
+</body></html>'''
+
+
+def test_compile_template_slots_and_defaults():
+    tmpl = compile_template(SOURCE)
+    assert tmpl.slots == ['recipient', 'invoice_no', 'total', 'item_rows', 'total']
+    assert tmpl.defaults == ['サンプル商事', '20240101-01', '1,000', '', '1,000']
+    assert len(tmpl.segments) == len(tmpl.slots) + 1
+    # 何も差し込まなければ元のHTML（マーカーだけ消える）
+    assert tmpl.fill() == SOURCE.replace('<!-- ITEM_ROWS -->', '')
+    assert '¥2,000' in tmpl.fill(total='2,000')
+    assert tmpl.fill(total='2,000').count('2,000') == 2
+
+
+def test_compile_template_compact_tweaks():
+    assert 'font-size: 11px;' in compile_template(SOURCE, compact=True).fill()
+    assert 'font-size: 13px;' in compile_template(SOURCE).fill()
+
+
+def test_fill_escapes_values_except_raw():
+    tmpl = compile_template(SOURCE)
+    out = tmpl.fill(recipient='<A&B>', item_rows=Raw('<tr><td>1</td></tr>'))
+    assert '<span>&lt;A&amp;B&gt;</span>' in out
+    assert '<tbody><tr><td>1</td></tr></tbody>' in out
+    assert escape('"x"') == '&quot;x&quot;'
+    assert escape(Raw('<b>')) == '<b>'
+
+
+def test_join_marked_wraps_each_slot():
+    tmpl = compile_template(SOURCE)
+    out = tmpl.join(tmpl.resolve({'invoice_no': '20240101-02'}), marked=True)
+    assert '<!--slot:1-->20240101-02<!--/slot:1-->' in out
+    assert '<!--slot:0-->サンプル商事<!--/slot:0-->' in out
+
+
+def test_load_template_recompiles_when_file_changes(tmp_path):
+    path = tmp_path / 'tmpl.html'
+    path.write_text(SOURCE, encoding='utf-8')
+    first = load_template(str(path))
+    assert load_template(str(path)) is first
+    path.write_text(SOURCE.replace('サンプル商事', '別の会社'), encoding='utf-8')
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1_000_000))
+    assert load_template(str(path)).default('recipient') == '別の会社'
+
+
+def test_estimate_lines():
+    assert estimate_lines('iPhone 15 Pro', 13, 310) == 1
+    assert estimate_lines('', 13, 310) == 1
+    # 全角24文字 = 312px なので2行、半角は約半分の幅
+    assert estimate_lines('あ' * 24, 13, 310) == 2
+    assert estimate_lines('a' * 43, 13, 310) == 1
+    assert estimate_lines('a' * 44, 13, 310) == 2
+    assert estimate_lines('あ' * 10, 13, 0) == 1
+
+
+def _check_pages(pages, weights, first, per_page, reserve):
+    assert pages[0][0] == 0 and pages[-1][1] == len(weights)
+    for (_, end), (start, _) in zip(pages, pages[1:]):
+        assert end == start
+    for i, (start, end) in enumerate(pages):
+        used = sum(weights[start:end])
+        cap = first if i == 0 else per_page
+        assert used <= (cap - reserve if i == len(pages) - 1 else cap)
+
+
+def test_paginate_fits_on_one_page_with_reserve():
+    assert paginate([1] * 9, 15, 20, 6) == [(0, 9)]
+
+
+def test_paginate_keeps_a_row_for_the_last_page():
+    # 合計欄の分が足りないので、1ページ目は詰められるだけ詰めて最低1行を次のページに残す
+    assert paginate([1] * 10, 15, 20, 6) == [(0, 9), (9, 10)]
+    assert paginate([1] * 16, 15, 20, 6) == [(0, 15), (15, 16)]
+    pages = paginate([1] * 30, 15, 20, 6)
+    assert pages == [(0, 15), (15, 29), (29, 30)]
+    _check_pages(pages, [1] * 30, 15, 20, 6)
+
+
+def test_paginate_wrapped_rows():
+    weights = [1, 1.45, 2.35, 1] * 10
+    pages = paginate(weights, 14, 18, 5)
+    _check_pages(pages, weights, 14, 18, 5)
+
+
+def test_paginate_row_taller_than_a_page():
+    pages = paginate([1, 30, 1], 15, 20, 6)
+    assert pages[0] == (0, 1)
+    assert (1, 2) in pages
+    assert pages[-1][1] == 3
@@ -4,5 +4,7 @@ chcp 65001 > nul
 cd /d "%~dp0\App_Core"
 
 echo 請求書を最新のデータからPDF化しています...
+rem 請求書用フォントが無ければ取ってくる（初回だけ。失敗しても続ける）
+C:\Users\Owner\AppData\Local\Programs\Python\Python312\python.exe fetch_fonts.py
 C:\Users\Owner\AppData\Local\Programs\Python\Python312\python.exe batch_gen.py
 pause
@@ -1,4 +1,6 @@
 @echo off
 cd /d "%~dp0\App_Core"
+rem fetch the invoice font on first run (continues even if it fails)
+"C:\Users\Owner\AppData\Local\Programs\Python\Python312\python.exe" fetch_fonts.py
 "C:\Users\Owner\AppData\Local\Programs\Python\Python312\python.exe" pick_invoice.py
 pause